@@ -0,0 +1,122 @@
+"""Converts a whole directory of raw CMM files to the standard file format without the GUI.
+
+Each raw file is matched by name to a row of a manifest CSV giving the serial number, module type,
+run number and operator, which are the values otherwise typed into the conversion GUIs:
+
+    file,serial_number,module_type,run_number,operator
+    20USEM20000014_XY_and_GlueHeight_MAR22.csv,20USEM20000014,M2,1,Peter Speers
+
+Usage:
+    python module_batch_file_conversion.py metrology module_metrology_data/raw_data/metrology --manifest shift.csv
+    python module_batch_file_conversion.py bow "module_metrology_data/raw_data/bow/*.csv" --manifest shift.csv --plots
+"""
+import argparse
+import contextlib
+import csv
+import glob
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import module_metrology as mm
+import module_metrology_file_conversion as metrology_conversion
+import module_bow_file_conversion as bow_conversion
+import module_stage_timing as stage_timing
+
+CONVERTERS = {'metrology': metrology_conversion, 'bow': bow_conversion}
+MANIFEST_FIELDS = ('file', 'serial_number', 'module_type', 'run_number', 'operator')
+
+def read_manifest(filename):
+    """Reads the manifest CSV and returns a dictionary of rows keyed by the raw file name."""
+    with open(filename, newline='') as csv_file:
+        reader = csv.DictReader(csv_file)
+        missing = [field for field in MANIFEST_FIELDS if field not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError('Manifest ' + filename + ' is missing the column(s): ' + ', '.join(missing))
+        manifest = dict()
+        for row in reader:
+            manifest[os.path.basename(row['file'].strip())] = {key: row[key].strip() for key in MANIFEST_FIELDS}
+    return manifest
+
+def find_raw_files(pattern):
+    """Returns the sorted list of raw files in a directory or matching a glob pattern."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.csv')
+    return sorted(file for file in glob.glob(pattern) if os.path.isfile(file))
+
+def preload_positions():
+    """Loads and validates the position files of all module types once per worker process."""
+    mm.load_position_registry(metrology_conversion.PATH_TO_POSITION_FILES)
+
+def convert_file(test, file, entry, plot=False, verbose=False):
+    """Converts one raw file to the standard file format. Runs in a worker process.
+    Returns the path of the written file."""
+    conversion = CONVERTERS[test]
+    output = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if verbose else output), stage_timing.module(entry['serial_number']):
+        converted = conversion.convert_cmm_file(file, entry['module_type'])
+        full_path = conversion.get_output_path(entry['serial_number'], entry['module_type'], entry['run_number'])
+        conversion.write_standard_file(full_path, converted, entry['serial_number'], entry['operator'], entry['run_number'])
+        if plot and test == 'bow':
+            conversion.save_bow_plot(converted, entry['serial_number'], entry['run_number'])
+    return full_path
+
+def convert_files(test, files, manifest, workers=None, plot=False, verbose=False):
+    """Converts the files on a process pool, printing the outcome of each file as it completes.
+    Returns a list of (file, output path or None, error message or None) tuples."""
+    outcomes = []
+    pending = dict()
+    with ProcessPoolExecutor(max_workers=workers, initializer=preload_positions) as executor:
+        for file in files:
+            entry = manifest.get(os.path.basename(file))
+            if entry is None:
+                outcomes.append((file, None, 'not in manifest'))
+                print('FAILED ' + file + ': not in manifest')
+                continue
+            pending[executor.submit(convert_file, test, file, entry, plot, verbose)] = file
+        for future in as_completed(pending):
+            file = pending[future]
+            try:
+                full_path = future.result()
+            except Exception as error:
+                outcomes.append((file, None, repr(error)))
+                print('FAILED ' + file + ': ' + repr(error))
+            else:
+                outcomes.append((file, full_path, None))
+                print('OK     ' + file + ' -> ' + full_path)
+    return outcomes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert raw CMM files to the standard file format.')
+    parser.add_argument('test', choices=sorted(CONVERTERS), help='type of measurement in the raw files')
+    parser.add_argument('input', help='directory of raw CSV files or a glob pattern')
+    parser.add_argument('--manifest', required=True, help='CSV with columns ' + ','.join(MANIFEST_FIELDS))
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPU count)')
+    parser.add_argument('--plots', action='store_true', help='also save the bow surface plots')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the conversion functions')
+    args = parser.parse_args(argv)
+
+    files = find_raw_files(args.input)
+    if not files:
+        print('No raw files found for ' + args.input)
+        return 1
+    manifest = read_manifest(args.manifest)
+    try:
+        preload_positions()
+    except (OSError, ValueError) as error:
+        print('Invalid position files: ' + str(error))
+        return 1
+
+    start = time.perf_counter()
+    outcomes = convert_files(args.test, files, manifest, args.workers, args.plots, args.verbose)
+    elapsed = time.perf_counter() - start
+
+    failures = [outcome for outcome in outcomes if outcome[2] is not None]
+    converted = len(outcomes) - len(failures)
+    print(f'Converted {converted} of {len(outcomes)} files in {elapsed:0.2f} s '
+          f'({len(outcomes)/elapsed:0.1f} files/s, {len(failures)} failed).')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+"""Uploads a whole directory of standard format files to the ITkDB without the GUI.
+
+Each file is processed exactly as in the upload GUIs. Files that do not match the definition of the test type
+in the ITkDB, or whose component is not at the institute or not in a stage with the test type, are rejected
+before anything is sent. The others are entered in the upload journal,
+then each test run is uploaded and its file attached as soon as the test run id comes back, with up to
+--concurrency modules in flight at once and at most --rate requests per second. Test runs already uploaded are
+skipped, and uploads left unfinished by a crash or a lost connection are finished with --resume. The passcodes
+are read from the ITKDB_ACCESS_CODE1 and ITKDB_ACCESS_CODE2 environment variables, or asked for.
+
+Usage:
+    python module_batch_upload.py metrology module_metrology_data/metrology_data
+    python module_batch_upload.py bow "module_metrology_data/bow_data/*.dat" --jig JIG1 --temperature 21 --stage GLUED
+    python module_batch_upload.py --resume --retry-failed
+"""
+import argparse
+import contextlib
+import getpass
+import glob
+import io
+import os
+import sys
+import threading
+import time
+import numpy as np
+from itkdb.settings import settings
+import module_itkdb_session as itkdb_session
+import module_upload_journal as upload_journal
+import module_upload_preflight as upload_preflight
+import module_upload_schema as upload_schema
+import module_metrology_upload as metrology_upload
+import module_bow_upload as bow_upload
+import module_stage_timing as stage_timing
+import module_results_index as results_index
+
+UPLOADERS = {'metrology': metrology_upload, 'bow': bow_upload}
+FILE_PATTERNS = {'metrology': '*_MODULE_METROLOGY_*.dat', 'bow': '*_MODULE_BOW_*.dat'} # Names given by the conversion scripts.
+STAGES = ('GLUED', 'FINISHED', 'STITCH_BONDING')
+CONCURRENCY = 4 # Modules uploaded at once.
+RATE_LIMIT = 10.0 #requests per second
+
+def find_data_files(test, pattern):
+    """Returns the sorted list of standard format files of a test in a directory, or matching a glob pattern."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, FILE_PATTERNS[test])
+    return sorted(file for file in glob.glob(pattern) if os.path.isfile(file))
+
+def get_rate_limiter(rate):
+    """Returns a function that blocks until the next request may be sent, so that requests from every thread
+    are spaced at least 1/rate seconds apart. A rate of None or 0 does not limit."""
+    lock = threading.Lock()
+    next_time = [time.monotonic()]
+    def wait():
+        if not rate:
+            return
+        with lock:
+            now = time.monotonic()
+            send_time = max(now, next_time[0])
+            next_time[0] = send_time + 1.0/rate
+        time.sleep(max(0.0, send_time - now))
+    return wait
+
+def build_payload(test, file, problems=False, stage=None, jig='', temperature='', record=True, index_path=None):
+    """Returns the data dictionary for the upload of a file with the options otherwise chosen in the GUI. Its
+    results are entered in the results index at index_path (by default the results index) if record."""
+    uploader = UPLOADERS[test]
+    with stage_timing.module(stage_timing.get_module_name(file)):
+        data, _, _ = uploader.build_data_dict(file)
+        data['passed'], _ = uploader.evaluate_test(data)
+    if record:
+        results_index.record(data, path=index_path)
+    data['problems'] = problems
+    if stage is not None:
+        data['isRetroactive'] = True
+        data['stage'] = stage
+    else:
+        data['isRetroactive'] = False
+    if test == 'bow':
+        data['properties']['JIG'] = jig
+        data['results']['TEMPERATURE'] = temperature
+    return data
+
+def upload_files(test, files, client, options, concurrency=CONCURRENCY, rate=RATE_LIMIT, verbose=False, connection=None,
+                 preflight=True, record=True, index_path=None):
+    """Processes the files, checks them against their test type and their components in the ITkDB (if preflight),
+    enters them in the upload journal and uploads them on a thread pool, printing the outcome of each file as it completes. Test runs
+    the journal has already completed are skipped. The results are entered in the results index at index_path if
+    record. Returns a list of (file, test run id or None, seconds taken or None, error message or None) tuples."""
+    connection = connection or upload_journal.open_journal()
+    outcomes = []
+    data_dicts = []
+    for file in files:
+        try:
+            with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+                data = build_payload(test, file, record=record, index_path=index_path, **options)
+        except Exception as error:
+            outcomes.append((file, None, None, repr(error)))
+            print('FAILED ' + file + ': ' + repr(error))
+            continue
+        entry = upload_journal.get_entry(connection, upload_journal.get_key(data))
+        if entry is not None and entry['state'] == upload_journal.COMPLETED:
+            print('SKIP   ' + file + ': already uploaded as ' + entry['test_run'])
+            continue
+        data_dicts.append(data)
+
+    if data_dicts:
+        try:
+            test_type = upload_schema.get_test_type(client, data_dicts[0]['testType'])
+        except itkdb_session.UploadError as error:
+            print('Could not check the data against the test type: ' + str(error))
+            test_type = None
+        for data in list(data_dicts):
+            warnings = []
+            problems = upload_schema.validate_payload(data, test_type, warnings) if test_type is not None else []
+            if warnings:
+                print('WARNING ' + data['results']['FILE'] + ': ' + '; '.join(warnings))
+            if problems:
+                outcomes.append((data['results']['FILE'], None, None, '; '.join(problems)))
+                print('INVALID ' + data['results']['FILE'] + ': ' + '; '.join(problems))
+                data_dicts.remove(data)
+
+    if preflight and data_dicts:
+        try:
+            problems = upload_preflight.check_uploads(client, data_dicts, UPLOADERS[test].INSTITUTE)
+        except itkdb_session.UploadError as error:
+            print('Could not check the components before the upload: ' + str(error))
+            return outcomes + [(data['results']['FILE'], None, None, str(error)) for data in data_dicts]
+        for data, problem in zip(list(data_dicts), problems):
+            if problem is not None:
+                outcomes.append((data['results']['FILE'], None, None, problem))
+                print('REJECT ' + data['results']['FILE'] + ': ' + problem)
+                data_dicts.remove(data)
+
+    keys = []
+    for data in data_dicts:
+        upload_journal.enqueue(connection, data)
+        keys.append(upload_journal.get_key(data))
+    return outcomes + upload_journal.drain(connection, client, keys, concurrency, get_rate_limiter(rate))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Upload standard format files to the ITkDB.')
+    parser.add_argument('test', nargs='?', choices=sorted(UPLOADERS), help='type of measurement in the files')
+    parser.add_argument('input', nargs='?', help='directory of standard format files or a glob pattern')
+    parser.add_argument('--stage', choices=STAGES, default=None, help='upload retroactively to this stage')
+    parser.add_argument('--problems', action='store_true', help='mark every test run as having problems')
+    parser.add_argument('--jig', default='', help='jig used for the bow measurements')
+    parser.add_argument('--temperature', default='', help='temperature of the bow measurements')
+    parser.add_argument('--no-preflight', action='store_true', help='do not check the location and stage of the components first')
+    parser.add_argument('--resume', action='store_true', help='also finish the unfinished uploads in the journal')
+    parser.add_argument('--retry-failed', action='store_true', help='also retry the failed uploads in the journal')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help='modules uploaded at once (default: %(default)s)')
+    parser.add_argument('--rate', type=float, default=RATE_LIMIT, help='maximum requests per second, 0 for no limit (default: %(default)s)')
+    parser.add_argument('--api-url', default=None, help='ITkDB server (default: the itkdb settings)')
+    parser.add_argument('--auth-url', default=None, help='ITkDB authentication server (default: the itkdb settings)')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the processing functions')
+    args = parser.parse_args(argv)
+
+    if (args.test is None or args.input is None) and not (args.resume or args.retry_failed):
+        parser.error('the test and input are required unless resuming')
+    if args.test == 'bow' and args.jig == '':
+        print('The jig must be given for bow uploads.')
+        return 1
+    files = find_data_files(args.test, args.input) if args.input is not None else []
+    if args.input is not None and not files:
+        print('No data files found for ' + args.input)
+        return 1
+
+    access_code1 = settings.ITKDB_ACCESS_CODE1 or getpass.getpass('Passcode 1: ')
+    access_code2 = settings.ITKDB_ACCESS_CODE2 or getpass.getpass('Passcode 2: ')
+    try:
+        client = itkdb_session.get_client(access_code1, access_code2, args.api_url, args.auth_url,
+                                          max(args.concurrency, itkdb_session.POOL_SIZE))
+    except Exception as error:
+        print('Set passcodes are incorrect: ' + str(error))
+        return 1
+
+    connection = upload_journal.open_journal()
+    start = time.perf_counter()
+    outcomes = []
+    if args.retry_failed:
+        upload_journal.reset_failed(connection)
+    if args.resume or args.retry_failed:
+        outcomes += upload_journal.drain(connection, client, upload_journal.get_unfinished_keys(connection),
+                                         args.concurrency, get_rate_limiter(args.rate))
+    options = {'problems': args.problems, 'stage': args.stage, 'jig': args.jig, 'temperature': args.temperature}
+    outcomes += upload_files(args.test, files, client, options, args.concurrency, args.rate, args.verbose, connection,
+                             not args.no_preflight)
+    elapsed = time.perf_counter() - start
+
+    latencies = [outcome[2] for outcome in outcomes if outcome[3] is None]
+    print(f'Uploaded {len(latencies)} of {len(outcomes)} modules in {elapsed:0.2f} s '
+          f'({len(latencies)/elapsed:0.2f} modules/s, {len(outcomes) - len(latencies)} failed).')
+    if latencies:
+        print(f'Latency per module: median {np.median(latencies):0.2f} s, max {max(latencies):0.2f} s.')
+    return 1 if len(latencies) < len(outcomes) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
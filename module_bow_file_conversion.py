@@ -1,186 +1,200 @@
-import csv
-import re
-import module_metrology as mm
-import tkinter as tk
-from tkinter import filedialog
-import matplotlib.pyplot as plt
-import numpy as np
-from matplotlib import cm
-from matplotlib.ticker import LinearLocator
-import os
-from pathlib import Path
-
-X_LIMIT = 0.1 #mm
-Y_LIMIT = 0.3 #mm
-INSTITUTE = 'SFU'
-INSTRUMENT = "Smartscope Flash 302"
-PATH_TO_DATA = 'module_metrology_data/'
-PATH_TO_POSITION_FILES = 'metrology_position_files/'
-SITE_TYPE = 'EC'
-PROGRAM_VERSION = 'Vancouver_LocalScript_Nov2025'
-X = 0
-Y = 1
-Z = 2
-ENTRY_X = 100
-ENTRY_Y = 20
-DATA_DICT = dict()
-
-def clear_data():
-    """Clears all data so one can start over"""
-    DATA_DICT.clear()
-    output_text.set('Please enter the database serial number, operator name and run number. Select the module type. '
-    'Look for a data file using the \'Find File\' button to import data from an appropriate CSV.' 
-    'If everything looks correct press \'Save Data\' to produce the standard file format.' )
-
-def get_file_data():
-    """Make the bow file in the standard file format"""
-    
-    if serial_number.get() == "" or run_num.get() == "" or module_box.curselection() == () :
-        output_text.set('Please ensure all mandatory values have been entered and a data file has been choosen. Then try again.')
-        return 
-
-    try:
-        file = filedialog.askopenfilename(title = 'Select Data File')
-        data_dict = mm.read_cmm_file(file)
-        data_dict = mm.tilt_correction(data_dict)
-        date = mm.get_date(file)
-
-        module_type = module_box.get(module_box.curselection()[0])
-
-    except:
-        output_text.set("Error in processing file. Likely an invalid file type.")
-        return
-
-    DATA_DICT['DATE'] = date
-    DATA_DICT['MODULE_TYPE'] = module_type.split('_')[0]
-    DATA_DICT['SENSOR'] = data_dict['Sensor']
-
-    output_text.set("File found and data parsed. Can now save to standard file format.")
-
-
-def save_data():
-    """Saves a metrology data file in the standard file format"""
-
-    if DATA_DICT == {}:
-        output_text.set("No data to upload. Please look for a valid data file and try again.")
-        return
-
-    # Determine the data file to write to.
-    module_ref = serial_number.get()
-    run_number = run_num.get()
-    module_type = module_box.get(module_box.curselection()[0])
-    file_prefix = module_ref + "_" + module_type + '_MODULE_BOW_'
-    path_to_save = PATH_TO_DATA + 'bow_data/'
-    local_path = mm.get_file_output(file_prefix, path_to_save, int(run_number))
-    full_path = os.path.dirname(os.path.abspath(__file__)) + '//' + local_path
-
-    #Open the data file and write to it.
-    file = open(full_path,'w+')
-    file.write('#---Header\n')
-    file.write('EC or Barrel: ' + SITE_TYPE + '\n')
-    file.write('Module type: ' + DATA_DICT['MODULE_TYPE'] + '\n')
-    file.write('Module ref. Number: ' + module_ref + '\n')
-    file.write('Date: ' + DATA_DICT['DATE'] + '\n')
-    file.write('Institute: ' + INSTITUTE + '\n')
-    file.write('Operator: ' + operator_display.get() + '\n')
-    file.write('Instrument type: ' + INSTRUMENT + '\n')
-    file.write('Run Number: ' + str(run_number) + '\n')
-    file.write('Measurement program version: ' + PROGRAM_VERSION + '\n')
-    file.write('#---Bow\n')
-    file.write('#Location X[mm] Y[mm] Z[mm]\n')
-    for point in DATA_DICT['SENSOR'] :
-        file.write(f'Sensor {point[X]:0.4f} {point[Y]:0.4f} {point[Z]:0.4f}\n')
-    file.close()
-    output_text.set('Output saved to ' + full_path)
-
-    sensor_x, sensor_y, sensor_z = [],[],[]
-
-    # produce plot of bow data 
-    for point in DATA_DICT['SENSOR']:
-        sensor_x.append(point[X])
-        sensor_y.append(point[Y])
-        sensor_z.append(point[Z])
-    # convert to numpy arrays
-    sensor_x = np.array(sensor_x)
-    sensor_y = np.array(sensor_y)
-    sensor_z = np.array(sensor_z)
-    
-    print(sensor_x)
-    print(sensor_y)
-    print(sensor_z)
-        
-    fig = plt.figure(figsize=(12,14))
-    ax = plt.axes(projection='3d')
-    # ax.scatter(sensor_x, sensor_y, sensor_z, c='blue', marker='o', s=50) 
-    ax.plot_trisurf(sensor_x, sensor_y, sensor_z, vmin=sensor_z.min() * 2, cmap=cm.YlGnBu)
-    plt.title(module_ref)
-    ax.set_xlabel('[mm]')
-    ax.set_ylabel('[mm]')
-    ax.set_zlabel('[mm]')
-    fig.tight_layout()
-    fig.savefig(os.path.dirname(os.path.abspath(__file__)) + '//module_metrology_data//bow_data//bow_plots//' + module_ref + '_' + run_number)
-    # fig.colorbar(surf, shrink=0.5, aspect=5)   
-    # plt.show()
-
-# GUI Definition
-root = tk.Tk()
-frame = tk.Frame(root, height = 450, width = 500)
-frame.pack()
-
-#Define String Variables of GUI
-serial_number = tk.StringVar()
-operator_display = tk.StringVar()
-
-run_num = tk.StringVar()
-output_text = tk.StringVar()
-
-#Define the boxes to dontain the string variables.
-title = tk.Label(frame, text = 'Module Bow CMM Parsing GUI', font = ('calibri', 18))
-title.place(x = 115, y = 10 )
-
-save_button = tk.Button(frame, text = "Save Data", command = lambda: save_data())
-save_button.place(x = ENTRY_X + 115, y = ENTRY_Y + 360)
-
-browser_button = tk.Button(frame, text = "Find File", command = lambda: get_file_data())
-browser_button.place(x = ENTRY_X + 300, y = ENTRY_Y + 40)
-
-clear_button = tk.Button(frame, text = "Clear Data", command = lambda: clear_data())
-clear_button.place(x = ENTRY_X + 300, y = ENTRY_Y + 100)
-
-module_label = tk.Label(frame, text='Sensor Type')
-module_label.place(x = ENTRY_X + 90, y = ENTRY_Y + 80)
-module_box = tk.Listbox(frame, width = 10, relief = 'groove', height = '9')
-module_box.place(x = ENTRY_X + 170, y = ENTRY_Y + 80)
-module_box.insert(0,"M0")
-module_box.insert(1,"M1")
-module_box.insert(2,"M2")
-module_box.insert(3,"3R")
-module_box.insert(4,"3L")
-module_box.insert(5,"4R")
-module_box.insert(6,"4L")
-module_box.insert(7,"5R")
-module_box.insert(8,"5L")
-
-id_label = tk.Label(frame, text='SN')
-id_label.place(x = ENTRY_X - 70, y = ENTRY_Y + 40)
-id_box = tk.Entry(frame, textvariable = serial_number, justify = 'left' , width = 20)
-id_box.place(x = ENTRY_X - 50 , y = ENTRY_Y + 40)
-
-run_num_label = tk.Label(frame, text='Run Number')
-run_num_label.place(x = ENTRY_X - 60, y = ENTRY_Y + 80)
-run_num_box = tk.Entry(frame, textvariable = run_num, justify = 'left' , width = 5)
-run_num_box.place(x = ENTRY_X + 15 , y = ENTRY_Y + 80)
-
-operator_label = tk.Label(frame, text='Operator')
-operator_label.place(x = ENTRY_X + 80, y = ENTRY_Y + 40)
-operator_box = tk.Entry(frame, textvariable = operator_display, justify = 'left', width = 20)
-operator_box.place(x = ENTRY_X + 135, y = ENTRY_Y + 40)
-
-output_text_box = tk.Message(frame, textvariable = output_text, font = ('calibri', 10), width = 344, relief = 'sunken', justify = 'left')
-output_text_box.place(x = ENTRY_X - 30, y = ENTRY_Y + 250)
-output_text.set('Please enter the database serial number, operator name and run number. Select the module type. '
-'Look for a data file using the \'Find File\' button to import data from an appropriate CSV.' 
-'If everything looks correct press \'Save Data\' to produce the standard file format.' )
-
-
-root.mainloop()
\ No newline at end of file
+import csv
+import re
+import module_metrology as mm
+import tkinter as tk
+from tkinter import filedialog
+import numpy as np
+import module_plot_renderer as plot_renderer
+import module_gui_tasks as gui_tasks
+import module_stage_timing as stage_timing
+import os
+from pathlib import Path
+
+X_LIMIT = 0.1 #mm
+Y_LIMIT = 0.3 #mm
+INSTITUTE = 'SFU'
+INSTRUMENT = "Smartscope Flash 302"
+PATH_TO_DATA = 'module_metrology_data/'
+PATH_TO_POSITION_FILES = 'metrology_position_files/'
+SITE_TYPE = 'EC'
+PROGRAM_VERSION = 'Vancouver_LocalScript_Nov2025'
+X = 0
+Y = 1
+Z = 2
+ENTRY_X = 100
+ENTRY_Y = 20
+DATA_DICT = dict()
+TASKS = None # The gui_tasks.TaskRunner of the window.
+
+def clear_data():
+    """Clears all data so one can start over"""
+    DATA_DICT.clear()
+    output_text.set('Please enter the database serial number, operator name and run number. Select the module type. '
+    'Look for a data file using the \'Find File\' button to import data from an appropriate CSV.' 
+    'If everything looks correct press \'Save Data\' to produce the standard file format.' )
+
+def convert_cmm_file(file, module_type):
+    """Reads a raw CMM file and corrects the tilt of the sensor points for the standard file format."""
+    data_dict = mm.read_cmm_file(file)
+    data_dict = mm.tilt_correction(data_dict)
+    return convert_data(data_dict, module_type, mm.get_date(file))
+
+def convert_data(data_dict, module_type, date):
+    """Collects the tilt corrected sensor points for the standard file format."""
+    converted = dict()
+    converted['DATE'] = date
+    converted['MODULE_TYPE'] = module_type.split('_')[0]
+    converted['SENSOR'] = data_dict['Sensor']
+    return converted
+
+def get_output_path(module_ref, module_type, run_number):
+    """Returns the full path of the standard format file for the module and run number."""
+    file_prefix = module_ref + "_" + module_type + '_MODULE_BOW_'
+    path_to_save = PATH_TO_DATA + 'bow_data/'
+    local_path = mm.get_file_output(file_prefix, path_to_save, int(run_number))
+    return os.path.dirname(os.path.abspath(__file__)) + '//' + local_path
+
+@stage_timing.traced('bow.write_standard_file')
+def write_standard_file(full_path, converted, module_ref, operator, run_number):
+    """Writes the converted data to a file in the standard file format"""
+    file = open(full_path,'w+')
+    file.write('#---Header\n')
+    file.write('EC or Barrel: ' + SITE_TYPE + '\n')
+    file.write('Module type: ' + converted['MODULE_TYPE'] + '\n')
+    file.write('Module ref. Number: ' + module_ref + '\n')
+    file.write('Date: ' + converted['DATE'] + '\n')
+    file.write('Institute: ' + INSTITUTE + '\n')
+    file.write('Operator: ' + operator + '\n')
+    file.write('Instrument type: ' + INSTRUMENT + '\n')
+    file.write('Run Number: ' + str(run_number) + '\n')
+    file.write('Measurement program version: ' + PROGRAM_VERSION + '\n')
+    file.write('#---Bow\n')
+    file.write('#Location X[mm] Y[mm] Z[mm]\n')
+    for point in converted['SENSOR'] :
+        file.write(f'Sensor {point[X]:0.4f} {point[Y]:0.4f} {point[Z]:0.4f}\n')
+    file.close()
+
+def save_bow_plot(converted, module_ref, run_number, background=False):
+    """Produces a surface plot of the bow data and saves it to the bow plots folder. In the background the
+    plot is rendered on the render pool and the future of its path is returned."""
+    sensor = np.asarray(converted['SENSOR'], dtype=float).reshape(-1, 3)
+    sensor_x, sensor_y, sensor_z = sensor[:, X], sensor[:, Y], sensor[:, Z]
+    path = os.path.dirname(os.path.abspath(__file__)) + '//module_metrology_data//bow_data//bow_plots//' + module_ref + '_' + str(run_number)
+    if background:
+        return plot_renderer.submit(plot_renderer.render_bow_surface, sensor_x, sensor_y, sensor_z, module_ref, path)
+    return plot_renderer.render_bow_surface(sensor_x, sensor_y, sensor_z, module_ref, path)
+
+def get_file_data():
+    """Make the bow file in the standard file format"""
+    
+    if serial_number.get() == "" or run_num.get() == "" or module_box.curselection() == () :
+        output_text.set('Please ensure all mandatory values have been entered and a data file has been choosen. Then try again.')
+        return 
+
+    file = filedialog.askopenfilename(title = 'Select Data File')
+    if file == '':
+        return
+    module_type = module_box.get(module_box.curselection()[0])
+
+    # Convert the file in the background.
+    output_text.set('Processing ' + os.path.basename(file) + '...')
+    TASKS.run('file', lambda task: convert_cmm_file(file, module_type), on_done=show_converted_data,
+              on_error=lambda error: output_text.set("Error in processing file. Likely an invalid file type."),
+              widgets=(browser_button, save_button))
+
+def show_converted_data(converted):
+    """Keeps the converted data of a file for saving. Called when the file has been converted."""
+    DATA_DICT.clear()
+    DATA_DICT.update(converted)
+
+    output_text.set("File found and data parsed. Can now save to standard file format.")
+
+
+def save_data():
+    """Saves a metrology data file in the standard file format"""
+
+    if DATA_DICT == {}:
+        output_text.set("No data to upload. Please look for a valid data file and try again.")
+        return
+
+    # Determine the data file to write to.
+    module_ref = serial_number.get()
+    run_number = run_num.get()
+    module_type = module_box.get(module_box.curselection()[0])
+    full_path = get_output_path(module_ref, module_type, run_number)
+
+    #Open the data file and write to it in the background.
+    converted = dict(DATA_DICT)
+    operator = operator_display.get()
+    TASKS.run('save', lambda task: write_standard_file(full_path, converted, module_ref, operator, run_number),
+              on_done=lambda _: output_text.set('Output saved to ' + full_path),
+              on_error=lambda error: output_text.set('Could not save the output: ' + repr(error)),
+              widgets=(browser_button, save_button))
+
+    save_bow_plot(DATA_DICT, module_ref, run_number, background=True)
+
+if __name__ == '__main__':
+    # GUI Definition
+    root = tk.Tk()
+    frame = tk.Frame(root, height = 450, width = 500)
+    frame.pack()
+    TASKS = gui_tasks.TaskRunner(root)
+
+    #Define String Variables of GUI
+    serial_number = tk.StringVar()
+    operator_display = tk.StringVar()
+
+    run_num = tk.StringVar()
+    output_text = tk.StringVar()
+
+    #Define the boxes to dontain the string variables.
+    title = tk.Label(frame, text = 'Module Bow CMM Parsing GUI', font = ('calibri', 18))
+    title.place(x = 115, y = 10 )
+
+    save_button = tk.Button(frame, text = "Save Data", command = lambda: save_data())
+    save_button.place(x = ENTRY_X + 115, y = ENTRY_Y + 360)
+
+    browser_button = tk.Button(frame, text = "Find File", command = lambda: get_file_data())
+    browser_button.place(x = ENTRY_X + 300, y = ENTRY_Y + 40)
+
+    clear_button = tk.Button(frame, text = "Clear Data", command = lambda: clear_data())
+    clear_button.place(x = ENTRY_X + 300, y = ENTRY_Y + 100)
+
+    module_label = tk.Label(frame, text='Sensor Type')
+    module_label.place(x = ENTRY_X + 90, y = ENTRY_Y + 80)
+    module_box = tk.Listbox(frame, width = 10, relief = 'groove', height = '9')
+    module_box.place(x = ENTRY_X + 170, y = ENTRY_Y + 80)
+    module_box.insert(0,"M0")
+    module_box.insert(1,"M1")
+    module_box.insert(2,"M2")
+    module_box.insert(3,"3R")
+    module_box.insert(4,"3L")
+    module_box.insert(5,"4R")
+    module_box.insert(6,"4L")
+    module_box.insert(7,"5R")
+    module_box.insert(8,"5L")
+
+    id_label = tk.Label(frame, text='SN')
+    id_label.place(x = ENTRY_X - 70, y = ENTRY_Y + 40)
+    id_box = tk.Entry(frame, textvariable = serial_number, justify = 'left' , width = 20)
+    id_box.place(x = ENTRY_X - 50 , y = ENTRY_Y + 40)
+
+    run_num_label = tk.Label(frame, text='Run Number')
+    run_num_label.place(x = ENTRY_X - 60, y = ENTRY_Y + 80)
+    run_num_box = tk.Entry(frame, textvariable = run_num, justify = 'left' , width = 5)
+    run_num_box.place(x = ENTRY_X + 15 , y = ENTRY_Y + 80)
+
+    operator_label = tk.Label(frame, text='Operator')
+    operator_label.place(x = ENTRY_X + 80, y = ENTRY_Y + 40)
+    operator_box = tk.Entry(frame, textvariable = operator_display, justify = 'left', width = 20)
+    operator_box.place(x = ENTRY_X + 135, y = ENTRY_Y + 40)
+
+    output_text_box = tk.Message(frame, textvariable = output_text, font = ('calibri', 10), width = 344, relief = 'sunken', justify = 'left')
+    output_text_box.place(x = ENTRY_X - 30, y = ENTRY_Y + 250)
+    output_text.set('Please enter the database serial number, operator name and run number. Select the module type. '
+    'Look for a data file using the \'Find File\' button to import data from an appropriate CSV.' 
+    'If everything looks correct press \'Save Data\' to produce the standard file format.' )
+
+
+    root.mainloop()
+    plot_renderer.shutdown() # Let the plots still being rendered finish.
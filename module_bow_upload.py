@@ -1,315 +1,435 @@
-"""This module is used to convert the data file to the raw data file for upload to the database."""
-import numpy as np
-import matplotlib.pyplot as plt
-from mpl_toolkits import mplot3d
-import math
-import itkdb
-import os
-import module_metrology as mm
-import tkinter as tk
-from tkinter import filedialog
-from tkinter.constants import DISABLED, NORMAL
-from tkinter import END
-
-# Institute Specific Constants - MODIFY THESE!
-INSTITUTE = 'SFU'
-INSTRUMENT = "Smartscope Flash 302"
-SITE_TYPE = 'EC'
-
-# Program Constants - Do not modify 
-PATH_TO_DATA = 'module_metrology_data/bow_data/'
-PROGRAM_VERSION = 'July2025'
-BOW_RANGE = (-50, 250) #um
-X = 0
-Y = 1
-Z = 2
-ENTRY_X = 100
-ENTRY_Y = 20
-DATA_DICT = dict()
-
-def round(number, decimal=2):
-    """Truncates a float to a value given by decimal. Default is 2 decimal places."""
-    factor = 10.0 ** decimal
-    return math.trunc(number * factor)/ factor
-
-def print_format(data):
-    """Formats for printing"""
-    output = ""
-    if type(data) == dict:
-        for key, values in data.items():
-            output += str(key) + ": " + str(values) + "\n"
-    else:
-        output = str(data)
-    return output
-
-def get_bow_results(lines):
-    """"Computes the bow of the module"""
-    results = dict()
-    index = 12
-
-    # Correct for tilt
-    raw_data_dict = dict()
-    for line in lines[index:] :
-        name, x, y ,z = line.split()
-        temp_list = raw_data_dict.get(name, [])
-        temp_list.append([float(x),float(y),float(z)])
-        raw_data_dict[name] = temp_list
-    data_dict = mm.tilt_correction(raw_data_dict)
-
-    # Determine the concavity
-    sensor_data = np.array(data_dict.get('Sensor'))
-    x = sensor_data[:,X]
-    y = sensor_data[:,Y]
-    z = sensor_data[:,Z]
-
-    mid_y = np.max(y)/2
-    mid_x = np.max(x)/2
-
-    min_index = 0
-    max_index = 0
-    min_value = 10000
-    max_value = -10000
-    for i in range(0,len(z)):
-        if z[i] > max_value:
-            max_value = z[i]
-            max_index = i
-        if z[i] < min_value:
-            min_value = z[i]
-            min_index = i
-    
-
-    d_max_value = math.sqrt((x[max_index] - mid_x)**2 + (y[max_index] - mid_y)**2)
-    d_min_value = math.sqrt((x[min_index] - mid_x)**2 + (y[min_index] - mid_y)**2)
-
-    #Concave Down
-    if d_max_value < d_min_value :
-        bow = (min_value - max_value)*1000
-    else:
-        bow = (max_value - min_value)*1000
-        
-    results["BOW"] = round(bow)
-
-    if BOW_RANGE[0] < bow < BOW_RANGE[1]:
-        DATA_DICT['passed'] = True
-        output_text.set("Bow passed! Press save to upload to database.")
-    else:
-        DATA_DICT['passed'] = False
-        output_text.set("Bow failed. Press save if you wish to upload.")
-
-    return results
-
-def get_file_data():
-    """Get the data from a file using the search function and format it into the standard JSON dictionary."""
-    # Clear everything (except the password) so that we can upload multiple files.
-    DATA_DICT.clear()
-    id_box.configure(state=NORMAL)
-    run_num_box.configure(state=NORMAL)
-    operator_box.configure(state=NORMAL)
-    bow_box.configure(state=NORMAL)
-    id_box.delete('1.0', END)
-    run_num_box.delete('1.0', END)
-    operator_box.delete('1.0', END)
-    bow_box.delete('1.0', END)
-    id_box.configure(state=DISABLED)
-    run_num_box.configure(state=DISABLED)
-    operator_box.configure(state=DISABLED)
-    bow_box.configure(state=DISABLED)
-
-    file = filedialog.askopenfilename(initialdir = PATH_TO_DATA, title = 'Select Data File')
-    
-    # Get the data from the file
-    with open(file) as data_file:
-        lines = data_file.readlines()
-    DATA_DICT["component"] = lines[3].split()[3]
-    DATA_DICT["testType"] = "MODULE_BOW"
-    # Added June 11 2025 - next 2 lines are for retroactive uploads
-    DATA_DICT["stage"] = "GLUED"
-    DATA_DICT["isRetroactive"] = True
-    ###
-    DATA_DICT["institution"] = lines[5].split()[1]
-    DATA_DICT["runNumber"] = str(lines[8].split()[2])
-    DATA_DICT["date"] = lines[4].split()[1]
-    DATA_DICT["passed"] = ""
-    DATA_DICT["problems"] = ""
-    properties = dict()
-    machine = lines[7].split()
-    operator = lines[6].split()
-    properties["JIG"] = ""
-    properties["OPERATOR"] = " ".join(operator[1:])
-    properties["USED_SETUP"] = " ".join(machine[2:])
-    properties["SCRIPT_VERSION"] = lines[9].split()[3] 
-    DATA_DICT["properties"] = properties 
-    DATA_DICT["results"] = get_bow_results(lines)
-    DATA_DICT["results"]["FILE"] = file
-    DATA_DICT["results"]["TEMPERATURE"] = ""
-    
-    # Update the output for the user.
-    id_box.configure(state=NORMAL)
-    run_num_box.configure(state=NORMAL)
-    operator_box.configure(state=NORMAL)
-    bow_box.configure(state=NORMAL)
-
-    id_box.insert('1.0', DATA_DICT["component"])
-    run_num_box.insert('1.0', DATA_DICT["runNumber"])
-    operator_box.insert('1.0', DATA_DICT["properties"]["OPERATOR"])
-    bow_box.insert('1.0', print_format(DATA_DICT["results"]["BOW"]))
-
-    id_box.configure(state=DISABLED)
-    run_num_box.configure(state=DISABLED)
-    operator_box.configure(state=DISABLED)
-    bow_box.configure(state=DISABLED)
-
-def save_data():
-    """Saves a metrology data file in the standard file format"""
-    if problems_box.curselection() == () or DATA_DICT == {} or jig.get() == "" or retroactive_box.curselection() == ():
-        output_text.set('Please ensure all mandatory values have been entered and a data file has been choosen. Then try again.')
-        return 
-    else:
-        if problems_box.get(problems_box.curselection()[0]) == "Yes":
-             DATA_DICT["problems"]  = True
-        else: 
-            DATA_DICT["problems"] = False
-    
-        if retroactive_box.get(retroactive_box.curselection()[0]) == "GLUED":
-            DATA_DICT["isRetroactive"] = True
-            DATA_DICT["stage"] = "GLUED"
-        elif retroactive_box.get(retroactive_box.curselection()[0]) == "FINISHED":
-            DATA_DICT["isRetroactive"] = True
-            DATA_DICT["stage"] = "FINISHED"  
-        elif retroactive_box.get(retroactive_box.curselection()[0]) == "STITCH-BONDING":
-            DATA_DICT["isRetroactive"] = True
-            DATA_DICT["stage"] = "STITCH_BONDING"        
-        else: 
-            DATA_DICT["isRetroactive"] = False 
-
-    print(DATA_DICT)
-    DATA_DICT['properties']['JIG'] = jig.get()
-    DATA_DICT["results"]['TEMPERATURE'] = temperature.get()
-
-    db_passcode_1 =  db_pass_1.get()
-    db_passcode_2 =  db_pass_2.get()
-
-    try :
-        user = itkdb.core.User(access_code1 = db_passcode_1, access_code2 = db_passcode_2)
-        client = itkdb.Client(user=user)
-    except:
-        output_text.set("Set passcodes are incorrect. Try again")
-        return
-    
-    result= client.post("uploadTestRunResults", json = DATA_DICT)
-
-    if (('uuAppErrorMap')=={}):
-        output_text.set('Upload of Test and File Successful!')
-    elif (('uuAppErrorMap'))[0]=='cern-itkpd-main/uploadTestRunResults/':
-        output_text.set("Error in Test Upload.")
-    elif list(('uuAppErrorMap'))[0]=='cern-itkpd-main/uploadTestRunResults/componentAtDifferentLocation':
-        output_text.set('Component cannot be uploaded as is not currently at the given location')
-    elif (('uuAppErrorMap'))[0]=='cern-itkpd-main/uploadTestRunResults/unassociatedStageWithTestType':
-        output_text.set('Component cannot be uploaded as the current stage does not have this test type. You will need to update the stage of the component on the ITK DB. Note that due to a bug on the ITK DB, you might also get this error if the component is not at your current location.')
-    elif (('uuAppErrorMap'))[0]!='cern-itkpd-main/uploadTestRunResults/':
-        output_text.set("Upload of Test Successful!")
-    else:
-        output_text.set('Error!')
-            
-    #upload the raw data file
-    if (('uuAppErrorMap')[0]!='cern-itkpd-main/uploadTestRunResults/'):
-        ###Upload the attached file!
-        testRun = result['testRun']['id']
-        file_path = DATA_DICT['results']['FILE']
-        file_name = os.path.basename(file_path)
-        dataforuploadattachment={
-                "testRun": testRun,
-                "type": "file",
-                "title": file_name, 
-                "description": "Automatic Attachment of Original Data File", 
-            }
-        attachment = {'data': (file_name, open(file_path, 'rb'), 'text')}
-        client.post("createTestRunAttachment", data = dataforuploadattachment, files = attachment)
-        output_text.set("Upload of test and attachment completed.")
- 
-
-# GUI Definition
-root = tk.Tk()
-frame = tk.Frame(root, height = 450, width = 500)
-frame.pack()
-
-jig = tk.StringVar()
-temperature = tk.StringVar()
-output_text = tk.StringVar()
-
-db_pass_1 = tk.StringVar()
-db_pass_2 = tk.StringVar()
-
-#Define the boxes to dontain the string variables.
-title = tk.Label(frame, text = 'Module Bow Upload GUI', font = ('calibri', 18))
-title.place(x = 115, y = 10 )
-
-save_button = tk.Button(frame, text = "Save Data", command = lambda: save_data())
-save_button.place(x = ENTRY_X + 110, y = ENTRY_Y + 275)
-
-browser_button = tk.Button(frame, text = "Find File", command = lambda: get_file_data())
-browser_button.place(x = ENTRY_X + 300, y = ENTRY_Y + 40)
-
-problems_label = tk.Label(frame, text='Problems?')
-problems_label.place(x = ENTRY_X + 60, y = ENTRY_Y + 120)
-problems_box = tk.Listbox(frame, width = 4, relief = 'groove', height = '2', exportselection=0)
-problems_box.place(x = ENTRY_X + 120, y = ENTRY_Y + 120)
-problems_box.insert(0,"Yes")
-problems_box.insert(1,"No")
-
-retroactive_label = tk.Label(frame, text='Retroactive Upload?')
-retroactive_label.place(x = ENTRY_X + 60, y = ENTRY_Y + 170)
-retroactive_box = tk.Listbox(frame, width = 20, relief = 'groove', height = '4', exportselection=0)
-retroactive_box.place(x = ENTRY_X + 60, y = ENTRY_Y + 190)
-retroactive_box.insert(0,"No")
-retroactive_box.insert(1,"GLUED")
-retroactive_box.insert(2,"FINISHED")
-retroactive_box.insert(2,"STITCH-BONDING")
-
-id_label = tk.Label(frame, text='SN')
-id_label.place(x = ENTRY_X - 70, y = ENTRY_Y + 40)
-id_box = tk.Text(frame, font = ('calibri', 10), width = 15, height = 1,  relief = 'sunken', state=DISABLED)
-id_box.place(x = ENTRY_X - 50 , y = ENTRY_Y + 40)
-
-run_num_label = tk.Label(frame, text='Run Number')
-run_num_label.place(x = ENTRY_X - 95, y = ENTRY_Y + 120)
-run_num_box = tk.Text(frame, font = ('calibri', 10), width = 5, height = 1, relief = 'sunken', state=DISABLED)
-run_num_box.place(x = ENTRY_X - 20 , y = ENTRY_Y + 120)
-
-temp_num_label = tk.Label(frame, text='Temperature')
-temp_num_label.place(x = ENTRY_X - 95, y = ENTRY_Y + 155)
-temp_num_box = tk.Entry(frame, textvariable = temperature, justify = 'left' , width = 5)
-temp_num_box.place(x = ENTRY_X - 20 , y = ENTRY_Y + 155)
-
-operator_label = tk.Label(frame, text='Operator')
-operator_label.place(x = ENTRY_X + 80, y = ENTRY_Y + 40)
-operator_box = tk.Text(frame, font = ('calibri', 10), width = 15, height = 1, relief = 'sunken', state=DISABLED)
-operator_box.place(x = ENTRY_X + 135, y = ENTRY_Y + 40)
-
-bow_label = tk.Label(frame, text='Bow (um)')
-bow_label.place(x = ENTRY_X - 95, y = ENTRY_Y + 80)
-bow_box = tk.Text(frame, font = ('calibri', 10), width = 20, height = 1,  relief = 'sunken',state=DISABLED)
-bow_box.place(x = ENTRY_X - 35 , y = ENTRY_Y + 80)
-
-jig_label = tk.Label(frame, text='Jig Used')
-jig_label.place(x = ENTRY_X + 120, y = ENTRY_Y + 80)
-jig_box = tk.Entry(frame, textvariable = jig, justify = 'left' , width = 30)
-jig_box.place(x = ENTRY_X + 170 , y = ENTRY_Y + 80)
-
-db_pass_1_label = tk.Label(frame, text="AccessCode 1")
-db_pass_1_label.place(x = ENTRY_X + 190, y = ENTRY_Y + 120)
-db_pass_1_box = tk.Entry(frame, textvariable = db_pass_1, show='*', justify = 'left', width = 15)
-db_pass_1_box.place(x = ENTRY_X + 270, y = ENTRY_Y + 120)
-
-db_pass_2_label = tk.Label(frame, text="AccessCode 2")
-db_pass_2_label.place(x = ENTRY_X + 190, y = ENTRY_Y + 150)
-db_pass_2_box = tk.Entry(frame, textvariable = db_pass_2, show='*',  justify = 'left', width = 15)
-db_pass_2_box.place(x = ENTRY_X + 270, y = ENTRY_Y + 150)
-
-output_text_box = tk.Message(frame, textvariable = output_text, font = ('calibri', 10), width = 344, relief = 'sunken', justify = 'left')
-output_text_box.place(x = ENTRY_X - 30, y = ENTRY_Y + 315)
-output_text.set(' Look for a data file using the \'Find File\' button to import data from an appropriate data file.'
-'Select \'Yes\' or \'No\' for if problems existed during testing and the jig used for the bow measurement.'
-'If everything looks correct press \'Save Data\' to upload to the database.' )
-
-root.mainloop()
\ No newline at end of file
+"""This module is used to convert the data file to the raw data file for upload to the database."""
+import numpy as np
+import hashlib
+import math
+import io
+import os
+import threading
+from collections import OrderedDict
+import module_metrology as mm
+import module_metrology_cache as cache
+import module_itkdb_session as itkdb_session
+import module_upload_journal as upload_journal
+import module_upload_schema as upload_schema
+import module_gui_tasks as gui_tasks
+import module_stage_timing as stage_timing
+import module_results_index as results_index
+import tkinter as tk
+from tkinter import filedialog
+from tkinter.constants import DISABLED, NORMAL
+from tkinter import END
+
+# Institute Specific Constants - MODIFY THESE!
+INSTITUTE = 'SFU'
+INSTRUMENT = "Smartscope Flash 302"
+SITE_TYPE = 'EC'
+
+# Program Constants - Do not modify 
+PATH_TO_DATA = 'module_metrology_data/bow_data/'
+PROGRAM_VERSION = 'July2025'
+BOW_RANGE = (-50, 250) #um
+X = 0
+Y = 1
+Z = 2
+ENTRY_X = 100
+ENTRY_Y = 20
+FIT_CACHE_SIZE = 64 # Grids whose quadratic fit factors are kept, a few hundred bytes each.
+LOCAL_RESULTS = ('BOW_FIT',) # Shown to the user but not in the MODULE_BOW test type, so not uploaded.
+DATA_DICT = dict()
+FIT_CACHE = OrderedDict()
+FIT_LOCK = threading.Lock()
+TASKS = None # The gui_tasks.TaskRunner of the window.
+
+def round(number, decimal=2):
+    """Truncates a float to a value given by decimal. Default is 2 decimal places."""
+    factor = 10.0 ** decimal
+    return math.trunc(number * factor)/ factor
+
+def print_format(data):
+    """Formats for printing"""
+    output = ""
+    if type(data) == dict:
+        for key, values in data.items():
+            output += str(key) + ": " + str(values) + "\n"
+    else:
+        output = str(data)
+    return output
+
+def get_bow_data(lines):
+    """Reads the tilt corrected sensor points from the lines of a standard format file."""
+    _, _, data_dict = mm.read_standard_file(lines)
+    return mm.tilt_correction(data_dict)
+
+def get_bow_results(lines):
+    """"Computes the bow of the module"""
+    return get_results_from_data(get_bow_data(lines))
+
+@stage_timing.traced('bow.get_results')
+def get_results_from_data(data_dict):
+    """Computes the bow of the module from the tilt corrected sensor points."""
+    results = dict()
+    sensor_data = np.asarray(data_dict.get('Sensor'), dtype=np.float64)
+    x = sensor_data[:,X]
+    y = sensor_data[:,Y]
+    z = sensor_data[:,Z]
+    results["BOW"] = round(get_extreme_bow(x, y, z, (np.max(x)/2, np.max(y)/2)))
+    return results
+
+def get_extreme_bow(x, y, z, centre):
+    """Returns the bow in um as the height between the highest and lowest of z, negative (concave down) when the
+    highest point is nearer the centre (x, y) than the lowest."""
+    max_index = np.argmax(z)
+    min_index = np.argmin(z)
+    max_value = z[max_index]
+    min_value = z[min_index]
+
+    d_max_value = math.sqrt((x[max_index] - centre[X])**2 + (y[max_index] - centre[Y])**2)
+    d_min_value = math.sqrt((x[min_index] - centre[X])**2 + (y[min_index] - centre[Y])**2)
+
+    #Concave Down
+    if d_max_value < d_min_value :
+        return (min_value - max_value)*1000
+    return (max_value - min_value)*1000
+
+def get_quadratic_design(x, y, scaling):
+    """Returns the (N,6) matrix of the terms 1, u, v, u^2, uv, v^2 of the quadratic surface over the points, in
+    the coordinates u, v centred and scaled by scaling = (x centre, y centre, x scale, y scale)."""
+    u = (x - scaling[0])/scaling[2]
+    v = (y - scaling[1])/scaling[3]
+    return np.column_stack((np.ones_like(u), u, v, u*u, u*v, v*v))
+
+def get_quadratic_fit(x, y):
+    """Returns (scaling, R) of the least squares fit of quadratic surfaces z = a + bx + cy + dx^2 + exy + fy^2
+    over the points: the centring and scale of the coordinates (see get_quadratic_design) and the (6,6) R
+    factor of the QR decomposition of the design matrix. They are computed once per grid of points and reused
+    for every scan on exactly the same grid, and only these few numbers are kept, never the design matrix."""
+    key = hashlib.sha1(np.ascontiguousarray(np.column_stack((x, y))).tobytes()).hexdigest()
+    with FIT_LOCK:
+        if key in FIT_CACHE:
+            FIT_CACHE.move_to_end(key)
+            return FIT_CACHE[key]
+    # Centred and scaled for a well conditioned fit.
+    scaling = (x.mean(), y.mean(), max(np.ptp(x), 1e-9), max(np.ptp(y), 1e-9))
+    r_factor = np.linalg.qr(get_quadratic_design(x, y, scaling), mode='r')
+    with FIT_LOCK:
+        FIT_CACHE[key] = (scaling, r_factor)
+        while len(FIT_CACHE) > FIT_CACHE_SIZE:
+            FIT_CACHE.popitem(last=False)
+    return scaling, r_factor
+
+@stage_timing.traced('bow.get_fitted_bow')
+def get_fitted_bow(data_dict):
+    """Computes the bow of the quadratic surface fitted to all of the tilt corrected sensor points, about the
+    centre of the points. Unlike the bow of the extreme points, single noisy points barely change it.
+    Returns None if there are too few points for a fit."""
+    sensor_data = np.asarray(data_dict.get('Sensor'), dtype=np.float64)
+    if len(sensor_data) < 6:
+        return None
+    x = sensor_data[:,X]
+    y = sensor_data[:,Y]
+    scaling, r_factor = get_quadratic_fit(x, y)
+    design = get_quadratic_design(x, y, scaling)
+    # R.T R = design.T design, so the normal equations are solved with two 6x6 solves.
+    coefficients = np.linalg.solve(r_factor, np.linalg.solve(r_factor.T, design.T @ sensor_data[:,Z]))
+    fitted = design @ coefficients
+    centre = ((np.min(x) + np.max(x))/2, (np.min(y) + np.max(y))/2)
+    return round(get_extreme_bow(x, y, fitted, centre))
+
+@stage_timing.traced('bow.evaluate_test')
+def evaluate_test(data):
+    """Checks the bow of a data dictionary against the range. Returns (passed, output message for the user)."""
+    if BOW_RANGE[0] < data['results']['BOW'] < BOW_RANGE[1]:
+        return True, "Bow passed! Press save to upload to database."
+    return False, "Bow failed. Press save if you wish to upload."
+
+def test_passed():
+    """Sets and returns whether the bow is within range and tells the user."""
+    DATA_DICT['passed'], output = evaluate_test(DATA_DICT)
+    output_text.set(output)
+    return DATA_DICT['passed']
+
+def get_processed_data(lines):
+    """Returns the tilt corrected points and the results of a standard format file, with the local results,
+    for the processing cache."""
+    data_dict = get_bow_data(lines)
+    results = get_results_from_data(data_dict)
+    results["BOW_FIT"] = get_fitted_bow(data_dict)
+    return data_dict, results
+
+def get_cache_constants():
+    """Returns the constants that the results depend on, used to key the processing cache."""
+    return {'TEST_TYPE': 'MODULE_BOW', 'LOCAL_RESULTS': LOCAL_RESULTS}
+
+@stage_timing.traced('bow.build_data_dict', stage_timing.describe_file)
+def build_data_dict(file, local_results=None):
+    """Reads a standard format bow file and returns (data dictionary for upload, cache key, cache hit).
+    The pass/fail and the upload options chosen by the user are not set. The results that are not uploaded
+    (LOCAL_RESULTS) are put in the local_results dictionary if one is given."""
+    with open(file, 'rb') as data_file:
+        contents = data_file.read()
+    text = contents.decode()
+    header = mm.read_standard_header(io.StringIO(text))
+    data = dict()
+    data["component"] = header['module ref. number']
+    data["testType"] = "MODULE_BOW"
+    # Added June 11 2025 - next 2 lines are for retroactive uploads
+    data["stage"] = "GLUED"
+    data["isRetroactive"] = True
+    ###
+    data["institution"] = header['institute']
+    data["runNumber"] = header['run number']
+    data["date"] = header['date']
+    data["passed"] = ""
+    data["problems"] = ""
+    properties = dict()
+    properties["JIG"] = ""
+    properties["OPERATOR"] = header['operator']
+    properties["USED_SETUP"] = header['instrument type']
+    properties["SCRIPT_VERSION"] = header['measurement program version']
+    data["properties"] = properties 
+    cache_key = cache.get_cache_key(contents, get_cache_constants())
+    _, results, cache_hit = cache.cached_processing(cache_key, lambda: get_processed_data(io.StringIO(text)))
+    for key in LOCAL_RESULTS:
+        value = results.pop(key, None)
+        if local_results is not None:
+            local_results[key] = value
+    data["results"] = results
+    data["results"]["FILE"] = file
+    data["results"]["TEMPERATURE"] = ""
+    return data, cache_key, cache_hit
+
+def get_file_data():
+    """Get the data from a file using the search function and format it into the standard JSON dictionary."""
+    # Clear everything (except the password) so that we can upload multiple files.
+    DATA_DICT.clear()
+    id_box.configure(state=NORMAL)
+    run_num_box.configure(state=NORMAL)
+    operator_box.configure(state=NORMAL)
+    bow_box.configure(state=NORMAL)
+    id_box.delete('1.0', END)
+    run_num_box.delete('1.0', END)
+    operator_box.delete('1.0', END)
+    bow_box.delete('1.0', END)
+    id_box.configure(state=DISABLED)
+    run_num_box.configure(state=DISABLED)
+    operator_box.configure(state=DISABLED)
+    bow_box.configure(state=DISABLED)
+
+    file = filedialog.askopenfilename(initialdir = PATH_TO_DATA, title = 'Select Data File')
+    if file == '':
+        return
+
+    # Read and process the file in the background.
+    output_text.set('Processing ' + os.path.basename(file) + '...')
+    TASKS.run('file', lambda task: process_file(task, file), on_done=show_file_data,
+              on_cancelled=lambda: output_text.set('Cancelled.'),
+              on_error=lambda error: output_text.set('Error in processing file: ' + repr(error)),
+              widgets=(browser_button, save_button))
+
+def process_file(task, file):
+    """Reads and processes a file. Runs in a worker thread. Returns (data dictionary, local results)."""
+    local_results = dict()
+    with stage_timing.module(stage_timing.get_module_name(file)):
+        data, _, _ = build_data_dict(file, local_results)
+    task.check_cancelled()
+    return data, local_results
+
+def show_file_data(result):
+    """Shows the data of a processed file. Called when the file has been processed."""
+    data, local_results = result
+    DATA_DICT.update(data)
+    test_passed()
+    results_index.record(DATA_DICT, local_results)
+    
+    # Update the output for the user.
+    id_box.configure(state=NORMAL)
+    run_num_box.configure(state=NORMAL)
+    operator_box.configure(state=NORMAL)
+    bow_box.configure(state=NORMAL)
+
+    id_box.insert('1.0', DATA_DICT["component"])
+    run_num_box.insert('1.0', DATA_DICT["runNumber"])
+    operator_box.insert('1.0', DATA_DICT["properties"]["OPERATOR"])
+    bow_box.insert('1.0', print_format(DATA_DICT["results"]["BOW"]) + ' (fit ' + print_format(local_results["BOW_FIT"]) + ')')
+
+    id_box.configure(state=DISABLED)
+    run_num_box.configure(state=DISABLED)
+    operator_box.configure(state=DISABLED)
+    bow_box.configure(state=DISABLED)
+
+def save_data():
+    """Saves a metrology data file in the standard file format"""
+    if problems_box.curselection() == () or DATA_DICT == {} or jig.get() == "" or retroactive_box.curselection() == ():
+        output_text.set('Please ensure all mandatory values have been entered and a data file has been choosen. Then try again.')
+        return 
+    else:
+        if problems_box.get(problems_box.curselection()[0]) == "Yes":
+             DATA_DICT["problems"]  = True
+        else: 
+            DATA_DICT["problems"] = False
+    
+        if retroactive_box.get(retroactive_box.curselection()[0]) == "GLUED":
+            DATA_DICT["isRetroactive"] = True
+            DATA_DICT["stage"] = "GLUED"
+        elif retroactive_box.get(retroactive_box.curselection()[0]) == "FINISHED":
+            DATA_DICT["isRetroactive"] = True
+            DATA_DICT["stage"] = "FINISHED"  
+        elif retroactive_box.get(retroactive_box.curselection()[0]) == "STITCH-BONDING":
+            DATA_DICT["isRetroactive"] = True
+            DATA_DICT["stage"] = "STITCH_BONDING"        
+        else: 
+            DATA_DICT["isRetroactive"] = False 
+
+    DATA_DICT['properties']['JIG'] = jig.get()
+    DATA_DICT["results"]['TEMPERATURE'] = temperature.get()
+
+    # Upload in the background, the window stays usable and the upload can be cancelled.
+    data_dict = dict(DATA_DICT)
+    db_passcode_1 =  db_pass_1.get()
+    db_passcode_2 =  db_pass_2.get()
+    TASKS.run('upload', lambda task: upload_data(task, data_dict, db_passcode_1, db_passcode_2),
+              on_done=output_text.set, on_progress=output_text.set,
+              on_cancelled=lambda: output_text.set("Upload cancelled."),
+              on_error=lambda error: output_text.set("Error in Test Upload: " + repr(error)),
+              widgets=(browser_button, save_button))
+
+def cancel_task():
+    """Cancels the processing or upload in progress. A step already sent to the ITkDB is finished first."""
+    if TASKS.is_running():
+        TASKS.cancel()
+        output_text.set("Cancelling...")
+
+def upload_data(task, data_dict, db_passcode_1, db_passcode_2):
+    """Uploads the test run and then the data file. Runs in a worker thread. Returns the message for the user."""
+    task.progress("Connecting to the ITkDB...")
+    try :
+        client = itkdb_session.get_client(db_passcode_1, db_passcode_2)
+    except:
+        return "Set passcodes are incorrect. Try again"
+    task.check_cancelled()
+
+    # Check the data against the test type first, so that an upload the ITkDB would refuse is not sent.
+    warnings = []
+    try:
+        problems = upload_schema.validate_payload(data_dict, upload_schema.get_test_type(client, data_dict["testType"]),
+                                                  warnings)
+    except itkdb_session.UploadError:
+        problems = [] # The upload itself will tell.
+    for warning in warnings:
+        print("Warning: " + warning)
+    if problems:
+        return "The data does not match the test type in the ITkDB:\n" + "\n".join(problems)
+    task.check_cancelled()
+
+    # Upload the test and then the data file, recording each step in the upload journal.
+    task.progress("Uploading...")
+    connection = upload_journal.open_journal()
+    try:
+        if upload_journal.enqueue(connection, data_dict) == upload_journal.COMPLETED:
+            return "This test run has already been uploaded."
+        key = upload_journal.get_key(data_dict)
+        upload_journal.drain(connection, client, [key], retry=False, cancelled=task.cancelled)
+        entry = upload_journal.get_entry(connection, key)
+    finally:
+        connection.close()
+    if entry['state'] == upload_journal.COMPLETED:
+        return "Upload of test and attachment completed."
+    elif entry['state'] in upload_journal.UNFINISHED and entry['test_run'] is None:
+        return "Upload cancelled before the test was sent."
+    elif entry['state'] in upload_journal.UNFINISHED:
+        return "Upload of Test Successful, but the attachment was cancelled. Press save to attach it."
+    elif entry['test_run'] is not None:
+        return "Upload of Test Successful, but not the attachment. Press save to try again.\n" + entry['last_error']
+    else:
+        return entry['last_error'].split(': ', 1)[1]
+
+if __name__ == '__main__':
+    # GUI Definition
+    root = tk.Tk()
+    frame = tk.Frame(root, height = 450, width = 500)
+    frame.pack()
+    TASKS = gui_tasks.TaskRunner(root)
+
+    jig = tk.StringVar()
+    temperature = tk.StringVar()
+    output_text = tk.StringVar()
+
+    db_pass_1 = tk.StringVar()
+    db_pass_2 = tk.StringVar()
+
+    #Define the boxes to dontain the string variables.
+    title = tk.Label(frame, text = 'Module Bow Upload GUI', font = ('calibri', 18))
+    title.place(x = 115, y = 10 )
+
+    save_button = tk.Button(frame, text = "Save Data", command = lambda: save_data())
+    save_button.place(x = ENTRY_X + 110, y = ENTRY_Y + 275)
+
+    cancel_button = tk.Button(frame, text = "Cancel", command = lambda: cancel_task())
+    cancel_button.place(x = ENTRY_X + 190, y = ENTRY_Y + 275)
+
+    browser_button = tk.Button(frame, text = "Find File", command = lambda: get_file_data())
+    browser_button.place(x = ENTRY_X + 300, y = ENTRY_Y + 40)
+
+    problems_label = tk.Label(frame, text='Problems?')
+    problems_label.place(x = ENTRY_X + 60, y = ENTRY_Y + 120)
+    problems_box = tk.Listbox(frame, width = 4, relief = 'groove', height = '2', exportselection=0)
+    problems_box.place(x = ENTRY_X + 120, y = ENTRY_Y + 120)
+    problems_box.insert(0,"Yes")
+    problems_box.insert(1,"No")
+
+    retroactive_label = tk.Label(frame, text='Retroactive Upload?')
+    retroactive_label.place(x = ENTRY_X + 60, y = ENTRY_Y + 170)
+    retroactive_box = tk.Listbox(frame, width = 20, relief = 'groove', height = '4', exportselection=0)
+    retroactive_box.place(x = ENTRY_X + 60, y = ENTRY_Y + 190)
+    retroactive_box.insert(0,"No")
+    retroactive_box.insert(1,"GLUED")
+    retroactive_box.insert(2,"FINISHED")
+    retroactive_box.insert(2,"STITCH-BONDING")
+
+    id_label = tk.Label(frame, text='SN')
+    id_label.place(x = ENTRY_X - 70, y = ENTRY_Y + 40)
+    id_box = tk.Text(frame, font = ('calibri', 10), width = 15, height = 1,  relief = 'sunken', state=DISABLED)
+    id_box.place(x = ENTRY_X - 50 , y = ENTRY_Y + 40)
+
+    run_num_label = tk.Label(frame, text='Run Number')
+    run_num_label.place(x = ENTRY_X - 95, y = ENTRY_Y + 120)
+    run_num_box = tk.Text(frame, font = ('calibri', 10), width = 5, height = 1, relief = 'sunken', state=DISABLED)
+    run_num_box.place(x = ENTRY_X - 20 , y = ENTRY_Y + 120)
+
+    temp_num_label = tk.Label(frame, text='Temperature')
+    temp_num_label.place(x = ENTRY_X - 95, y = ENTRY_Y + 155)
+    temp_num_box = tk.Entry(frame, textvariable = temperature, justify = 'left' , width = 5)
+    temp_num_box.place(x = ENTRY_X - 20 , y = ENTRY_Y + 155)
+
+    operator_label = tk.Label(frame, text='Operator')
+    operator_label.place(x = ENTRY_X + 80, y = ENTRY_Y + 40)
+    operator_box = tk.Text(frame, font = ('calibri', 10), width = 15, height = 1, relief = 'sunken', state=DISABLED)
+    operator_box.place(x = ENTRY_X + 135, y = ENTRY_Y + 40)
+
+    bow_label = tk.Label(frame, text='Bow (um)')
+    bow_label.place(x = ENTRY_X - 95, y = ENTRY_Y + 80)
+    bow_box = tk.Text(frame, font = ('calibri', 10), width = 20, height = 1,  relief = 'sunken',state=DISABLED)
+    bow_box.place(x = ENTRY_X - 35 , y = ENTRY_Y + 80)
+
+    jig_label = tk.Label(frame, text='Jig Used')
+    jig_label.place(x = ENTRY_X + 120, y = ENTRY_Y + 80)
+    jig_box = tk.Entry(frame, textvariable = jig, justify = 'left' , width = 30)
+    jig_box.place(x = ENTRY_X + 170 , y = ENTRY_Y + 80)
+
+    db_pass_1_label = tk.Label(frame, text="AccessCode 1")
+    db_pass_1_label.place(x = ENTRY_X + 190, y = ENTRY_Y + 120)
+    db_pass_1_box = tk.Entry(frame, textvariable = db_pass_1, show='*', justify = 'left', width = 15)
+    db_pass_1_box.place(x = ENTRY_X + 270, y = ENTRY_Y + 120)
+
+    db_pass_2_label = tk.Label(frame, text="AccessCode 2")
+    db_pass_2_label.place(x = ENTRY_X + 190, y = ENTRY_Y + 150)
+    db_pass_2_box = tk.Entry(frame, textvariable = db_pass_2, show='*',  justify = 'left', width = 15)
+    db_pass_2_box.place(x = ENTRY_X + 270, y = ENTRY_Y + 150)
+
+    output_text_box = tk.Message(frame, textvariable = output_text, font = ('calibri', 10), width = 344, relief = 'sunken', justify = 'left')
+    output_text_box.place(x = ENTRY_X - 30, y = ENTRY_Y + 315)
+    output_text.set(' Look for a data file using the \'Find File\' button to import data from an appropriate data file.'
+    'Select \'Yes\' or \'No\' for if problems existed during testing and the jig used for the bow measurement.'
+    'If everything looks correct press \'Save Data\' to upload to the database.' )
+
+    root.mainloop()
@@ -0,0 +1,88 @@
+"""Classifies the feature names of metrology data into the categories used for the results.
+
+All of the feature regexes are combined into one compiled pattern of optional lookaheads with named groups,
+so a single match finds every category a name belongs to. Decisions are memoized by name, so each name is
+only ever matched once per session, and every bin is sorted once in natural order.
+"""
+import re
+from functools import lru_cache
+import module_stage_timing as stage_timing
+
+HYBRID0_GT_REGEX = '_R[0-5]H0_[0-9]+'
+HYBRID1_GT_REGEX = '_R[0-5]H1_[0-9]+'
+PB_GT_REGEX = 'PB_[0-5]'
+PB_MOD_REGEX = 'PB_[0-4]' # Powerboard glue points used for the pass/fail average.
+ABC_REGEX = 'ABC'
+SHIELD_REGEX = 'Shield'
+CAP_REGEX = 'C[1-8]'
+
+# Categories, in the order of precedence used for the results.
+CAP = 'CAP'
+HYBRID0 = 'HYBRID0'
+HYBRID1 = 'HYBRID1'
+PB = 'PB'
+SHIELD = 'SHIELD'
+CATEGORIES = (CAP, HYBRID0, HYBRID1, PB, SHIELD)
+# Flags and subsets.
+ABC = 'ABC'
+PB_MOD = 'PB_MOD'
+ABC0 = 'ABC0'
+ABC1 = 'ABC1'
+HYBRID = 'HYBRID'
+GLUE = 'GLUE'
+
+FEATURE_REGEXES = {CAP: CAP_REGEX, HYBRID0: HYBRID0_GT_REGEX, HYBRID1: HYBRID1_GT_REGEX, PB: PB_GT_REGEX,
+                   SHIELD: SHIELD_REGEX, ABC: ABC_REGEX, PB_MOD: PB_MOD_REGEX}
+FEATURE_PATTERN = re.compile(''.join(f'(?:(?=.*?(?P<{name}>{regex})))?' for name, regex in FEATURE_REGEXES.items()))
+
+def atoi(text):
+    return int(text) if text.isdigit() else text
+
+@lru_cache(maxsize=None)
+def natural_keys(text):
+    '''
+    alist.sort(key=natural_keys) sorts in human order
+    http://nedbatchelder.com/blog/200712/human_sorting.html
+    (See Toothy's implementation in the comments)
+    '''
+    return tuple( atoi(c) for c in re.split(r'(\d+)', text) )
+
+@lru_cache(maxsize=None)
+def match_feature(name):
+    """Returns the frozenset of every category and flag whose regex is found in the feature name."""
+    return frozenset(group for group, value in FEATURE_PATTERN.match(name).groupdict().items() if value is not None)
+
+@lru_cache(maxsize=None)
+def classify_feature(name):
+    """Returns the category of the feature for the results, the first of CATEGORIES that matches, or None."""
+    matches = match_feature(name)
+    for category in CATEGORIES:
+        if category in matches:
+            return category
+    return None
+
+@stage_timing.traced('classify_features', lambda names: {'features': len(names)})
+def classify_features(names):
+    """Sorts feature names into bins. Returns a dictionary with a naturally sorted list of names for each of
+    CATEGORIES and for the subsets HYBRID (both hybrids), ABC0 and ABC1 (ABC chips of each hybrid), PB_MOD
+    (powerboard points used for the average) and GLUE (every hybrid or powerboard glue point, whatever its
+    category)."""
+    bins = {category: [] for category in CATEGORIES + (HYBRID, ABC0, ABC1, PB_MOD, GLUE)}
+    for name in names:
+        matches = match_feature(name)
+        category = classify_feature(name)
+        if category is not None:
+            bins[category].append(name)
+        if category == HYBRID0 or category == HYBRID1:
+            bins[HYBRID].append(name)
+        if category == HYBRID0 and ABC in matches:
+            bins[ABC0].append(name)
+        elif category == HYBRID1 and ABC in matches:
+            bins[ABC1].append(name)
+        elif category == PB and PB_MOD in matches:
+            bins[PB_MOD].append(name)
+        if HYBRID0 in matches or HYBRID1 in matches or PB in matches:
+            bins[GLUE].append(name)
+    for names_in_bin in bins.values():
+        names_in_bin.sort(key=natural_keys)
+    return bins
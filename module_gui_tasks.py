@@ -0,0 +1,116 @@
+"""Runs the slow work of the GUIs (reading and processing files, plotting and uploading) on worker threads.
+
+Tk may only be used from the thread running its main loop, so the work never touches the GUI. It reports its
+progress and result through a queue, which the main loop polls with after() and hands to the callbacks. The
+widgets a task affects are disabled while it runs. A task can be cancelled, and its work stops at the next
+check between steps.
+"""
+import queue
+import threading
+from tkinter.constants import DISABLED
+
+POLL_INTERVAL = 50 #ms
+
+class TaskCancelled(Exception):
+    """Raised in the work of a task that has been cancelled."""
+
+class Task:
+    """Work running on a worker thread. The work is called with its task, to report progress with progress()
+    and to stop early with check_cancelled()."""
+    def __init__(self, runner, name):
+        self.runner = runner
+        self.name = name
+        self.cancel_event = threading.Event()
+
+    def progress(self, message):
+        """Passes a progress message to the on_progress callback, on the Tk thread."""
+        self.runner.messages.put((self, 'progress', message))
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check_cancelled(self):
+        """Raises TaskCancelled if the task has been cancelled."""
+        if self.cancelled():
+            raise TaskCancelled(self.name + ' cancelled')
+
+class TaskRunner:
+    """Runs tasks for a Tk window, one at a time for each name."""
+    def __init__(self, root, poll_interval=POLL_INTERVAL):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.messages = queue.Queue()
+        self.tasks = dict()
+        self.polling = False
+
+    def is_running(self, name=None):
+        """Returns true if the task of the name, or any task, is running."""
+        return name in self.tasks if name is not None else bool(self.tasks)
+
+    def run(self, name, work, on_done=None, on_error=None, on_progress=None, on_cancelled=None, widgets=()):
+        """Starts work(task) on a worker thread, disabling the widgets until it ends. Then on_done(result),
+        on_error(exception) or on_cancelled() is called on the Tk thread, and on_progress(message) for each
+        progress message. Returns the task, or None if a task of the same name is already running."""
+        if name in self.tasks:
+            return None
+        task = Task(self, name)
+        states = [(widget, widget.cget('state')) for widget in widgets]
+        for widget in widgets:
+            widget.configure(state=DISABLED)
+        self.tasks[name] = (task, on_done, on_error, on_progress, on_cancelled, states)
+        threading.Thread(target=self.work, args=(task, work), daemon=True).start()
+        if not self.polling:
+            self.polling = True
+            self.root.after(self.poll_interval, self.poll)
+        return task
+
+    def cancel(self, name=None):
+        """Cancels the task of the name, or every task."""
+        for task_name, (task, *_) in self.tasks.items():
+            if name is None or task_name == name:
+                task.cancel()
+
+    def work(self, task, work):
+        """Runs the work of a task. Runs in the worker thread."""
+        try:
+            result = work(task)
+        except TaskCancelled:
+            self.messages.put((task, 'cancelled', None))
+        except Exception as error:
+            self.messages.put((task, 'error', error))
+        else:
+            self.messages.put((task, 'done', result))
+
+    def poll(self):
+        """Hands the messages of the workers to the callbacks. Runs in the Tk thread."""
+        while True:
+            try:
+                task, kind, value = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            if self.tasks.get(task.name, (None,))[0] is not task:
+                continue
+            _, on_done, on_error, on_progress, on_cancelled, states = self.tasks[task.name]
+            if kind == 'progress':
+                if on_progress is not None:
+                    on_progress(value)
+                continue
+            del self.tasks[task.name]
+            for widget, state in states:
+                widget.configure(state=state)
+            if kind == 'done' and on_done is not None:
+                on_done(value)
+            elif kind == 'error':
+                if on_error is not None:
+                    on_error(value)
+                else:
+                    print('Error in ' + task.name + ':', repr(value))
+            elif kind == 'cancelled' and on_cancelled is not None:
+                on_cancelled()
+        if self.tasks:
+            self.root.after(self.poll_interval, self.poll)
+        else:
+            self.polling = False
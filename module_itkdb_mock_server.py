@@ -0,0 +1,228 @@
+"""A local stand-in for the ITkDB, to test and benchmark uploads without touching the production database.
+
+Implements the authentication (grantToken and listKeys), uploadTestRunResults, createTestRunAttachment,
+listTestRunsByComponent, getComponentBulk, getComponentTypeByCode and getTestTypeByCode (of modules), with a configurable latency,
+injected errors and a record of every request.
+
+Usage:
+    python module_itkdb_mock_server.py --port 8000 --latency 0.05 --error componentAtDifferentLocation:0.1
+then point the uploads at it, with any passcodes:
+    set ITKDB_API_URL=http://localhost:8000/api/ and ITKDB_AUTH_URL=http://localhost:8000/auth/
+
+itkdb checks every token against the signing keys of the production authentication server, which it fetches from
+a fixed address. A client accepts the tokens of the stand-in only if it is created within server.signing_keys(), in
+the same process as the server, as the upload benchmark does.
+"""
+import argparse
+import contextlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import rsa
+from jose import jwk, jwt
+from itkdb.settings import settings
+
+TOKEN_LIFETIME = 3600 #seconds
+KEY_SIZE = 1024 #bits, small so the server starts quickly
+MODULE_STAGES = {'RECEPTION': (), 'GLUED': ('MODULE_METROLOGY', 'MODULE_BOW'),
+                 'STITCH_BONDING': ('MODULE_METROLOGY', 'MODULE_BOW'), 'FINISHED': ('MODULE_METROLOGY', 'MODULE_BOW')}
+TEST_TYPES = {
+    'MODULE_BOW': {'properties': {'JIG': 'string', 'OPERATOR': 'string', 'USED_SETUP': 'string', 'SCRIPT_VERSION': 'string'},
+                   'parameters': {'BOW': 'float', 'TEMPERATURE': 'float', 'FILE': 'string'}},
+    'MODULE_METROLOGY': {'properties': {'MACHINE': 'string', 'OPERATOR': 'string', 'SCRIPT_VERSION': 'string'},
+                         'parameters': {'HYBRID_POSITION': 'float', 'PB_POSITION': 'float', 'HYBRID_GLUE_THICKNESS': 'float',
+                                        'ABC0_GLUE_THICKNESS': 'float', 'ABC1_GLUE_THICKNESS': 'float',
+                                        'PB_GLUE_THICKNESS': 'float', 'PB_GLUE_MOD_THICKNESS': 'float',
+                                        'CAP_HEIGHT': 'float', 'SHIELDBOX_HEIGHT': 'float', 'FILE': 'string'}}}
+OPTIONAL_FIELDS = ('TEMPERATURE', 'FILE', 'ABC1_GLUE_THICKNESS')
+ERROR_STATUS = {'componentAtDifferentLocation': 400, 'unassociatedStageWithTestType': 400, 'serverError': 503}
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """Answers the requests of itkdb clients from the state of the MockServer."""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_request(self, method):
+        start = time.perf_counter()
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        endpoint = self.path.rstrip('/').split('/')[-1]
+        status, data, component = self.server.respond(endpoint, body, self.headers.get('Content-Type', ''))
+        self.send_json(status, data)
+        self.server.record(method, endpoint, len(body), status, component, time.perf_counter() - start)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+class MockServer(ThreadingHTTPServer):
+    """The stand-in ITkDB. Every request waits latency seconds, and a test run upload fails with each error
+    code of errors (a dictionary of code to probability) at its probability, or always with the error code
+    of its component in error_components. Every serial number is a module at default_location and
+    default_stage, unless given a location and stage in components (serial number to (location, stage)).
+    Test runs are kept in test_runs and requests in records."""
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, errors=None, error_components=None, components=None,
+                 default_location='TRIUMF', default_stage='GLUED', token_lifetime=TOKEN_LIFETIME, seed=None):
+        super().__init__(address, MockRequestHandler)
+        self.components = dict(components or {})
+        self.default_location = default_location
+        self.default_stage = default_stage
+        self.latency = latency
+        self.errors = dict(errors or {})
+        self.error_components = dict(error_components or {})
+        self.token_lifetime = token_lifetime
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.records = []
+        self.test_runs = dict()
+        public_key, private_key = rsa.newkeys(KEY_SIZE)
+        self.private_key = private_key.save_pkcs1().decode()
+        self.public_jwk = jwk.construct(public_key.save_pkcs1().decode(), 'RS256').to_dict()
+        self.public_jwk['kid'] = 'mock'
+
+    def get_url(self, prefix):
+        """Returns the URL to give itkdb for the 'api' or 'auth' prefix."""
+        return f'http://{self.server_address[0]}:{self.server_address[1]}/{prefix}/'
+
+    @contextlib.contextmanager
+    def signing_keys(self):
+        """Has the itkdb clients created within it check their tokens against the keys of this server. itkdb has no
+        public way to choose the keys, so the method of its User that loads them into the private _jwks is replaced
+        until the end of the block."""
+        import itkdb
+        load_jwks = itkdb.core.User._load_jwks
+        def load_server_jwks(user, force=False):
+            user._jwks = {'keys': [self.public_jwk]}
+        itkdb.core.User._load_jwks = load_server_jwks
+        try:
+            yield self
+        finally:
+            itkdb.core.User._load_jwks = load_jwks
+
+    def record(self, method, endpoint, size, status, component, seconds):
+        with self.lock:
+            self.records.append({'time': time.time(), 'method': method, 'endpoint': endpoint, 'bytes': size,
+                                 'status': status, 'component': component, 'seconds': seconds})
+
+    def get_error(self, component):
+        """Returns the error code to inject for a test run upload of the component, or None."""
+        if component in self.error_components:
+            return self.error_components[component]
+        with self.lock:
+            for code, probability in self.errors.items():
+                if self.random.random() < probability:
+                    return code
+        return None
+
+    def get_component(self, serial_number):
+        """Returns the ITkDB component of a serial number."""
+        location, stage = self.components.get(serial_number, (self.default_location, self.default_stage))
+        return {'code': serial_number.lower(), 'serialNumber': serial_number, 'componentType': {'code': 'MODULE'},
+                'currentLocation': {'code': location}, 'currentStage': {'code': stage}}
+
+    def respond(self, endpoint, body, content_type):
+        """Returns (HTTP status, response data, component) for a request."""
+        time.sleep(self.latency)
+        data = json.loads(body) if body and content_type.startswith('application/json') else dict()
+        if endpoint == 'listKeys':
+            return 200, {'keys': [self.public_jwk]}, None
+        if endpoint == 'grantToken':
+            claims = {'aud': settings.ITKDB_ACCESS_AUDIENCE, 'exp': int(time.time()) + self.token_lifetime,
+                      'name': 'Mock User', 'uuidentity': 'mock'}
+            token = jwt.encode(claims, self.private_key, algorithm='RS256', headers={'kid': 'mock'})
+            return 200, {'access_token': uuid.uuid4().hex, 'id_token': token}, None
+        if endpoint == 'uploadTestRunResults':
+            component = data.get('component')
+            error = self.get_error(component)
+            if error is not None:
+                key = 'cern-itkpd-main/uploadTestRunResults/' + error
+                return ERROR_STATUS.get(error, 400), {'uuAppErrorMap': {key: {'type': 'error', 'message': error}}}, component
+            test_run = {'id': uuid.uuid4().hex, 'runNumber': data.get('runNumber'), 'testType': data.get('testType'),
+                        'passed': data.get('passed'), 'problems': data.get('problems'), 'attachments': 0}
+            with self.lock:
+                self.test_runs.setdefault(component, []).append(test_run)
+            return 200, {'testRun': {'id': test_run['id']}, 'uuAppErrorMap': {}}, component
+        if endpoint == 'createTestRunAttachment':
+            with self.lock:
+                for test_runs in self.test_runs.values():
+                    for test_run in test_runs:
+                        if test_run['id'].encode() in body:
+                            test_run['attachments'] += 1
+                            return 200, {'attachment': {'code': uuid.uuid4().hex}, 'uuAppErrorMap': {}}, None
+            return 400, {'uuAppErrorMap': {'cern-itkpd-main/createTestRunAttachment/testRunDoesNotExist': {}}}, None
+        if endpoint == 'listTestRunsByComponent':
+            filter_map = data.get('filterMap', dict())
+            component = filter_map.get('serialNumber')
+            with self.lock:
+                test_runs = [test_run for test_run in self.test_runs.get(component, [])
+                             if test_run['testType'] in filter_map.get('testType', [test_run['testType']])]
+            return 200, {'itemList': test_runs, 'uuAppErrorMap': {}}, component
+        if endpoint == 'getComponentBulk':
+            return 200, {'itemList': [self.get_component(serial_number) for serial_number in data.get('component', [])],
+                         'uuAppErrorMap': {}}, None
+        if endpoint == 'getComponentTypeByCode':
+            stages = [{'code': stage, 'testTypes': [{'testType': {'code': test_type}} for test_type in test_types]}
+                      for stage, test_types in MODULE_STAGES.items()]
+            return 200, {'code': data.get('code'), 'stages': stages, 'uuAppErrorMap': {}}, None
+        if endpoint == 'getTestTypeByCode':
+            if data.get('code') not in TEST_TYPES:
+                return 400, {'uuAppErrorMap': {'cern-itkpd-main/getTestTypeByCode/testTypeDaoGetByCodeFailed': {}}}, None
+            fields = {group: [{'code': code, 'dataType': data_type, 'valueType': 'single', 'required': code not in OPTIONAL_FIELDS}
+                              for code, data_type in definition.items()]
+                      for group, definition in TEST_TYPES[data['code']].items()}
+            return 200, dict(code=data['code'], uuAppErrorMap={}, **fields), None
+        return 404, {'uuAppErrorMap': {'cern-itkpd-main/' + endpoint + '/unknownEndpoint': {}}}, None
+
+def start_server(port=0, **options):
+    """Starts a MockServer on a background thread on localhost (port 0 picks a free port) and returns it.
+    The options are those of MockServer."""
+    server = MockServer(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def parse_errors(values):
+    """Returns the dictionary of error code to probability for the --error arguments (code:probability)."""
+    errors = dict()
+    for value in values:
+        code, _, probability = value.partition(':')
+        if code not in ERROR_STATUS:
+            raise ValueError('Unknown error code ' + code + ', expected one of ' + ', '.join(ERROR_STATUS))
+        errors[code] = float(probability or 1)
+    return errors
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the ITkDB.')
+    parser.add_argument('--port', type=int, default=8000, help='port to listen on (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--location', default='TRIUMF', help='institute every component is at (default: %(default)s)')
+    parser.add_argument('--error', action='append', default=[], metavar='CODE:PROBABILITY',
+                        help='inject an error code into test run uploads: ' + ', '.join(ERROR_STATUS))
+    args = parser.parse_args(argv)
+
+    server = MockServer(('127.0.0.1', args.port), latency=args.latency, errors=parse_errors(args.error),
+                        default_location=args.location)
+    print('ITkDB stand-in listening, set ITKDB_API_URL=' + server.get_url('api') + ' and ITKDB_AUTH_URL=' + server.get_url('auth'))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(f'{len(server.records)} requests, {sum(len(runs) for runs in server.test_runs.values())} test runs stored.')
+
+if __name__ == '__main__':
+    main()
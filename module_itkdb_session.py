@@ -0,0 +1,154 @@
+"""Keeps one authenticated ITkDB client per set of access codes for the whole session.
+
+The first upload authenticates and opens the connection pool, every later upload (test runs and their
+attachments) reuses the same client. The token is renewed by itkdb before any request made within
+REFRESH_MARGIN seconds of its expiry, so a long upload session never sends an expired token.
+
+The database and authentication servers default to the itkdb settings, which can be overridden with the
+ITKDB_API_URL and ITKDB_AUTH_URL environment variables, or per client with api_url and auth_url, for
+example to run against a local stand-in server.
+
+itkdb and requests are imported by the functions that use them, so that the GUIs open without waiting for them.
+"""
+import hashlib
+import json
+import os
+import threading
+import module_stage_timing as stage_timing
+
+REFRESH_MARGIN = 300 #seconds before the token expires at which it is renewed
+POOL_SIZE = 8 # Connections kept open to the database server.
+
+UPLOAD_ERROR_MESSAGES = {
+    'componentAtDifferentLocation': 'Component cannot be uploaded as is not currently at the given location',
+    'unassociatedStageWithTestType': 'Component cannot be uploaded as the current stage does not have this test type. You will need to update the stage of the component on the ITK DB. Note that due to a bug on the ITK DB, you might also get this error if the component is not at your current location.',
+}
+
+SESSIONS = dict()
+SESSIONS_LOCK = threading.Lock()
+
+class UploadError(Exception):
+    """An upload that failed, with the error codes of the ITkDB response (the last part of each uuAppErrorMap key)
+    and its HTTP status, which is None if there was no response."""
+    def __init__(self, message, codes=(), status=None):
+        super().__init__(message)
+        self.codes = tuple(codes)
+        self.status = status
+
+    def is_transient(self):
+        """Returns true if the same upload may succeed later: the ITkDB could not be reached or had a server error."""
+        return self.status is None or self.status >= 500
+
+def get_session_key(access_code1, access_code2, api_url, auth_url):
+    """Returns the key of a session, without keeping the access codes themselves."""
+    codes = hashlib.sha256((access_code1 + '\0' + access_code2).encode()).hexdigest()
+    return (codes, api_url, auth_url)
+
+@stage_timing.traced('itkdb.create_client')
+def create_client(access_code1, access_code2, api_url=None, auth_url=None, pool_size=POOL_SIZE):
+    """Returns a new authenticated itkdb.Client with a pool of pool_size connections to the database server.
+    Raises an itkdb exception if the access codes are incorrect."""
+    import itkdb
+    import requests
+    from itkdb.settings import settings
+    api_url = api_url or settings.ITKDB_API_URL
+    auth_url = auth_url or settings.ITKDB_AUTH_URL
+    user = itkdb.core.User(access_code1=access_code1, access_code2=access_code2, prefix_url=auth_url,
+                           auth_expiry_threshold=REFRESH_MARGIN)
+    client = itkdb.Client(user=user, prefix_url=api_url, cache=False)
+    client.mount(api_url, requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+    user.authenticate()
+    return client
+
+def get_client(access_code1, access_code2, api_url=None, auth_url=None, pool_size=POOL_SIZE):
+    """Returns the authenticated client for the access codes, creating it on first use.
+    The pool size only applies when the client is created. Raises an itkdb exception if the access codes are incorrect."""
+    from itkdb.settings import settings
+    key = get_session_key(access_code1, access_code2, api_url or settings.ITKDB_API_URL,
+                          auth_url or settings.ITKDB_AUTH_URL)
+    with SESSIONS_LOCK:
+        client = SESSIONS.get(key)
+        if client is None:
+            client = create_client(access_code1, access_code2, api_url, auth_url, pool_size)
+            SESSIONS[key] = client
+        else:
+            client.user.authenticate() # Renews the token if it is close to expiry.
+    return client
+
+def close_sessions():
+    """Closes the connections of every client and forgets them."""
+    with SESSIONS_LOCK:
+        for client in SESSIONS.values():
+            client.close()
+        SESSIONS.clear()
+
+def get_error_codes(response):
+    """Returns the error codes of the uuAppErrorMap of an ITkDB response."""
+    try:
+        error_map = response.json().get('uuAppErrorMap', dict())
+    except ValueError:
+        return []
+    if not isinstance(error_map, dict):
+        return []
+    return [key.rstrip('/').split('/')[-1] for key in error_map]
+
+def get_error_message(codes):
+    """Returns the message for the user for the error codes of a failed test upload."""
+    for code in codes:
+        if code in UPLOAD_ERROR_MESSAGES:
+            return UPLOAD_ERROR_MESSAGES[code]
+    return ('Error in Test Upload. ' + ', '.join(codes)).strip()
+
+@stage_timing.traced('post uploadTestRunResults', lambda client, data_dict: {'module': data_dict.get('component'), 'bytes': len(json.dumps(data_dict))})
+def upload_test_run(client, data_dict):
+    """Uploads the results of a test run and returns its id. Raises UploadError if the ITkDB refuses it."""
+    import itkdb
+    import requests
+    try:
+        result = client.post("uploadTestRunResults", json = data_dict)
+    except itkdb.exceptions.ResponseException as error:
+        codes = get_error_codes(error.response)
+        raise UploadError(get_error_message(codes), codes, error.response.status_code) from error
+    except requests.RequestException as error:
+        raise UploadError('Could not reach the ITkDB: ' + str(error)) from error
+    return result['testRun']['id']
+
+@stage_timing.traced('post createTestRunAttachment', lambda client, test_run, file_path: {'module': stage_timing.get_module_name(file_path), 'bytes': os.path.getsize(file_path)})
+def upload_attachment(client, test_run, file_path):
+    """Attaches the data file to an uploaded test run. Raises UploadError if it fails."""
+    import itkdb
+    import requests
+    file_name = os.path.basename(file_path)
+    dataforuploadattachment={
+            "testRun": test_run,
+            "type": "file",
+            "title": file_name,
+            "description": "Automatic Attachment of Original Data File",
+        }
+    try:
+        with open(file_path, 'rb') as data_file:
+            attachment = {'data': (file_name, data_file, 'text')}
+            client.post("createTestRunAttachment", data = dataforuploadattachment, files = attachment)
+    except itkdb.exceptions.ResponseException as error:
+        codes = get_error_codes(error.response)
+        raise UploadError(('Error in Attachment Upload. ' + ', '.join(codes)).strip(), codes, error.response.status_code) from error
+    except requests.RequestException as error:
+        raise UploadError('Could not reach the ITkDB: ' + str(error)) from error
+
+@stage_timing.traced('get listTestRunsByComponent', lambda client, data_dict: {'module': data_dict.get('component')})
+def find_test_run(client, data_dict):
+    """Returns the id of the test run of the component with the test type and run number of a data dictionary
+    already in the ITkDB, or None. Raises UploadError if the ITkDB cannot be searched."""
+    import itkdb
+    import requests
+    filter_map = {"serialNumber": data_dict["component"], "testType": [data_dict["testType"]], "state": ["ready"]}
+    try:
+        for test_run in client.get("listTestRunsByComponent", json={"filterMap": filter_map}):
+            if str(test_run.get("runNumber")) == str(data_dict["runNumber"]):
+                return test_run["id"]
+    except itkdb.exceptions.ResponseException as error:
+        raise UploadError('Could not search the ITkDB for the test run.', get_error_codes(error.response),
+                          error.response.status_code) from error
+    except requests.RequestException as error:
+        raise UploadError('Could not reach the ITkDB: ' + str(error)) from error
+    return None
@@ -1,109 +1,426 @@
-import numpy as np
-import matplotlib.pyplot as plt
-import csv
-from scipy.linalg import lstsq
-import math
-import os
-import re
-from datetime import datetime
-
-X_LIMIT = 0.1 #mm
-Y_LIMIT = 0.3 #mm
-PATH_TO_DATA = 'C:/Users/Graham Greig/Desktop/Sensor Probing/module_metrology/'
-PATH_TO_POSITION_FILES = 'C:/Users/Graham Greig/Desktop/Sensor Probing/module_metrology/metrology_position_files'
-FLEX_THICKNESS = 0.270 #um (Endcap)
-GLUE_RANGE = (0.80, 0.160) #um
-X = 0
-Y = 1
-Z = 2
-
-def read_cmm_file(filename):
-    """Reads a CMM file and returns a dictionary of lists of data points"""
-    with open(filename) as csv_file:
-        data = csv.reader(csv_file)
-        data = list(data)
-    data_dictionary = {}
-    temp_list = []
-    for row in data[1:]:
-        if len(row) == 4 :
-            name, element, value = row[1:4]
-        else :
-            name, feature_id, element, value = row[1:5]
-        name = name.upper()
-        if re.search("_[A-Z]$", name) :
-            name = name[0:-2]
-        if "SENSOR" in name or "SHIELD" in name:
-            name = name.capitalize()
-        if 'Sensor' in name :
-            name = 'Sensor'
-        if 'Y' in element :
-            temp_list.append(-(float(value))) #Y needs to be flipped for the desired co-ordinate system.
-        elif 'Z' in element:
-            temp_list.append(float(value))
-            temp_entry = data_dictionary.get(name, [])
-            temp_entry.append(temp_list)
-            data_dictionary[name] = temp_entry
-            temp_list = []
-        else:
-            temp_list.append(float(value))
-    print(data_dictionary)
-    return data_dictionary
-
-def get_date(filename):
-    """Gets the date of a file in ISO8601 format"""
-    creation_time = os.path.getctime(filename) 
-    creation_time = datetime.utcfromtimestamp(creation_time)
-    return creation_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-
-def tilt_correction(data_dictionary):
-    """Correct the tilt of the data using the vacuumed down surface of the sensor as the Z=0 plane.
-    Perfroms a least squares regression fit to the data cloud and subtracts the normal distance to 
-    to the plane from each data point to correct for tilt."""
-    sensor_data = data_dictionary.get('Sensor')
-    temp_xy = []
-    temp_z = []
-    for row in sensor_data:
-        temp_xy.append([row[X], row[Y], 1])
-        temp_z.append(row[Z])
-    z = np.matrix(temp_z).T
-    xy = np.matrix(temp_xy)
-    
-    c = (xy.T * xy).I * xy.T * z
-    for point_lists in data_dictionary.values():
-        for point in point_lists:
-            point[Z] = float(-(c[X]*point[X] + c[Y]*point[Y] - point[Z] + c[Z]) / np.sqrt(c[X]**2 + c[Y]**2 + 1))
-    return data_dictionary
-
-def plot_data(data_dictionary, key):
-    """Produces a 3D plot of the data point cloud for the key of interest.
-       Also plots plane of best fit for sensor data."""
-    data = np.array(data_dictionary.get(key))
-    x = data[:,X]
-    y = data[:,Y]
-    z = data[:,Z]
-    ax = plt.axes(projection='3d')
-    ax.scatter3D(x, y, z)
-    ax.set_xlabel('X')
-    ax.set_ylabel('Y')
-    ax.set_zlabel('Z')
-    if key == "Sensor":
-        xx, yy = np.meshgrid([min(x),max(x)],[min(y),max(y)])
-        A = np.c_[x, y, np.ones(len(z))]
-        C, _, _, _ = lstsq(A, z)
-        z_pred = C[0]*xx + C[1]*yy + C[2]
-        ax.plot_surface(xx, yy, z_pred, rstride=1, cstride=1, alpha=0.2)
-    plt.show()
-
-
-def get_data_array(data_dictionary, key):
-    """returns an array of x,y,z data for easy processing for the given key"""
-    return np.array(data_dictionary.get(key))
-
-    
-def get_file_output(file_prefix, path_to_save, run_number):
-    """Determines the name of the file path and file path by searching if previous files have been saved.
-    Returns the file name and the full path to the file."""
-    file_name = file_prefix + f"{run_number:03d}.dat"
-    full_path = path_to_save + file_name
-    return full_path
-
+import numpy as np
+import csv
+import math
+import os
+import re
+import hashlib
+import itertools
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+import module_stage_timing as stage_timing
+
+X_LIMIT = 0.1 #mm
+Y_LIMIT = 0.3 #mm
+PATH_TO_DATA = 'C:/Users/Graham Greig/Desktop/Sensor Probing/module_metrology/'
+PATH_TO_POSITION_FILES = 'C:/Users/Graham Greig/Desktop/Sensor Probing/module_metrology/metrology_position_files'
+FLEX_THICKNESS = 0.270 #um (Endcap)
+GLUE_RANGE = (0.80, 0.160) #um
+GRID_TOLERANCE = 0.01 #mm, sensor grids that agree to within this share a plane fit factorization
+PLANE_SOLVER_CACHE_SIZE = 64
+CHUNK_ROWS = 65536 # Rows of a CMM file parsed at once.
+POINT_BYTES = 100 # Approximate size of a point in a CMM file, to preallocate the points of a file.
+MODULE_TYPES = ('M0', 'M1', 'M2', '3R', '3L', '4R', '4L', '5R', '5L')
+HEADER_SECTION = 'Header'
+POSITIONS_SECTION = 'Positions'
+X = 0
+Y = 1
+Z = 2
+PLANE_SOLVER_CACHE = OrderedDict()
+POSITION_REGISTRY = dict()
+
+def normalize_feature_name(name):
+    """Converts a CMM feature label to the name used as the key of the data dictionary."""
+    name = name.upper()
+    if re.search("_[A-Z]$", name) :
+        name = name[0:-2]
+    if "SENSOR" in name or "SHIELD" in name:
+        name = name.capitalize()
+    if 'Sensor' in name :
+        name = 'Sensor'
+    return name
+
+def group_points(codes, names, points):
+    """Groups the rows of an (N,3) array of points by their integer name code, where names[code] is the name.
+    Returns a dictionary of (n,3) arrays in code order, each a view into one contiguous array of all points."""
+    codes = np.asarray(codes, dtype=np.intp)
+    grouped = np.ascontiguousarray(points[np.argsort(codes, kind='stable')], dtype=np.float64)
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=len(names)))))
+    data_dictionary = dict()
+    for code, name in enumerate(names):
+        data_dictionary[name] = grouped[offsets[code]:offsets[code + 1]]
+    return data_dictionary
+
+@stage_timing.traced('read_cmm_file', stage_timing.describe_file)
+def read_cmm_file(filename, chunk_rows=CHUNK_ROWS):
+    """Reads a CMM file and returns a dictionary of (N,3) arrays of data points.
+    Supports both the 4 column (without feature ID) and 5+ column layouts of the CMM export.
+    The file is parsed chunk_rows rows at a time into one growable float64 buffer, so that besides the points
+    only one chunk of text is held. When each feature is one run of rows, as the CMM writes them, the arrays
+    are views of that buffer at the offsets of the features; otherwise the points are grouped in one copy."""
+    buffer = np.empty((max(os.path.getsize(filename)//POINT_BYTES, 1), 3))
+    count = 0
+    runs = [] # [code, first point] of each run of points of one feature.
+    axis_of = dict()
+    name_codes = dict()
+    code_of = dict()
+    carry = []
+    with open(filename, newline='') as csv_file:
+        rows = csv.reader(csv_file)
+        next(rows, None)
+        while True:
+            block = [row[1:4] if len(row) == 4 else row[1:5:2] + row[4:5] for row in itertools.islice(rows, chunk_rows) if len(row) >= 4]
+            if not block:
+                break
+            columns = carry + block
+            values = np.array([column[2] for column in columns], dtype=np.float64)
+
+            # Classify each unique element and label once rather than every row.
+            for element in set(column[1] for column in block):
+                if element not in axis_of:
+                    axis_of[element] = Y if 'Y' in element else Z if 'Z' in element else X
+            axes = np.fromiter((axis_of[column[1]] for column in columns), dtype=np.int8, count=len(columns))
+            values[axes == Y] *= -1 #Y needs to be flipped for the desired co-ordinate system.
+
+            # A point is completed by its Z coordinate; the rows after the last Z are carried to the next chunk,
+            # and dropped at the end of the file. Three of them are enough to catch a misplaced Z.
+            z_rows = np.flatnonzero(axes == Z)
+            if not np.array_equal(z_rows, np.arange(2, 3*len(z_rows), 3)):
+                raise ValueError(f"{filename} does not have an X, Y and Z coordinate for every point.")
+            carry = columns[3*len(z_rows):3*len(z_rows) + 3]
+            if len(z_rows) == 0:
+                continue
+
+            for label in dict.fromkeys(columns[row][0] for row in z_rows):
+                if label not in code_of:
+                    name = 'Sensor' if 'SENSOR' in label.upper() else normalize_feature_name(label)
+                    code_of[label] = name_codes.setdefault(name, len(name_codes))
+            codes = np.fromiter((code_of[columns[row][0]] for row in z_rows), dtype=np.intp, count=len(z_rows))
+            if count + len(codes) > len(buffer):
+                buffer.resize((max(count + len(codes), 2*len(buffer)), 3), refcheck=False)
+            buffer[count:count + len(codes)] = values[:3*len(z_rows)].reshape(-1, 3)
+            for start in np.concatenate(([0], np.flatnonzero(np.diff(codes)) + 1)):
+                if not runs or runs[-1][0] != codes[start]:
+                    runs.append([codes[start], count + start])
+            count += len(codes)
+    buffer.resize((count, 3), refcheck=False)
+
+    names = list(name_codes)
+    starts = [start for _, start in runs] + [count]
+    if [code for code, _ in runs] == list(range(len(names))):
+        return {name: buffer[starts[code]:starts[code + 1]] for code, name in enumerate(names)}
+    codes = np.repeat([code for code, _ in runs], np.diff(starts))
+    return group_points(codes, names, buffer)
+
+def iter_standard_file(lines):
+    """Streams the lines of a standard format file once, yielding (section, fields) for each entry, where
+    section is the name of the last '#---' marker ('Header', 'Positions', 'Glue heights', 'Other heights',
+    'Bow'). Header entries yield (key, value) with the key in lower case, data entries the list of fields."""
+    section = None
+    for line in lines:
+        line = line.strip()
+        if line.startswith('#---'):
+            section = line[4:].rstrip(':').strip()
+        elif line == '' or line.startswith('#'):
+            continue
+        elif section == HEADER_SECTION:
+            key, _, value = line.partition(':')
+            yield section, (key.strip().lower(), " ".join(value.split()))
+        else:
+            yield section, line.split()
+
+def read_standard_header(lines):
+    """Reads only the header of a standard format file. Returns a dictionary keyed by the lower case field
+    name, e.g. 'module ref. number' or 'run number'."""
+    header = dict()
+    for section, fields in iter_standard_file(lines):
+        if section != HEADER_SECTION:
+            break
+        header[fields[0]] = fields[1]
+    return header
+
+@stage_timing.traced('read_standard_file')
+def read_standard_file(lines):
+    """Reads a standard format file in one pass. Returns (header, positions, data_dictionary) where positions
+    is a dictionary of [x, y] from the positions section and data_dictionary holds an (N,3) array for each
+    feature with height points (glue heights, other heights or bow)."""
+    header = dict()
+    positions = dict()
+    coordinates = array('d')
+    codes = array('l')
+    name_codes = dict()
+    for section, fields in iter_standard_file(lines):
+        if section == HEADER_SECTION:
+            header[fields[0]] = fields[1]
+        elif len(fields) == 3 and section == POSITIONS_SECTION:
+            positions[fields[0]] = [float(fields[1]), float(fields[2])]
+        elif len(fields) in (4, 5):
+            coordinates.extend(map(float, fields[-3:]))
+            codes.append(name_codes.setdefault(fields[0], len(name_codes)))
+        else:
+            raise ValueError(f"Unexpected line in section {section}: {' '.join(fields)}")
+    points = np.frombuffer(coordinates, dtype=np.float64).reshape(-1, 3)
+    return header, positions, group_points(np.frombuffer(codes, dtype=codes.typecode), list(name_codes), points)
+
+def load_position_file(filename):
+    """Reads and validates a position file of fiducial IDs and expected X, Y positions.
+    Returns a registry entry with the ID 'names', an (N,2) array 'xy', the 'index' of each ID's row and
+    a 'positions' dictionary of ID to (x, y). Raises a ValueError for duplicate IDs or bad numbers."""
+    names = []
+    xy = []
+    index = dict()
+    with open(filename, newline='') as csv_file:
+        reader = csv.reader(csv_file, delimiter = ',')
+        next(reader, None)
+        for line_number, row in enumerate(reader, start=2):
+            if not any(field.strip() for field in row):
+                continue
+            if len(row) < 3:
+                raise ValueError(f"{filename} line {line_number}: expected an ID, X and Y position.")
+            name = row[0].strip()
+            try:
+                point = (float(row[1]), float(row[2]))
+            except ValueError:
+                raise ValueError(f"{filename} line {line_number}: position of {name} is not a number.") from None
+            if not all(math.isfinite(value) for value in point):
+                raise ValueError(f"{filename} line {line_number}: position of {name} is not finite.")
+            if name in index:
+                raise ValueError(f"{filename} line {line_number}: {name} is listed more than once.")
+            index[name] = len(names)
+            names.append(name)
+            xy.append(point)
+    entry = dict()
+    entry['names'] = names
+    entry['xy'] = np.array(xy, dtype=np.float64).reshape(-1, 2)
+    entry['index'] = index
+    entry['positions'] = dict(zip(names, xy))
+    return entry
+
+def get_position_table(module_type, path_to_position_files):
+    """Returns the registry entry of the position file of the module type (see load_position_file).
+    The file is only read again when its modification time or size has changed."""
+    filename = os.path.join(path_to_position_files, module_type + '_positions.csv')
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), module_type)
+    entry = POSITION_REGISTRY.get(key)
+    if entry is None or entry['stamp'] != (stat.st_mtime_ns, stat.st_size):
+        entry = load_position_file(filename)
+        entry['stamp'] = (stat.st_mtime_ns, stat.st_size)
+        POSITION_REGISTRY[key] = entry
+    return entry
+
+def load_position_registry(path_to_position_files, module_types=MODULE_TYPES):
+    """Loads the position files of all module types into the registry, e.g. before processing a batch.
+    Returns a dictionary of module type to registry entry."""
+    return {module_type: get_position_table(module_type, path_to_position_files) for module_type in module_types}
+
+def get_date(filename):
+    """Gets the date of a file in ISO8601 format"""
+    creation_time = os.path.getctime(filename) 
+    creation_time = datetime.utcfromtimestamp(creation_time)
+    return creation_time.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def fit_plane(points):
+    """Least squares fit of the plane z = a*x + b*y + c to an (N,3) array of points. The fit is solved on
+    coordinates centred on their mean, which keeps it well conditioned far from the origin. Returns [a, b, c]."""
+    points = np.asarray(points, dtype=np.float64)
+    centre = points.mean(axis=0)
+    centred = points - centre
+    (a, b), _, _, _ = np.linalg.lstsq(centred[:, X:Z], centred[:, Z], rcond=None)
+    return np.array([a, b, centre[Z] - a*centre[X] - b*centre[Y]])
+
+def correct_points(points, plane):
+    """Replaces, in place, the Z coordinate of an (N,3) array of points by the signed normal distance to the
+    plane z = a*x + b*y + c given as [a, b, c]."""
+    a, b, c = plane
+    points[:, Z] -= a*points[:, X] + b*points[:, Y] + c
+    points[:, Z] /= np.sqrt(a**2 + b**2 + 1)
+    return points
+
+def shared_buffer(data_dictionary):
+    """Returns the contiguous (N,3) array that the point arrays of the dictionary are consecutive views of,
+    in key order, or None if they do not share one."""
+    arrays = list(data_dictionary.values())
+    if not arrays or not all(isinstance(points, np.ndarray) for points in arrays):
+        return None
+    base = arrays[0].base
+    if base is None or base.ndim != 2 or base.shape[1] != 3 or not base.flags['C_CONTIGUOUS']:
+        return None
+    address = base.__array_interface__['data'][0]
+    for points in arrays:
+        if points.base is not base or points.__array_interface__['data'][0] != address or not points.flags['C_CONTIGUOUS']:
+            return None
+        address += points.nbytes
+    if address != base.__array_interface__['data'][0] + base.nbytes:
+        return None
+    return base
+
+def tilt_correct_arrays(data_dictionary):
+    """Corrects the tilt of a dictionary of (N,3) float arrays in place, using the plane fitted to the
+    sensor points. When the arrays are views into one buffer, as returned by read_cmm_file, every feature
+    is corrected by a single operation on that buffer."""
+    plane = fit_plane(data_dictionary['Sensor'])
+    buffer = shared_buffer(data_dictionary)
+    if buffer is not None:
+        correct_points(buffer, plane)
+    else:
+        for points in data_dictionary.values():
+            correct_points(points, plane)
+    return data_dictionary
+
+@stage_timing.traced('tilt_correction', stage_timing.describe_points)
+def tilt_correction(data_dictionary):
+    """Correct the tilt of the data using the vacuumed down surface of the sensor as the Z=0 plane.
+    Perfroms a least squares regression fit to the data cloud and subtracts the normal distance to 
+    to the plane from each data point to correct for tilt.
+    Dictionaries of float arrays are corrected in place. Lists of points are copied into one
+    array, corrected and returned as lists."""
+    if all(isinstance(points, np.ndarray) and points.dtype == np.float64 for points in data_dictionary.values()):
+        return tilt_correct_arrays(data_dictionary)
+    names = list(data_dictionary)
+    lengths = [len(data_dictionary[name]) for name in names]
+    codes = np.repeat(np.arange(len(names)), lengths)
+    packed = np.array([point for name in names for point in data_dictionary[name]], dtype=np.float64).reshape(-1, 3)
+    for name, points in tilt_correct_arrays(group_points(codes, names, packed)).items():
+        data_dictionary[name] = points.tolist()
+    return data_dictionary
+
+def get_feature_table(data_dictionary):
+    """Returns (names, points, feature_ids): all points of the dictionary as one (N,3) array and, for each point,
+    the index of its feature in names. The shared buffer of the dictionary is used without copying if it has one."""
+    names = list(data_dictionary)
+    lengths = [len(data_dictionary[name]) for name in names]
+    points = shared_buffer(data_dictionary)
+    if points is None:
+        points = np.concatenate([data_dictionary[name] for name in names]) if names else np.empty((0, 3))
+    return names, points, np.repeat(np.arange(len(names)), lengths)
+
+def grouped_statistics(values, feature_ids, number_of_features):
+    """Computes the count, mean, min, max and std of the values of each feature in single grouped reductions,
+    where feature_ids gives the feature index of each value. Returns a dictionary of arrays indexed by feature;
+    features without values have a count of 0 and NaN statistics."""
+    values = np.asarray(values, dtype=np.float64)
+    feature_ids = np.asarray(feature_ids, dtype=np.intp)
+    if np.any(feature_ids[1:] < feature_ids[:-1]):
+        order = np.argsort(feature_ids, kind='stable')
+        values = values[order]
+        feature_ids = feature_ids[order]
+    count = np.bincount(feature_ids, minlength=number_of_features)
+    present = count > 0
+    statistics = {'count': count}
+    for key in ('mean', 'min', 'max', 'std'):
+        statistics[key] = np.full(number_of_features, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        statistics['mean'] = np.bincount(feature_ids, weights=values, minlength=number_of_features) / count
+        deviation = values - statistics['mean'][feature_ids]
+        statistics['std'] = np.sqrt(np.bincount(feature_ids, weights=deviation*deviation, minlength=number_of_features) / count)
+    starts = (np.cumsum(count) - count)[present]
+    if len(starts):
+        statistics['min'][present] = np.minimum.reduceat(values, starts)
+        statistics['max'][present] = np.maximum.reduceat(values, starts)
+    return statistics
+
+def grid_hash(points):
+    """Returns a hash of the XY grid of an (N,3) array of points."""
+    grid = np.ascontiguousarray(np.asarray(points, dtype=np.float64)[:, X:Z])
+    return hashlib.sha1(grid.tobytes()).hexdigest()
+
+def grids_match(points, other_points):
+    """Returns true if two (N,3) arrays have the same XY grid to within GRID_TOLERANCE."""
+    return len(points) == len(other_points) and np.abs(points[:, X:Z] - other_points[:, X:Z]).max() <= GRID_TOLERANCE
+
+def find_plane_solver(module_type, points):
+    """Returns the cached (grid, centre, solver) of the module type whose grid matches the points, or None."""
+    for key, entry in PLANE_SOLVER_CACHE.items():
+        if key[0] == module_type and key[1] == len(points) and grids_match(entry[0], points):
+            PLANE_SOLVER_CACHE.move_to_end(key)
+            return entry
+    return None
+
+def cache_plane_solver(module_type, points):
+    """Factorizes the plane fit design matrix of the grid of the points once and caches it by module type and
+    grid hash. Returns (grid, centre, solver), where solver @ z gives the plane [a, b, c'] about the centre."""
+    grid = np.array(points, dtype=np.float64)
+    centre = grid[:, X:Z].mean(axis=0)
+    design = np.column_stack((grid[:, X:Z] - centre, np.ones(len(grid))))
+    entry = (grid, centre, np.linalg.pinv(design))
+    PLANE_SOLVER_CACHE[(module_type, len(grid), grid_hash(grid))] = entry
+    if len(PLANE_SOLVER_CACHE) > PLANE_SOLVER_CACHE_SIZE:
+        PLANE_SOLVER_CACHE.popitem(last=False)
+    return entry
+
+def fit_planes(module_type, sensor_clouds):
+    """Fits the sensor plane of many modules of the same type. Modules whose grids match each other or a
+    cached grid are solved together as one matrix product with the cached factorization of that grid. A
+    module whose grid matches neither is fitted on its own. Returns a (K,3) array of [a, b, c] per module."""
+    sensor_clouds = [np.asarray(points, dtype=np.float64) for points in sensor_clouds]
+    planes = np.empty((len(sensor_clouds), 3))
+    groups = []
+    for index, points in enumerate(sensor_clouds):
+        for group in reversed(groups[-16:]):
+            if grids_match(group[1], points):
+                group[2].append(index)
+                break
+        else:
+            groups.append([find_plane_solver(module_type, points), points, [index]])
+    for entry, points, indices in groups:
+        if entry is None and len(indices) == 1:
+            planes[indices[0]] = fit_plane(points)
+            continue
+        if entry is None:
+            entry = cache_plane_solver(module_type, points)
+        _, centre, solver = entry
+        solution = (solver @ np.column_stack([sensor_clouds[index][:, Z] for index in indices])).T
+        planes[indices, :2] = solution[:, :2]
+        planes[indices, 2] = solution[:, 2] - solution[:, :2] @ centre
+    return planes
+
+def tilt_correction_batch(module_type, data_dictionaries):
+    """Corrects the tilt of a list of data dictionaries of (N,3) float arrays for modules of the same type
+    in place, fitting all of the sensor planes with fit_planes."""
+    planes = fit_planes(module_type, [data_dictionary['Sensor'] for data_dictionary in data_dictionaries])
+    for data_dictionary, plane in zip(data_dictionaries, planes):
+        buffer = shared_buffer(data_dictionary)
+        if buffer is not None:
+            correct_points(buffer, plane)
+        else:
+            for points in data_dictionary.values():
+                correct_points(points, plane)
+    return data_dictionaries
+
+def plot_data(data_dictionary, key):
+    """Produces a 3D plot of the data point cloud for the key of interest.
+       Also plots plane of best fit for sensor data."""
+    # Imported here as they are slow to load and only needed for this plot.
+    import matplotlib.pyplot as plt
+    from scipy.linalg import lstsq
+    data = np.array(data_dictionary.get(key))
+    x = data[:,X]
+    y = data[:,Y]
+    z = data[:,Z]
+    ax = plt.axes(projection='3d')
+    ax.scatter3D(x, y, z)
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    ax.set_zlabel('Z')
+    if key == "Sensor":
+        xx, yy = np.meshgrid([min(x),max(x)],[min(y),max(y)])
+        A = np.c_[x, y, np.ones(len(z))]
+        C, _, _, _ = lstsq(A, z)
+        z_pred = C[0]*xx + C[1]*yy + C[2]
+        ax.plot_surface(xx, yy, z_pred, rstride=1, cstride=1, alpha=0.2)
+    plt.show()
+
+
+def get_data_array(data_dictionary, key):
+    """returns an array of x,y,z data for easy processing for the given key"""
+    return np.array(data_dictionary.get(key))
+
+    
+def get_file_output(file_prefix, path_to_save, run_number):
+    """Determines the name of the file path and file path by searching if previous files have been saved.
+    Returns the file name and the full path to the file."""
+    file_name = file_prefix + f"{run_number:03d}.dat"
+    full_path = path_to_save + file_name
+    return full_path
+
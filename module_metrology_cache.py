@@ -0,0 +1,118 @@
+"""On-disk cache of the tilt corrected point clouds and results of processed data files.
+
+Entries are .npz files keyed by the hash of the file contents and the processing constants, so re-opening
+a file costs only a hash and a load. The cache is limited in size and evicts the least recently used entries.
+"""
+import hashlib
+import json
+import os
+import threading
+import numpy as np
+
+PATH_TO_CACHE = 'module_metrology_data/.cache/'
+CACHE_SIZE_LIMIT = 256 * 1024 * 1024 #bytes
+CACHE_VERSION = 2 # Increase when the processing changes so that old entries are not used.
+PLOT_RECORD = 'plots.json'
+PLOT_RECORD_LOCK = threading.Lock()
+
+def get_cache_path():
+    """Returns the full path of the cache folder."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), PATH_TO_CACHE)
+
+def get_cache_key(contents, constants):
+    """Returns the cache key for the contents of a file (bytes) processed with a dictionary of constants."""
+    digest = hashlib.sha256(contents)
+    digest.update(json.dumps({'version': CACHE_VERSION, 'constants': constants}, sort_keys=True).encode())
+    return digest.hexdigest()
+
+def load(key):
+    """Returns (arrays, results) for the cache key, or None if there is no entry. The arrays are views
+    into one contiguous array of all points."""
+    path = os.path.join(get_cache_path(), key + '.npz')
+    try:
+        with np.load(path) as entry:
+            results = json.loads(str(entry['results']))
+            points = entry['points']
+            names = entry['names'].tolist()
+            offsets = entry['offsets']
+    except (OSError, ValueError, KeyError):
+        return None
+    os.utime(path) # Mark as recently used.
+    arrays = {name: points[offsets[index]:offsets[index + 1]] for index, name in enumerate(names)}
+    return arrays, results
+
+def store(key, arrays, results):
+    """Stores a dictionary of (N,3) arrays and a JSON serializable results dictionary under the cache key,
+    then evicts the least recently used entries beyond the cache size limit."""
+    cache_path = get_cache_path()
+    os.makedirs(cache_path, exist_ok=True)
+    path = os.path.join(cache_path, key + '.npz')
+    temp_path = os.path.join(cache_path, key + '.' + str(os.getpid()) + '.tmp.npz')
+    names = list(arrays)
+    lengths = [len(arrays[name]) for name in names]
+    points = np.concatenate([arrays[name] for name in names]) if names else np.empty((0, 3))
+    np.savez(temp_path, results=np.array(json.dumps(results)), points=points,
+             names=np.array(names, dtype=str), offsets=np.concatenate(([0], np.cumsum(lengths))))
+    os.replace(temp_path, path)
+    evict(CACHE_SIZE_LIMIT)
+
+def evict(size_limit):
+    """Removes the least recently used entries until the cache is within the size limit."""
+    cache_path = get_cache_path()
+    entries = []
+    for entry in os.scandir(cache_path):
+        if entry.name.endswith('.npz') and not entry.name.endswith('.tmp.npz'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= size_limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+def cached_processing(key, process):
+    """Returns (arrays, results, cache_hit) for a cache key, calling process() to compute (arrays, results)
+    and storing them when the key is not in the cache."""
+    cached = load(key)
+    if cached is not None:
+        return cached[0], cached[1], True
+    arrays, results = process()
+    try:
+        store(key, arrays, results)
+    except OSError as error:
+        print("Could not write to the processing cache:", error)
+    return arrays, results, False
+
+def plots_current(key, plot_files):
+    """Returns true if every plot file exists and was last made from the data of the cache key."""
+    plot_record = read_plot_record()
+    return all(os.path.exists(plot_file) and plot_record.get(os.path.abspath(plot_file)) == key for plot_file in plot_files)
+
+def record_plots(key, plot_files):
+    """Records that the plot files were made from the data of the cache key. The record is rewritten through a
+    temporary file, so that it is never read half written, and by one thread at a time."""
+    path = os.path.join(get_cache_path(), PLOT_RECORD)
+    temp_path = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+    with PLOT_RECORD_LOCK:
+        plot_record = read_plot_record()
+        for plot_file in plot_files:
+            plot_record[os.path.abspath(plot_file)] = key
+        try:
+            os.makedirs(get_cache_path(), exist_ok=True)
+            with open(temp_path, 'w') as record_file:
+                json.dump(plot_record, record_file)
+            os.replace(temp_path, path)
+        except OSError as error:
+            print("Could not write to the processing cache:", error)
+
+def read_plot_record():
+    """Returns the dictionary of plot file to the cache key it was made from."""
+    try:
+        with open(os.path.join(get_cache_path(), PLOT_RECORD)) as record_file:
+            return json.load(record_file)
+    except (OSError, ValueError):
+        return dict()
@@ -1,246 +1,254 @@
-
-import csv
-import re
-import module_metrology as mm
-import tkinter as tk
-from tkinter import filedialog
-import os
-
-
-X_LIMIT = 0.250 #mm
-Y_LIMIT = 0.250 #mm
-INSTITUTE = 'SFU'
-INSTRUMENT = "Smartscope Flash 302"
-PATH_TO_DATA = 'module_metrology_data/'
-PATH_TO_POSITION_FILES = 'metrology_position_files/'
-SITE_TYPE = 'EC'
-PROGRAM_VERSION = 'Vancouver_LocalScript_June2025'
-X = 0
-Y = 1
-Z = 2
-ENTRY_X = 100
-ENTRY_Y = 20
-DATA_DICT = dict()
-HYBRID_GT_REGEX = '_R[0-5]H[0-1]_[0-9]+'
-PB_GT_REGEX = 'PB_[0-5]'
-SHIELD_REGEX = 'Shield'
-CAP_REGEX = 'C[1-8]'
-
-def clear_data():
-    """Clears all data so one can start over"""
-    DATA_DICT.clear()
-    output_text.set('Please enter the database serial number, operator name and run number. Select the module type. '
-    'Look for a data file using the \'Find File\' button to import data from an appropriate CSV.' 
-    'If everything looks correct press \'Save Data\' to produce the standard file format.' )
-
-def atoi(text):
-    return int(text) if text.isdigit() else text
-
-def natural_keys(text):
-    '''
-    alist.sort(key=natural_keys) sorts in human order
-    http://nedbatchelder.com/blog/200712/human_sorting.html
-    (See Toothy's implementation in the comments)
-    '''
-    return [ atoi(c) for c in re.split(r'(\d+)', text) ]
-
-def sort_dict(dictionary):
-    """Returns a sorted dictionary"""
-    dict_keys = list(dictionary.keys())
-    print(dict_keys)
-    dict_keys.sort(key=natural_keys)
-    print(dict_keys)
-    sorted_dict = dict()
-    for key in dict_keys:
-        sorted_dict[key] = dictionary[key]
-    return sorted_dict
-
-def get_glue_thickness_dictionary(data_dictionary):
-    """Generates the glue thickness dictionary.
-    Module object can be either 'Power Board' or 'Hybrid' """
-    glue_dict = dict()
-    for key, values in data_dictionary.items():
-        if re.search(HYBRID_GT_REGEX,key) :
-            glue_dict[key] = values
-    for key, values in data_dictionary.items():
-        if re.search(PB_GT_REGEX,key) :
-            glue_dict[key] = values
-    print(glue_dict)
-    return sort_dict(glue_dict)
-    
-def get_capacitor_heights(data_dictionary):
-    """Gets a dictionary of capacitor heights"""
-    cap_dict = dict()
-    for key, value in data_dictionary.items():
-        if re.search(CAP_REGEX,key) :      
-            cap_dict[key] = value[0]
-    return sort_dict(cap_dict)
-
-def get_distance_dict(data_dictionary, module_type):
-    """Determines the absolute distances in X and Y from the expected position
-    for key points of interest"""
-    filename = PATH_TO_POSITION_FILES + module_type + '_positions.csv'
-    with open(filename, mode='r') as csv_file:
-        reader = csv.reader(csv_file, delimiter = ',')
-        data = list(reader)
-        position_dict = dict()
-        for row in data[1:]:
-            point = data_dictionary.get(row[0],None)[0]
-            if point != None:
-                position_dict[row[0]] = [point[X],point[Y]]                    
-    return sort_dict(position_dict)
-
-def get_file_data():
-    """Get the data from a file using the search function and format it into the standard JSON dictionary."""
-
-    if serial_number.get() == "" or run_num.get() == "" or module_box.curselection() == () :
-        output_text.set('Please ensure all mandatory values have been entered and a data file has been chosen. Then try again.')
-        return 
-
-    try:
-        file = filedialog.askopenfilename(title = 'Select Data File')
-        data_dict = mm.read_cmm_file(file)
-        data_dict = mm.tilt_correction(data_dict)
-        date = mm.get_date(file)
-
-        module_type = module_box.get(module_box.curselection()[0])
-        print("Data Collected")
-        try:
-            print(module_type)
-            print(data_dict)
-            position_dict = get_distance_dict(data_dict, module_type)
-        except:
-            print("One or more fiducial locations are missing")
-        print("Distances Parsed")
-        cap_dict = get_capacitor_heights(data_dict)
-        print("Capacitor Heights Collected")
-        glue_dict = get_glue_thickness_dictionary(data_dict)
-        print("Glue thicknesses data resolved.")
-    except:
-        output_text.set("Error in processing file. Likely an invalid file type or wrong module type.")
-        return
-
-    DATA_DICT['DATE'] = date
-    DATA_DICT['MODULE_TYPE'] = module_type.split('_')[0]
-    DATA_DICT['POSITIONS'] = position_dict
-    DATA_DICT['GLUE_HEIGHTS'] = glue_dict
-    DATA_DICT['CAP'] = cap_dict
-    try:
-        DATA_DICT["SHIELD"] = data_dict['Shield']
-    except:
-        print("There are no shieldbox points in raw data file")
-    DATA_DICT['SENSOR'] = data_dict['Sensor']
-
-    output_text.set("File found and data parsed. Can now save to standard file format.")
-
-def save_data():
-    """Saves a metrology data file in the standard file format"""
-
-    if DATA_DICT == {}:
-        output_text.set("No data to upload. Please look for a valid data file and try again.")
-        return
-
-    # Determine the data file to write to.
-    module_ref = serial_number.get()
-    run_number = run_num.get()
-    module_type = module_box.get(module_box.curselection()[0])
-    file_prefix = module_ref + "_" + module_type + '_MODULE_METROLOGY_'
-    path_to_save = PATH_TO_DATA + 'metrology_data/'
-    # full_path = mm.get_file_output(file_prefix, path_to_save, int(run_number))
-    local_path = mm.get_file_output(file_prefix, path_to_save, int(run_number))
-    full_path = os.path.dirname(os.path.abspath(__file__)) + '//' + local_path
-    print(DATA_DICT)
-    #Open the data file and write to it.
-    file = open(full_path,'w+')
-    file.write('#---Header\n')
-    file.write('EC or Barrel: ' + SITE_TYPE + '\n')
-    file.write('Module type: ' + DATA_DICT['MODULE_TYPE'] + '\n')
-    file.write('Module ref. Number: ' + module_ref + '\n')
-    file.write('Date: ' + DATA_DICT['DATE'] + '\n')
-    file.write('Institute: ' + INSTITUTE + '\n')
-    file.write('Operator: ' + operator_display.get() + '\n')
-    file.write('Instrument type: ' + INSTRUMENT + '\n')
-    file.write('Run Number: ' + str(run_number) + '\n')
-    file.write('Measurement program version: ' + PROGRAM_VERSION + '\n')
-    file.write('#---Positions\n')
-    file.write('#Location X[mm] Y[mm]\n')
-    for key, point in DATA_DICT['POSITIONS'].items() :
-        file.write(f'{key} {point[X]:0.4f} {point[Y]:0.4f}\n')
-    file.write('#---Glue heights:\n')
-    file.write('#Location Type X[mm] Y[mm] Z[mm]\n')
-    for point in DATA_DICT['SENSOR']:
-        file.write(f'Sensor\t1\t{point[X]:0.4f}\t{point[Y]:0.4f}\t{point[Z]:0.4f}\n')
-    for key, points in DATA_DICT['GLUE_HEIGHTS'].items() :
-        for point in points:
-            file.write(f'{key}\t2\t{point[X]:0.4f}\t{point[Y]:0.4f}\t{point[Z]:0.4f}\n')
-    if DATA_DICT['CAP'] != {} and DATA_DICT['SHIELD'] != {} :
-        file.write('#---Other heights:\n')
-        file.write('#Location\tType\tX[mm]\tY[mm]\tZ[mm]\n')
-        for key, point in DATA_DICT['CAP'].items() :
-            file.write(f'{key}\t4\t{point[X]:0.4f}\t{point[Y]:0.4f}\t{point[Z]:0.4f}\n')  
-        for point in DATA_DICT['SHIELD'] :
-            file.write(f'Shield\t4\t{point[X]:0.4f}\t{point[Y]:0.4f}\t{point[Z]:0.4f}\n') 
-    file.close()    
-    output_text.set('Output saved to ' + full_path)
-
-# GUI Definition
-root = tk.Tk()
-frame = tk.Frame(root, height = 450, width = 500)
-frame.pack()
-
-#Define String Variables of GUI
-serial_number = tk.StringVar()
-operator_display = tk.StringVar()
-
-run_num = tk.StringVar()
-output_text = tk.StringVar()
-
-#Define the boxes to dontain the string variables.
-title = tk.Label(frame, text = 'Module Metrology CMM Parsing GUI', font = ('calibri', 18))
-title.place(x = 90, y = 10 )
-
-save_button = tk.Button(frame, text = "Save Data", command = lambda: save_data())
-save_button.place(x = ENTRY_X + 115, y = ENTRY_Y + 360)
-
-browser_button = tk.Button(frame, text = "Find File", command = lambda: get_file_data())
-browser_button.place(x = ENTRY_X + 300, y = ENTRY_Y + 40)
-
-clear_button = tk.Button(frame, text = "Clear Data", command = lambda: clear_data())
-clear_button.place(x = ENTRY_X + 300, y = ENTRY_Y + 100)
-
-module_label = tk.Label(frame, text='Module Type')
-module_label.place(x = ENTRY_X + 90, y = ENTRY_Y + 80)
-module_box = tk.Listbox(frame, width = 10, relief = 'groove', height = '9')
-module_box.place(x = ENTRY_X + 170, y = ENTRY_Y + 80)
-module_box.insert(0,"M0")
-module_box.insert(1,"M1")
-module_box.insert(2,"M2")
-module_box.insert(3,"3R")
-module_box.insert(4,"3L")
-module_box.insert(5,"4R")
-module_box.insert(6,"4L")
-module_box.insert(7,"5R")
-module_box.insert(8,"5L")
-
-id_label = tk.Label(frame, text='SN')
-id_label.place(x = ENTRY_X - 70, y = ENTRY_Y + 40)
-id_box = tk.Entry(frame, textvariable = serial_number, justify = 'left' , width = 20)
-id_box.place(x = ENTRY_X - 50 , y = ENTRY_Y + 40)
-
-run_num_label = tk.Label(frame, text='Run Number')
-run_num_label.place(x = ENTRY_X - 60, y = ENTRY_Y + 80)
-run_num_box = tk.Entry(frame, textvariable = run_num, justify = 'left' , width = 5)
-run_num_box.place(x = ENTRY_X + 15 , y = ENTRY_Y + 80)
-
-operator_label = tk.Label(frame, text='Operator')
-operator_label.place(x = ENTRY_X + 80, y = ENTRY_Y + 40)
-operator_box = tk.Entry(frame, textvariable = operator_display, justify = 'left', width = 20)
-operator_box.place(x = ENTRY_X + 135, y = ENTRY_Y + 40)
-
-output_text_box = tk.Message(frame, textvariable = output_text, font = ('calibri', 10), width = 344, relief = 'sunken', justify = 'left')
-output_text_box.place(x = ENTRY_X - 30, y = ENTRY_Y + 250)
-output_text.set('Please enter the database serial number, operator name and run number. Select the module type. '
-'Look for a data file using the \'Find File\' button to import data from an appropriate CSV.' 
-'If everything looks correct press \'Save Data\' to produce the standard file format.' )
-
-root.mainloop()
\ No newline at end of file
+
+import module_metrology as mm
+import module_feature_classifier as fc
+import tkinter as tk
+from tkinter import filedialog
+import os
+import module_gui_tasks as gui_tasks
+import module_stage_timing as stage_timing
+
+
+X_LIMIT = 0.250 #mm
+Y_LIMIT = 0.250 #mm
+INSTITUTE = 'SFU'
+INSTRUMENT = "Smartscope Flash 302"
+PATH_TO_DATA = 'module_metrology_data/'
+PATH_TO_POSITION_FILES = 'metrology_position_files/'
+SITE_TYPE = 'EC'
+PROGRAM_VERSION = 'Vancouver_LocalScript_June2025'
+X = 0
+Y = 1
+Z = 2
+ENTRY_X = 100
+ENTRY_Y = 20
+DATA_DICT = dict()
+TASKS = None # The gui_tasks.TaskRunner of the window.
+
+def clear_data():
+    """Clears all data so one can start over"""
+    DATA_DICT.clear()
+    output_text.set('Please enter the database serial number, operator name and run number. Select the module type. '
+    'Look for a data file using the \'Find File\' button to import data from an appropriate CSV.' 
+    'If everything looks correct press \'Save Data\' to produce the standard file format.' )
+
+def sort_dict(dictionary):
+    """Returns a sorted dictionary"""
+    dict_keys = sorted(dictionary.keys(), key=fc.natural_keys)
+    sorted_dict = dict()
+    for key in dict_keys:
+        sorted_dict[key] = dictionary[key]
+    return sorted_dict
+
+def get_glue_thickness_dictionary(data_dictionary):
+    """Generates the glue thickness dictionary.
+    Module object can be either 'Power Board' or 'Hybrid' """
+    glue_dict = dict()
+    for key in fc.classify_features(data_dictionary)[fc.GLUE]:
+        glue_dict[key] = data_dictionary[key]
+    return glue_dict
+    
+def get_capacitor_heights(data_dictionary):
+    """Gets a dictionary of capacitor heights"""
+    cap_dict = dict()
+    for key in fc.classify_features(data_dictionary)[fc.CAP]:
+        cap_dict[key] = data_dictionary[key][0]
+    return cap_dict
+
+def get_distance_dict(data_dictionary, module_type):
+    """Determines the absolute distances in X and Y from the expected position
+    for key points of interest. Raises ValueError naming the fiducials missing from the data."""
+    position_table = mm.get_position_table(module_type, PATH_TO_POSITION_FILES)
+    missing = [name for name in position_table['names'] if len(data_dictionary.get(name, ())) == 0]
+    if missing:
+        raise ValueError('Fiducial(s) of a ' + module_type + ' module missing from the data: ' + ', '.join(missing))
+    position_dict = dict()
+    for name in position_table['names']:
+        point = data_dictionary[name][0]
+        position_dict[name] = [point[X],point[Y]]
+    return sort_dict(position_dict)
+
+def convert_cmm_file(file, module_type):
+    """Reads a raw CMM file, corrects the tilt and collects the positions, glue heights and other heights
+    needed for the standard file format."""
+    data_dict = mm.read_cmm_file(file)
+    data_dict = mm.tilt_correction(data_dict)
+    date = mm.get_date(file)
+    print("Data Collected")
+    return convert_data(data_dict, module_type, date)
+
+def convert_data(data_dict, module_type, date):
+    """Collects the positions, glue heights and other heights of tilt corrected points for the standard
+    file format."""
+    try:
+        position_dict = get_distance_dict(data_dict, module_type)
+    except ValueError as error:
+        print(error)
+        raise
+    print("Distances Parsed")
+    cap_dict = get_capacitor_heights(data_dict)
+    print("Capacitor Heights Collected")
+    glue_dict = get_glue_thickness_dictionary(data_dict)
+    print("Glue thicknesses data resolved.")
+
+    converted = dict()
+    converted['DATE'] = date
+    converted['MODULE_TYPE'] = module_type.split('_')[0]
+    converted['POSITIONS'] = position_dict
+    converted['GLUE_HEIGHTS'] = glue_dict
+    converted['CAP'] = cap_dict
+    if 'Shield' in data_dict:
+        converted['SHIELD'] = data_dict['Shield']
+    else:
+        print("There are no shieldbox points in raw data file")
+    converted['SENSOR'] = data_dict['Sensor']
+    return converted
+
+def get_output_path(module_ref, module_type, run_number):
+    """Returns the full path of the standard format file for the module and run number."""
+    file_prefix = module_ref + "_" + module_type + '_MODULE_METROLOGY_'
+    path_to_save = PATH_TO_DATA + 'metrology_data/'
+    local_path = mm.get_file_output(file_prefix, path_to_save, int(run_number))
+    return os.path.dirname(os.path.abspath(__file__)) + '//' + local_path
+
+@stage_timing.traced('metrology.write_standard_file')
+def write_standard_file(full_path, converted, module_ref, operator, run_number):
+    """Writes the converted data to a file in the standard file format"""
+    file = open(full_path,'w+')
+    file.write('#---Header\n')
+    file.write('EC or Barrel: ' + SITE_TYPE + '\n')
+    file.write('Module type: ' + converted['MODULE_TYPE'] + '\n')
+    file.write('Module ref. Number: ' + module_ref + '\n')
+    file.write('Date: ' + converted['DATE'] + '\n')
+    file.write('Institute: ' + INSTITUTE + '\n')
+    file.write('Operator: ' + operator + '\n')
+    file.write('Instrument type: ' + INSTRUMENT + '\n')
+    file.write('Run Number: ' + str(run_number) + '\n')
+    file.write('Measurement program version: ' + PROGRAM_VERSION + '\n')
+    file.write('#---Positions\n')
+    file.write('#Location X[mm] Y[mm]\n')
+    for key, point in converted['POSITIONS'].items() :
+        file.write(f'{key} {point[X]:0.4f} {point[Y]:0.4f}\n')
+    file.write('#---Glue heights:\n')
+    file.write('#Location Type X[mm] Y[mm] Z[mm]\n')
+    for point in converted['SENSOR']:
+        file.write(f'Sensor\t1\t{point[X]:0.4f}\t{point[Y]:0.4f}\t{point[Z]:0.4f}\n')
+    for key, points in converted['GLUE_HEIGHTS'].items() :
+        for point in points:
+            file.write(f'{key}\t2\t{point[X]:0.4f}\t{point[Y]:0.4f}\t{point[Z]:0.4f}\n')
+    if converted['CAP'] != {} and 'SHIELD' in converted :
+        file.write('#---Other heights:\n')
+        file.write('#Location\tType\tX[mm]\tY[mm]\tZ[mm]\n')
+        for key, point in converted['CAP'].items() :
+            file.write(f'{key}\t4\t{point[X]:0.4f}\t{point[Y]:0.4f}\t{point[Z]:0.4f}\n')  
+        for point in converted['SHIELD'] :
+            file.write(f'Shield\t4\t{point[X]:0.4f}\t{point[Y]:0.4f}\t{point[Z]:0.4f}\n') 
+    file.close()    
+
+def get_file_data():
+    """Get the data from a file using the search function and format it into the standard JSON dictionary."""
+
+    if serial_number.get() == "" or run_num.get() == "" or module_box.curselection() == () :
+        output_text.set('Please ensure all mandatory values have been entered and a data file has been chosen. Then try again.')
+        return 
+
+    file = filedialog.askopenfilename(title = 'Select Data File')
+    if file == '':
+        return
+    module_type = module_box.get(module_box.curselection()[0])
+
+    # Convert the file in the background.
+    output_text.set('Processing ' + os.path.basename(file) + '...')
+    TASKS.run('file', lambda task: convert_cmm_file(file, module_type), on_done=show_converted_data,
+              on_error=lambda error: output_text.set("Error in processing file. Likely an invalid file type or wrong module type."),
+              widgets=(browser_button, save_button))
+
+def show_converted_data(converted):
+    """Keeps the converted data of a file for saving. Called when the file has been converted."""
+    DATA_DICT.clear()
+    DATA_DICT.update(converted)
+
+    output_text.set("File found and data parsed. Can now save to standard file format.")
+
+def save_data():
+    """Saves a metrology data file in the standard file format"""
+
+    if DATA_DICT == {}:
+        output_text.set("No data to upload. Please look for a valid data file and try again.")
+        return
+
+    # Determine the data file to write to.
+    module_ref = serial_number.get()
+    run_number = run_num.get()
+    module_type = module_box.get(module_box.curselection()[0])
+    full_path = get_output_path(module_ref, module_type, run_number)
+    #Open the data file and write to it in the background.
+    converted = dict(DATA_DICT)
+    operator = operator_display.get()
+    TASKS.run('save', lambda task: write_standard_file(full_path, converted, module_ref, operator, run_number),
+              on_done=lambda _: output_text.set('Output saved to ' + full_path),
+              on_error=lambda error: output_text.set('Could not save the output: ' + repr(error)),
+              widgets=(browser_button, save_button))
+
+if __name__ == '__main__':
+    # GUI Definition
+    root = tk.Tk()
+    frame = tk.Frame(root, height = 450, width = 500)
+    frame.pack()
+    TASKS = gui_tasks.TaskRunner(root)
+
+    #Define String Variables of GUI
+    serial_number = tk.StringVar()
+    operator_display = tk.StringVar()
+
+    run_num = tk.StringVar()
+    output_text = tk.StringVar()
+
+    #Define the boxes to dontain the string variables.
+    title = tk.Label(frame, text = 'Module Metrology CMM Parsing GUI', font = ('calibri', 18))
+    title.place(x = 90, y = 10 )
+
+    save_button = tk.Button(frame, text = "Save Data", command = lambda: save_data())
+    save_button.place(x = ENTRY_X + 115, y = ENTRY_Y + 360)
+
+    browser_button = tk.Button(frame, text = "Find File", command = lambda: get_file_data())
+    browser_button.place(x = ENTRY_X + 300, y = ENTRY_Y + 40)
+
+    clear_button = tk.Button(frame, text = "Clear Data", command = lambda: clear_data())
+    clear_button.place(x = ENTRY_X + 300, y = ENTRY_Y + 100)
+
+    module_label = tk.Label(frame, text='Module Type')
+    module_label.place(x = ENTRY_X + 90, y = ENTRY_Y + 80)
+    module_box = tk.Listbox(frame, width = 10, relief = 'groove', height = '9')
+    module_box.place(x = ENTRY_X + 170, y = ENTRY_Y + 80)
+    module_box.insert(0,"M0")
+    module_box.insert(1,"M1")
+    module_box.insert(2,"M2")
+    module_box.insert(3,"3R")
+    module_box.insert(4,"3L")
+    module_box.insert(5,"4R")
+    module_box.insert(6,"4L")
+    module_box.insert(7,"5R")
+    module_box.insert(8,"5L")
+
+    id_label = tk.Label(frame, text='SN')
+    id_label.place(x = ENTRY_X - 70, y = ENTRY_Y + 40)
+    id_box = tk.Entry(frame, textvariable = serial_number, justify = 'left' , width = 20)
+    id_box.place(x = ENTRY_X - 50 , y = ENTRY_Y + 40)
+
+    run_num_label = tk.Label(frame, text='Run Number')
+    run_num_label.place(x = ENTRY_X - 60, y = ENTRY_Y + 80)
+    run_num_box = tk.Entry(frame, textvariable = run_num, justify = 'left' , width = 5)
+    run_num_box.place(x = ENTRY_X + 15 , y = ENTRY_Y + 80)
+
+    operator_label = tk.Label(frame, text='Operator')
+    operator_label.place(x = ENTRY_X + 80, y = ENTRY_Y + 40)
+    operator_box = tk.Entry(frame, textvariable = operator_display, justify = 'left', width = 20)
+    operator_box.place(x = ENTRY_X + 135, y = ENTRY_Y + 40)
+
+    output_text_box = tk.Message(frame, textvariable = output_text, font = ('calibri', 10), width = 344, relief = 'sunken', justify = 'left')
+    output_text_box.place(x = ENTRY_X - 30, y = ENTRY_Y + 250)
+    output_text.set('Please enter the database serial number, operator name and run number. Select the module type. '
+    'Look for a data file using the \'Find File\' button to import data from an appropriate CSV.' 
+    'If everything looks correct press \'Save Data\' to produce the standard file format.' )
+
+    root.mainloop()
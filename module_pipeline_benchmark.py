@@ -0,0 +1,130 @@
+"""Benchmarks the processing of modules, stage by stage, on synthetic data.
+
+For each number of modules, writes that many synthetic modules (see module_synthetic_data) to a temporary folder
+and times every stage of the conversion and upload processing of each: reading the raw CMM file, the tilt
+correction, writing the standard format file, computing the results from the standard format file and checking
+them against the limits, for metrology and bow. Writes the total, mean, p50 and p99 time of each stage to a JSON
+report. Given the report of an earlier run, lists the stages that have become slower.
+
+Usage:
+    python module_pipeline_benchmark.py --modules 1 100 10000 --report benchmark.json --baseline old.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+import module_metrology as mm
+import module_metrology_file_conversion as metrology_conversion
+import module_bow_file_conversion as bow_conversion
+import module_metrology_upload as metrology_upload
+import module_bow_upload as bow_upload
+import module_synthetic_data as synthetic_data
+
+TOLERANCE = 1.25 # A stage is slower when its median time is more than this times the baseline.
+PIPELINES = {'metrology': (metrology_conversion, metrology_upload, metrology_upload.get_metrology_results),
+             'bow': (bow_conversion, bow_upload, bow_upload.get_bow_results)}
+
+def time_module(module, path, times):
+    """Processes the files of one synthetic module, adding the seconds of each stage to the lists in times."""
+    def timed(stage, function, *args):
+        start = time.perf_counter()
+        result = function(*args)
+        times.setdefault(stage, []).append(time.perf_counter() - start)
+        return result
+
+    for test, (conversion, upload, get_results) in PIPELINES.items():
+        data_dict = timed(test + '.read_cmm_file', mm.read_cmm_file, module[test + '_raw'])
+        data_dict = timed(test + '.tilt_correction', mm.tilt_correction, data_dict)
+        converted = conversion.convert_data(data_dict, module['module_type'], mm.get_date(module[test + '_raw']))
+        timed(test + '.write_standard_file', conversion.write_standard_file, os.path.join(path, test + '.dat'),
+              converted, module['serial_number'], synthetic_data.MANIFEST_OPERATOR, module['run_number'])
+        with open(module[test + '_data']) as data_file:
+            lines = data_file.readlines()
+        results = timed(test + '.get_results', get_results, lines)
+        timed(test + '.evaluate_test', upload.evaluate_test, {'results': results})
+
+def summarize(times):
+    """Returns the statistics in seconds of the times of each stage."""
+    summary = dict()
+    for stage, seconds in times.items():
+        seconds = np.array(seconds)
+        summary[stage] = {'total': seconds.sum(), 'mean': seconds.mean(), 'p50': np.percentile(seconds, 50),
+                          'p99': np.percentile(seconds, 99)}
+    return summary
+
+def run_benchmark(count, options):
+    """Generates count modules and times their processing. Returns a dictionary of the measurements."""
+    with tempfile.TemporaryDirectory() as path:
+        modules = synthetic_data.generate(path, count, **options)
+        times = dict()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for module in modules:
+                time_module(module, path, times)
+        elapsed = time.perf_counter() - start
+    return {'modules': count, 'seconds': elapsed, 'modules_per_second': count/elapsed, 'stages': summarize(times)}
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    """Returns a list of (modules, stage, p50, baseline p50) for the stages whose median time is more than
+    tolerance times that of the run of the same number of modules in the baseline report. The median is
+    compared as it is barely moved by the odd slow write to disk."""
+    slower = []
+    baseline_runs = {run['modules']: run for run in baseline['runs']}
+    for run in report['runs']:
+        baseline_run = baseline_runs.get(run['modules'])
+        if baseline_run is None:
+            continue
+        for stage, statistics in run['stages'].items():
+            baseline_statistics = baseline_run['stages'].get(stage)
+            if baseline_statistics is not None and statistics['p50'] > tolerance*baseline_statistics['p50']:
+                slower.append((run['modules'], stage, statistics['p50'], baseline_statistics['p50']))
+    return slower
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the processing of synthetic modules stage by stage.')
+    parser.add_argument('--modules', type=int, nargs='+', default=[1, 10, 100], help='numbers of modules to run (default: 1 10 100)')
+    parser.add_argument('--types', nargs='+', default=list(mm.MODULE_TYPES), choices=mm.MODULE_TYPES, help='module types to cycle through (default: all)')
+    parser.add_argument('--sensor-points', type=int, default=synthetic_data.SENSOR_POINTS, help='sensor points of a metrology file (default: %(default)s)')
+    parser.add_argument('--bow-points', type=int, default=synthetic_data.BOW_POINTS, help='sensor points of a bow file (default: %(default)s)')
+    parser.add_argument('--columns', type=int, choices=(4, 5), default=5, help='layout of the raw files (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the modules (default: %(default)s)')
+    parser.add_argument('--report', default='pipeline_benchmark.json', help='JSON file to write the results to (default: %(default)s)')
+    parser.add_argument('--baseline', default=None, help='report of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help='slowdown of a stage reported as a regression (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    options = {'module_types': args.types, 'seed': args.seed, 'sensor_points': args.sensor_points,
+               'bow_points': args.bow_points, 'columns': args.columns}
+    report = {'date': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+              'numpy': np.__version__, 'machine': platform.platform(), 'options': options, 'runs': []}
+    for count in args.modules:
+        run = run_benchmark(count, options)
+        report['runs'].append(run)
+        print(f'{count} modules in {run["seconds"]:0.2f} s ({run["modules_per_second"]:0.1f} modules/s)')
+        print('stage                             mean [ms]  p50 [ms]  p99 [ms]  total [s]')
+        for stage, statistics in run['stages'].items():
+            print(f'{stage:32s}  {statistics["mean"]*1000:9.2f}  {statistics["p50"]*1000:8.2f}  '
+                  f'{statistics["p99"]*1000:8.2f}  {statistics["total"]:9.2f}')
+    with open(args.report, 'w') as report_file:
+        json.dump(report, report_file, indent=1)
+    print('Report written to ' + args.report)
+
+    if args.baseline is None:
+        return 0
+    with open(args.baseline) as baseline_file:
+        slower = compare(report, json.load(baseline_file), args.tolerance)
+    for count, stage, p50, baseline_p50 in slower:
+        print(f'SLOWER {stage} with {count} modules: p50 {p50*1000:0.2f} ms, was {baseline_p50*1000:0.2f} ms')
+    if not slower:
+        print('No stage is slower than in ' + args.baseline)
+    return 1 if slower else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
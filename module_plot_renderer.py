@@ -0,0 +1,94 @@
+"""Renders the metrology and bow plots off the GUI thread.
+
+Figures are drawn with the Agg backend from plain arrays, on a pool of worker processes, and are cleared as soon
+as they are saved. The GUIs hand the numbers to the pool and return at once, and no figure outlives its plot.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import module_stage_timing as stage_timing
+
+RENDER_WORKERS = 2 # Plots rendered at once.
+GLUE_PLOT_SIZE = (16, 12) #inches
+BOW_PLOT_SIZE = (12, 14) #inches
+POOL = None
+POOL_LOCK = threading.Lock()
+
+def save_figure(fig, path):
+    """Saves a figure as a png (adding the extension if missing) through a temporary file, then clears it.
+    Returns the path written."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    if not path.endswith('.png'):
+        path += '.png'
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        FigureCanvasAgg(fig)
+        fig.savefig(temp_path, format='png')
+        os.replace(temp_path, path)
+    finally:
+        fig.clear()
+    return path
+
+@stage_timing.traced('plot glue heights', lambda *args, **kwargs: {'file': os.path.basename(args[4])})
+def render_glue_heights(names, heights, glue_range, title, path, rotate_labels=False):
+    """Plots glue heights against the minimum, target and maximum of glue_range and saves the plot to path."""
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=GLUE_PLOT_SIZE)
+    ax = fig.add_subplot()
+    ax.plot(list(names), list(heights), 'k-', label="glue height")
+    ax.axhline(y=glue_range[0], color='red', linestyle='--', linewidth=2, label='Min')
+    ax.axhline(y=glue_range[2], color='red', linestyle='--', linewidth=2, label='Max')
+    ax.axhline(y=glue_range[1], color='green', linestyle='--', linewidth=2, label='Target')
+    ax.set_title(title)
+    ax.set_ylabel("Glue Thickness [um]")
+    if rotate_labels:
+        for label in ax.get_xticklabels():
+            label.update({'rotation': 90, 'ha': 'right'})
+    return save_figure(fig, path)
+
+@stage_timing.traced('plot bow surface', lambda *args, **kwargs: {'file': os.path.basename(args[4])})
+def render_bow_surface(x, y, z, title, path):
+    """Plots a triangulated surface through the x, y and z arrays of sensor points and saves the plot to path."""
+    from matplotlib import cm
+    from matplotlib.figure import Figure
+    z = np.asarray(z)
+    fig = Figure(figsize=BOW_PLOT_SIZE)
+    ax = fig.add_subplot(projection='3d')
+    ax.plot_trisurf(x, y, z, vmin=z.min() * 2, cmap=cm.YlGnBu)
+    ax.set_title(title)
+    ax.set_xlabel('[mm]')
+    ax.set_ylabel('[mm]')
+    ax.set_zlabel('[mm]')
+    fig.tight_layout()
+    return save_figure(fig, path)
+
+def get_pool():
+    """Returns the render pool, starting it on first use."""
+    global POOL
+    with POOL_LOCK:
+        if POOL is None:
+            POOL = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+        return POOL
+
+def report_render(future):
+    """Prints the outcome of a finished render."""
+    try:
+        print("Plot saved to " + future.result())
+    except Exception as error:
+        print("Could not save the plot:", repr(error))
+
+def submit(render, *args, **kwargs):
+    """Renders a plot with one of the render functions on the render pool. Returns the future of its path."""
+    future = get_pool().submit(render, *args, **kwargs)
+    future.add_done_callback(report_render)
+    return future
+
+def shutdown(wait=True):
+    """Stops the render pool, by default after the plots still queued are saved."""
+    global POOL
+    with POOL_LOCK:
+        pool, POOL = POOL, None
+    if pool is not None:
+        pool.shutdown(wait=wait)
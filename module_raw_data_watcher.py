@@ -0,0 +1,294 @@
+"""Watches the raw data folders and converts and checks each new CMM file as soon as it has been written.
+
+The folders are watched with inotify on Linux, with a full scan every RESCAN_INTERVAL for the changes it does not
+see (such as those made over a network share), and scanned every POLL_INTERVAL elsewhere. A file is taken once its
+size and modification time have not changed for SETTLE_TIME and it can be opened, so a file still being written by
+the CMM is never read half way. Its serial number, module type, run number and operator come from a sidecar
+<raw file name>.json, from a manifest.csv in its folder (as for the batch conversion) or else from its name: the
+serial number at its start gives the module type, and a number at its end the run number (1 if none). Each file
+is converted to the standard format in metrology_data or bow_data and checked against the limits on a process
+pool, its plots are saved, its results entered in the results index, and its outcome written to the status log.
+
+Usage:
+    python module_raw_data_watcher.py --operator "Peter Speers"
+    python module_raw_data_watcher.py --existing --once
+"""
+import argparse
+import ctypes
+import getpass
+import json
+import logging
+import os
+import re
+import select
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import module_batch_file_conversion as batch_conversion
+import module_results_index as results_index
+
+WATCH_PATHS = {'metrology': 'module_metrology_data/raw_data/metrology', 'bow': 'module_metrology_data/raw_data/bow'}
+PATH_TO_LOG = 'module_metrology_data/raw_data/watcher.log'
+MANIFEST_NAME = 'manifest.csv'
+POLL_INTERVAL = 1.0 #s
+BUSY_INTERVAL = 0.1 #s, between checks for finished files while files are processed
+SETTLE_TIME = 2.0 #s, unchanged for this long a file has been written
+RESCAN_INTERVAL = 30.0 #s, full scans with inotify, for changes it does not report
+SERIAL_PATTERN = re.compile(r'^(20USE(M[0-2]|[3-5][LR])\d{7})', re.IGNORECASE)
+RUN_PATTERN = re.compile(r'_(?:run_?)?(\d{1,3})\.csv$', re.IGNORECASE)
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+EVENT_HEADER = struct.Struct('iIII')
+LOGGER = logging.getLogger('module_raw_data_watcher')
+
+def open_inotify(paths):
+    """Returns (file descriptor, dictionary of folder by watch descriptor) of an inotify instance watching the
+    folders, or None where inotify is not available."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        descriptor = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if descriptor < 0:
+        return None
+    watches = dict()
+    for path in paths:
+        watch = libc.inotify_add_watch(descriptor, os.fsencode(path), IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if watch < 0:
+            os.close(descriptor)
+            return None
+        watches[watch] = path
+    return descriptor, watches
+
+def read_events(inotify, timeout):
+    """Waits up to timeout seconds for inotify events and returns the set of files they name."""
+    descriptor, watches = inotify
+    files = set()
+    if not select.select([descriptor], [], [], timeout)[0]:
+        return files
+    try:
+        buffer = os.read(descriptor, 65536)
+    except BlockingIOError:
+        return files
+    offset = 0
+    while offset < len(buffer):
+        watch, _, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+        name = buffer[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+        offset += EVENT_HEADER.size + length
+        if watch in watches and name:
+            files.add(os.path.join(watches[watch], os.fsdecode(name)))
+    return files
+
+def get_signature(file):
+    """Returns (size, modification time) of a file, or None if it is gone."""
+    try:
+        status = os.stat(file)
+    except OSError:
+        return None
+    return status.st_size, status.st_mtime_ns
+
+def can_open(file):
+    """Returns true if the file can be opened, which it cannot on Windows while the CMM still writes it."""
+    try:
+        with open(file, 'rb'):
+            return True
+    except OSError:
+        return False
+
+def is_raw_file(file):
+    name = os.path.basename(file)
+    return name.lower().endswith('.csv') and name.lower() != MANIFEST_NAME
+
+def get_entry(file, operator):
+    """Returns the manifest entry (serial number, module type, run number and operator) of a raw file, from its
+    sidecar, the manifest of its folder or its name, or None if its serial number cannot be told."""
+    entry = {'file': os.path.basename(file), 'operator': operator}
+    name_match = SERIAL_PATTERN.match(os.path.basename(file))
+    if name_match:
+        run_match = RUN_PATTERN.search(os.path.basename(file))
+        entry.update(serial_number=name_match.group(1).upper(), module_type=name_match.group(2).upper(),
+                     run_number=run_match.group(1) if run_match else '1')
+    manifest_file = os.path.join(os.path.dirname(file), MANIFEST_NAME)
+    if os.path.isfile(manifest_file):
+        entry.update(batch_conversion.read_manifest(manifest_file).get(os.path.basename(file), {}))
+    sidecar = os.path.splitext(file)[0] + '.json'
+    if os.path.isfile(sidecar):
+        with open(sidecar) as sidecar_file:
+            entry.update({key: str(value) for key, value in json.load(sidecar_file).items()
+                          if key in batch_conversion.MANIFEST_FIELDS})
+    if not all(entry.get(field) for field in batch_conversion.MANIFEST_FIELDS):
+        return None
+    return entry
+
+def process_file(test, file, entry, plot=True):
+    """Converts a raw file to the standard format, saving the bow plot, and checks its results. Runs in a
+    worker process. Returns (standard format file, data dictionary, local results)."""
+    full_path = batch_conversion.convert_file(test, file, entry, plot)
+    data, local_results = results_index.process_file(full_path)
+    return full_path, data, local_results
+
+class Watcher:
+    """Finds the raw files that have been written in the watched folders and processes them on a process pool."""
+    def __init__(self, paths, operator, workers=None, plot=True, existing=False):
+        self.paths = paths
+        self.operator = operator
+        self.plot = plot
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=batch_conversion.preload_positions)
+        self.inotify = open_inotify(list(paths.values()))
+        self.last_scan = 0.0
+        self.signatures = dict() # file: (signature, time it was first seen with it)
+        self.done = dict() # file: signature last processed or skipped
+        self.skipped = set() # files whose entry could not be told, retried when a sidecar or manifest changes
+        self.running = dict() # future: (test, file, start time)
+        now = time.monotonic()
+        for file in self.scan():
+            self.signatures[file] = (get_signature(file), now)
+            if not existing:
+                self.done[file] = self.signatures[file][0]
+
+    def get_test(self, file):
+        folder = os.path.abspath(os.path.dirname(file))
+        return next((test for test, path in self.paths.items() if os.path.abspath(path) == folder), None)
+
+    def scan(self):
+        """Returns every file of the watched folders."""
+        self.last_scan = time.monotonic()
+        files = []
+        for path in self.paths.values():
+            try:
+                files += [os.path.join(path, name) for name in os.listdir(path)]
+            except OSError as error:
+                LOGGER.info('Cannot read ' + path + ': ' + str(error))
+        return files
+
+    def get_ready(self, timeout):
+        """Waits for changes up to timeout seconds and returns the raw files written and settled since."""
+        if self.inotify is not None and time.monotonic() - self.last_scan < RESCAN_INTERVAL:
+            changed = read_events(self.inotify, timeout)
+        else:
+            time.sleep(timeout)
+            changed = set(self.scan())
+        now = time.monotonic()
+        ready = []
+        for file in changed | set(self.signatures):
+            signature = get_signature(file)
+            if signature is None:
+                self.signatures.pop(file, None)
+                continue
+            if file not in self.signatures or self.signatures[file][0] != signature:
+                self.signatures[file] = (signature, now)
+                if not is_raw_file(file):
+                    self.retry_skipped(os.path.dirname(file))
+                continue
+            if not is_raw_file(file) or self.done.get(file) == signature:
+                continue
+            if now - self.signatures[file][1] >= SETTLE_TIME and can_open(file):
+                ready.append(file)
+        # Settled files that are done need not be checked again until an event or scan names them.
+        for file in [file for file, (signature, _) in self.signatures.items() if self.done.get(file) == signature]:
+            del self.signatures[file]
+        return sorted(ready)
+
+    def retry_skipped(self, folder):
+        """Takes again the skipped files of a folder whose sidecar or manifest has changed."""
+        for file in [file for file in self.skipped if os.path.dirname(file) == folder]:
+            self.skipped.discard(file)
+            self.done.pop(file, None)
+            self.signatures[file] = (get_signature(file), time.monotonic())
+
+    def submit(self, file):
+        """Starts processing a raw file."""
+        self.done[file] = get_signature(file)
+        test = self.get_test(file)
+        try:
+            entry = get_entry(file, self.operator)
+        except (OSError, ValueError) as error:
+            entry, reason = None, str(error)
+        else:
+            reason = 'no serial number in its name, sidecar or ' + MANIFEST_NAME
+        if entry is None:
+            self.skipped.add(file)
+            LOGGER.info('SKIPPED ' + file + ': ' + reason)
+            return
+        self.skipped.discard(file)
+        LOGGER.info(f'NEW     {file}: {entry["serial_number"]} {entry["module_type"]} {test} run {entry["run_number"]}')
+        future = self.executor.submit(process_file, test, file, entry, self.plot)
+        self.running[future] = (test, file, time.monotonic())
+
+    def collect(self):
+        """Reports the processed files. Returns their number."""
+        finished = [future for future in self.running if future.done()]
+        for future in finished:
+            test, file, start = self.running.pop(future)
+            try:
+                full_path, data, local_results = future.result()
+            except Exception as error:
+                LOGGER.info('ERROR   ' + file + ': ' + repr(error))
+                continue
+            results_index.record(data, local_results)
+            if test == 'metrology' and self.plot:
+                import module_metrology_upload as metrology_upload
+                metrology_upload.plot_glue_heights(data)
+            LOGGER.info(f'{"PASSED " if data["passed"] else "FAILED "} {data["component"]} {test} run '
+                        f'{data["runNumber"]} in {time.monotonic() - start:0.1f} s -> {full_path}')
+        return len(finished)
+
+    def run(self, once=False):
+        """Watches the folders until interrupted, or if once until the files there now are processed."""
+        LOGGER.info('Watching ' + ', '.join(self.paths.values()) + (' with inotify' if self.inotify else ' by polling'))
+        try:
+            while True:
+                for file in self.get_ready(BUSY_INTERVAL if self.running else POLL_INTERVAL):
+                    self.submit(file)
+                self.collect()
+                if once and not self.running and not any(is_raw_file(file) and self.done.get(file) != signature
+                                                         for file, (signature, _) in self.signatures.items()):
+                    return
+        except KeyboardInterrupt:
+            LOGGER.info('Stopping')
+        finally:
+            self.executor.shutdown(wait=True)
+            self.collect()
+            if self.inotify is not None:
+                os.close(self.inotify[0])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert and check the raw CMM files as they are written.')
+    parser.add_argument('--metrology', default=WATCH_PATHS['metrology'], help='folder of the raw metrology files (default: %(default)s)')
+    parser.add_argument('--bow', default=WATCH_PATHS['bow'], help='folder of the raw bow files (default: %(default)s)')
+    parser.add_argument('--operator', default=getpass.getuser(), help='operator of the files without one in a sidecar or manifest (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPU count)')
+    parser.add_argument('--log', default=PATH_TO_LOG, help='status log file (default: %(default)s)')
+    parser.add_argument('--no-plots', action='store_true', help='do not save the glue height and bow plots')
+    parser.add_argument('--existing', action='store_true', help='also process the files already in the folders')
+    parser.add_argument('--once', action='store_true', help='stop once the files found have been processed')
+    args = parser.parse_args(argv)
+
+    paths = {'metrology': args.metrology, 'bow': args.bow}
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(args.log)), exist_ok=True)
+    formatter = logging.Formatter('%(asctime)s %(message)s', '%Y-%m-%d %H:%M:%S')
+    for handler in (logging.StreamHandler(sys.stdout), logging.FileHandler(args.log)):
+        handler.setFormatter(formatter)
+        LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.INFO)
+    try:
+        batch_conversion.preload_positions()
+    except (OSError, ValueError) as error:
+        print('Invalid position files: ' + str(error))
+        return 1
+
+    Watcher(paths, args.operator, args.workers, not args.no_plots, args.existing or args.once).run(args.once)
+    if not args.no_plots:
+        import module_plot_renderer as plot_renderer
+        plot_renderer.shutdown()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
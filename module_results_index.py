@@ -0,0 +1,247 @@
+"""Index of the results of every processed module, kept in a SQLite file for fast queries across modules.
+
+Every data dictionary checked by the upload GUIs or the batch uploader is entered in the index, keyed by
+(component, testType, runNumber), with its header fields, pass/fail and results. Each number of the results is
+also a row of its own, with the result name, the feature and the axis for positions, so that questions such as
+the mean ABC glue thickness under hybrid 0 of every 5R module last month are one indexed query. The standard
+format files already on disk are entered with the backfill command, processed in parallel. Each new run is
+also added to the control charts of module_spc.
+
+Usage:
+    python module_results_index.py backfill module_metrology_data/metrology_data module_metrology_data/bow_data
+    python module_results_index.py stats ABC0_GLUE_THICKNESS --module-type 5R --since 2026-09-01 --total
+"""
+import argparse
+import contextlib
+import datetime
+import glob
+import io
+import json
+import numbers
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import module_spc as spc
+
+PATH_TO_INDEX = 'module_metrology_data/results_index.sqlite'
+DATA_PATHS = ('module_metrology_data/metrology_data', 'module_metrology_data/bow_data')
+AXES = ('X', 'Y')
+BATCH_SIZE = 200 # Files entered per transaction by the backfill.
+
+def get_index_path():
+    """Returns the full path of the index file."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), PATH_TO_INDEX)
+
+def open_index(path=None):
+    """Opens the index, creating it if needed, and returns the sqlite3 connection."""
+    path = path or get_index_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript('''
+        CREATE TABLE IF NOT EXISTS runs (
+            component TEXT, test_type TEXT, run_number TEXT, module_type TEXT, institution TEXT, date TEXT,
+            operator TEXT, instrument TEXT, program_version TEXT, passed INTEGER, file TEXT, file_time REAL,
+            results TEXT, indexed TEXT, PRIMARY KEY (component, test_type, run_number));
+        CREATE TABLE IF NOT EXISTS results (
+            component TEXT, test_type TEXT, run_number TEXT, result TEXT, feature TEXT, axis TEXT, value REAL);
+        CREATE INDEX IF NOT EXISTS runs_by_type ON runs (test_type, module_type, date);
+        CREATE INDEX IF NOT EXISTS results_by_name ON results (result, feature);
+        CREATE INDEX IF NOT EXISTS results_by_run ON results (component, test_type, run_number);''')
+    spc.create_table(connection)
+    connection.commit()
+    return connection
+
+def get_module_type(data_dict):
+    """Returns the module type of a data dictionary, for bow files from the name of their standard format file,
+    which the conversion scripts name <serial number>_<module type>_MODULE_BOW_<run>.dat."""
+    if data_dict.get('moduleType'):
+        return data_dict['moduleType']
+    parts = os.path.basename(str(data_dict['results'].get('FILE', ''))).split('_')
+    return parts[1] if len(parts) > 2 else None
+
+def flatten_results(results):
+    """Returns a list of (result, feature, axis, value) for each number of a results dictionary. Positions,
+    which are [x, y] lists, give a row for each axis."""
+    rows = []
+    for result, value in results.items():
+        items = value.items() if isinstance(value, dict) else [(None, value)]
+        for feature, item in items:
+            if isinstance(item, (list, tuple)):
+                rows += [(result, feature, axis, number) for axis, number in zip(AXES, item)
+                         if isinstance(number, numbers.Real)]
+            elif isinstance(item, numbers.Real) and not isinstance(item, bool):
+                rows.append((result, feature, None, item))
+    return rows
+
+def upsert(connection, data_dict, local_results=None, charts=True):
+    """Enters or replaces the run of a checked data dictionary in the index. The local results, which are
+    not uploaded, are indexed with the others. A new run is added to the control charts if charts.
+    Returns a list of (chart key, drift) of the charts that drift. Does not commit."""
+    key = (data_dict['component'], data_dict['testType'], str(data_dict['runNumber']))
+    new = connection.execute('SELECT 1 FROM runs WHERE component=? AND test_type=? AND run_number=?',
+                             key).fetchone() is None
+    results = dict(data_dict['results'])
+    results.update(local_results or {})
+    file = os.path.abspath(results['FILE']) if results.get('FILE') else None
+    try:
+        file_time = os.path.getmtime(file) if file else None
+    except OSError:
+        file_time = None
+    properties = data_dict.get('properties', dict())
+    passed = data_dict.get('passed')
+    connection.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', key + (
+        get_module_type(data_dict), data_dict.get('institution'), data_dict.get('date'), properties.get('OPERATOR'),
+        properties.get('MACHINE', properties.get('USED_SETUP')), properties.get('SCRIPT_VERSION'),
+        passed if isinstance(passed, bool) else None, file, file_time, json.dumps(results),
+        datetime.datetime.now().isoformat()))
+    connection.execute('DELETE FROM results WHERE component=? AND test_type=? AND run_number=?', key)
+    rows = flatten_results(results)
+    connection.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)', [key + row for row in rows])
+    return spc.update(connection, get_module_type(data_dict), rows) if charts and new else []
+
+def record(data_dict, local_results=None, path=None):
+    """Enters a checked data dictionary in the index and prints the control charts it makes drift. A failure
+    is printed, it never stops an upload. Returns a list of (chart key, drift) of the charts that drift."""
+    try:
+        connection = open_index(path)
+        try:
+            with connection:
+                drifting = upsert(connection, data_dict, local_results)
+        finally:
+            connection.close()
+    except (sqlite3.Error, OSError) as error:
+        print('Could not enter the results in the index:', error)
+        return []
+    for chart, drift in drifting:
+        print(spc.get_message(chart, drift))
+    return drifting
+
+def rebuild_charts(connection):
+    """Recomputes the control charts from the indexed runs, in the order they were measured. Returns the
+    number of charts. Does not commit."""
+    runs = connection.execute('SELECT module_type, results FROM runs ORDER BY date, indexed')
+    return spc.rebuild(connection, ((row['module_type'], flatten_results(json.loads(row['results'])))
+                                    for row in runs))
+
+def get_indexed_files(connection):
+    """Returns a dictionary of the modification time of each file in the index when it was entered."""
+    return {row['file']: row['file_time'] for row in connection.execute('SELECT file, file_time FROM runs')}
+
+def get_result_statistics(connection, result, module_type=None, since=None, until=None, feature=None, passed=None,
+                          by_feature=True):
+    """Returns rows of (feature, axis, count, modules, mean, minimum, maximum) of a result over the indexed
+    runs of the module type and measured from since up to until (ISO dates), for one feature or each, or
+    over all of its features if not by_feature."""
+    conditions = ['r.result = ?']
+    parameters = [result]
+    for condition, value in (('u.module_type = ?', module_type), ('u.date >= ?', since), ('u.date < ?', until),
+                             ('r.feature = ?', feature), ('u.passed = ?', passed)):
+        if value is not None:
+            conditions.append(condition)
+            parameters.append(value)
+    group = 'r.feature, r.axis' if by_feature else 'r.axis'
+    return [dict(row) for row in connection.execute(
+        'SELECT ' + ('r.feature' if by_feature else 'NULL') + ' AS feature, r.axis AS axis, COUNT(*) AS count, '
+        'COUNT(DISTINCT r.component) AS modules, AVG(r.value) AS mean, MIN(r.value) AS minimum, MAX(r.value) AS maximum '
+        'FROM results r JOIN runs u ON u.component = r.component AND u.test_type = r.test_type AND u.run_number = r.run_number '
+        'WHERE ' + ' AND '.join(conditions) + ' GROUP BY ' + group + ' ORDER BY ' + group, parameters)]
+
+def find_data_files(paths):
+    """Returns the sorted standard format files in the folders (and their uploaded folders) or glob patterns."""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            patterns = [os.path.join(path, '*_MODULE_*.dat'), os.path.join(path, 'uploaded', '*_MODULE_*.dat')]
+        else:
+            patterns = [path]
+        for pattern in patterns:
+            files.update(os.path.abspath(file) for file in glob.glob(pattern) if os.path.isfile(file))
+    return sorted(files)
+
+def process_file(file):
+    """Processes a standard format file and checks its results. Runs in a worker process.
+    Returns (data dictionary, local results)."""
+    import module_metrology_upload as metrology_upload
+    import module_bow_upload as bow_upload
+    with contextlib.redirect_stdout(io.StringIO()):
+        if '_MODULE_BOW_' in os.path.basename(file):
+            local_results = dict()
+            data, _, _ = bow_upload.build_data_dict(file, local_results)
+            data['passed'], _ = bow_upload.evaluate_test(data)
+            return data, local_results
+        data, _, _ = metrology_upload.build_data_dict(file)
+        data['passed'], _ = metrology_upload.evaluate_test(data)
+        return data, None
+
+def backfill(files, connection, workers=None, force=False):
+    """Enters the standard format files in the index, processing them on a process pool. Files indexed since
+    they were last modified are skipped unless force. As the files are entered in the order they finish, the
+    control charts are then rebuilt in the order measured. Returns (entered, skipped, failed) counts."""
+    indexed = get_indexed_files(connection) if not force else dict()
+    pending = [file for file in files if force or indexed.get(file) != os.path.getmtime(file)]
+    entered = failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_file, file): file for file in pending}
+        batch = []
+        for future in as_completed(futures):
+            try:
+                batch.append(future.result())
+            except Exception as error:
+                failed += 1
+                print('FAILED ' + futures[future] + ': ' + repr(error))
+            if len(batch) >= BATCH_SIZE:
+                with connection:
+                    for data, local_results in batch:
+                        upsert(connection, data, local_results, charts=False)
+                entered += len(batch)
+                batch = []
+        with connection:
+            for data, local_results in batch:
+                upsert(connection, data, local_results, charts=False)
+            if entered + len(batch):
+                rebuild_charts(connection)
+        entered += len(batch)
+    return entered, len(files) - len(pending), failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index and query the results of the processed modules.')
+    parser.add_argument('--index', default=None, help='index file (default: ' + PATH_TO_INDEX + ')')
+    commands = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = commands.add_parser('backfill', help='enter the standard format files already on disk')
+    backfill_parser.add_argument('paths', nargs='*', default=list(DATA_PATHS), help='folders or glob patterns (default: the data folders)')
+    backfill_parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: CPU count)')
+    backfill_parser.add_argument('--force', action='store_true', help='also enter the files already indexed')
+    stats_parser = commands.add_parser('stats', help='statistics of a result, e.g. ABC0_GLUE_THICKNESS or BOW')
+    stats_parser.add_argument('result', help='name of the result')
+    stats_parser.add_argument('--module-type', default=None, help='only modules of this type')
+    stats_parser.add_argument('--since', default=None, help='only runs measured on or after this ISO date')
+    stats_parser.add_argument('--until', default=None, help='only runs measured before this ISO date')
+    stats_parser.add_argument('--feature', default=None, help='only this feature, e.g. ABC_R5H0_3')
+    stats_parser.add_argument('--total', action='store_true', help='over all features together rather than each')
+    args = parser.parse_args(argv)
+
+    connection = open_index(args.index)
+    if args.command == 'backfill':
+        files = find_data_files(args.paths)
+        start = datetime.datetime.now()
+        entered, skipped, failed = backfill(files, connection, args.workers, args.force)
+        elapsed = (datetime.datetime.now() - start).total_seconds()
+        print(f'Entered {entered} of {len(files)} files in {elapsed:0.2f} s ({skipped} already indexed, {failed} failed).')
+        return 1 if failed else 0
+
+    rows = get_result_statistics(connection, args.result, args.module_type, args.since, args.until, args.feature,
+                                 by_feature=not args.total)
+    if not rows:
+        print('No indexed values of ' + args.result)
+        return 1
+    print('feature            axis  count  modules      mean   minimum   maximum')
+    for row in rows:
+        print(f'{row["feature"] or "-":17s}  {row["axis"] or "-":4s}  {row["count"]:5d}  {row["modules"]:7d}  '
+              f'{row["mean"]:8.2f}  {row["minimum"]:8.2f}  {row["maximum"]:8.2f}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
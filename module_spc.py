@@ -0,0 +1,214 @@
+"""Statistical process control of the results, with running statistics for each module type and feature.
+
+Each number of the results (a glue thickness of a feature, an axis of a position, the shield height, the bow)
+has a control chart for each module type, kept in the results index. A chart holds the running mean and
+variance of all its values (Welford's method), an exponentially weighted moving average (EWMA) and the latest
+WINDOW values, so a new module updates only the charts of its own numbers. After each update a chart drifts
+when its EWMA has shifted from its mean, when its latest values come within LIMIT_SIGMAS standard deviations
+of a limit (GLUE_RANGE, X_LIMIT and Y_LIMIT, MAX_SHIELD_HEIGHT, BOW_RANGE) or when their trend crosses a limit
+within TREND_MODULES modules, which warns of a process going wrong before its modules fail.
+
+Usage:
+    python module_spc.py chart ABC0_GLUE_THICKNESS --module-type 5R
+    python module_spc.py drift
+    python module_spc.py rebuild
+"""
+import argparse
+import json
+import math
+import sys
+from datetime import datetime
+
+EWMA_WEIGHT = 0.2 # Weight of the newest value in the EWMA.
+EWMA_WIDTH = 3 # Control limits of the EWMA in its standard deviations.
+WINDOW = 25 # Latest values kept on each chart.
+MIN_COUNT = 10 # Values of a chart before it is checked for drift.
+LIMIT_SIGMAS = 3
+TREND_MODULES = 25
+DRIFTS = {'shift': 'EWMA shifted from the mean', 'near_lower': 'latest values near the lower limit',
+          'near_upper': 'latest values near the upper limit', 'trend_lower': 'trend reaches the lower limit',
+          'trend_upper': 'trend reaches the upper limit'}
+LIMITS = None
+
+def create_table(connection):
+    """Creates the table of the charts in the results index if needed. Does not commit."""
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS charts (
+            module_type TEXT, result TEXT, feature TEXT, axis TEXT, count INTEGER, mean REAL, m2 REAL, ewma REAL,
+            window TEXT, drift TEXT, updated TEXT, PRIMARY KEY (module_type, result, feature, axis))''')
+
+def get_limits():
+    """Returns a dictionary of the (lower, upper) limits of each (result, axis), None for no limit. The glue
+    thickness limits are those of a failure, not of passing with problems."""
+    global LIMITS
+    if LIMITS is None:
+        import module_metrology_upload as metrology_upload
+        import module_bow_upload as bow_upload
+        glue = (metrology_upload.GLUE_RANGE[0], metrology_upload.GLUE_RANGE[2])
+        LIMITS = {('HYBRID_POSITION', 'X'): (-metrology_upload.X_LIMIT, metrology_upload.X_LIMIT),
+                  ('HYBRID_POSITION', 'Y'): (-metrology_upload.Y_LIMIT, metrology_upload.Y_LIMIT),
+                  ('PB_POSITION', 'X'): (-metrology_upload.X_LIMIT, metrology_upload.X_LIMIT),
+                  ('PB_POSITION', 'Y'): (-metrology_upload.Y_LIMIT, metrology_upload.Y_LIMIT),
+                  ('SHIELDBOX_HEIGHT', None): (None, metrology_upload.MAX_SHIELD_HEIGHT),
+                  ('BOW', None): bow_upload.BOW_RANGE, ('BOW_FIT', None): bow_upload.BOW_RANGE}
+        for result in ('HYBRID_GLUE_THICKNESS', 'ABC0_GLUE_THICKNESS', 'ABC1_GLUE_THICKNESS', 'PB_GLUE_THICKNESS',
+                       'PB_GLUE_MOD_THICKNESS'):
+            LIMITS[(result, None)] = glue
+    return LIMITS
+
+def get_key(module_type, result, feature, axis):
+    """Returns the key of a chart. Missing parts are empty strings, as NULL would make the key never match."""
+    return (module_type or '', result, feature or '', axis or '')
+
+def new_chart():
+    return {'count': 0, 'mean': 0.0, 'm2': 0.0, 'ewma': 0.0, 'window': [], 'drift': []}
+
+def get_standard_deviation(chart):
+    return math.sqrt(chart['m2']/(chart['count'] - 1)) if chart['count'] > 1 else 0.0
+
+def add_value(chart, value):
+    """Adds a value to the running mean, variance, EWMA and window of a chart."""
+    chart['count'] += 1
+    delta = value - chart['mean']
+    chart['mean'] += delta/chart['count']
+    chart['m2'] += delta*(value - chart['mean'])
+    chart['ewma'] = value if chart['count'] == 1 else EWMA_WEIGHT*value + (1 - EWMA_WEIGHT)*chart['ewma']
+    chart['window'] = (chart['window'] + [value])[-WINDOW:]
+
+def get_window_statistics(window):
+    """Returns the mean, standard deviation and slope per module of the values of a window."""
+    count = len(window)
+    mean = sum(window)/count
+    deviation = math.sqrt(sum((value - mean)**2 for value in window)/(count - 1)) if count > 1 else 0.0
+    centre = (count - 1)/2
+    spread = sum((index - centre)**2 for index in range(count))
+    slope = sum((index - centre)*(value - mean) for index, value in enumerate(window))/spread if spread else 0.0
+    return mean, deviation, slope
+
+def get_drift(chart, limits=(None, None)):
+    """Returns the drifts (keys of DRIFTS) of a chart against its limits."""
+    if chart['count'] < MIN_COUNT:
+        return []
+    drift = []
+    sigma = get_standard_deviation(chart)
+    if sigma > 0 and abs(chart['ewma'] - chart['mean']) > EWMA_WIDTH*sigma*math.sqrt(EWMA_WEIGHT/(2 - EWMA_WEIGHT)):
+        drift.append('shift')
+    mean, deviation, slope = get_window_statistics(chart['window'])
+    projected = mean + slope*((len(chart['window']) - 1)/2 + TREND_MODULES)
+    lower, upper = limits
+    if lower is not None:
+        if mean - LIMIT_SIGMAS*deviation < lower:
+            drift.append('near_lower')
+        elif projected < lower:
+            drift.append('trend_lower')
+    if upper is not None:
+        if mean + LIMIT_SIGMAS*deviation > upper:
+            drift.append('near_upper')
+        elif projected > upper:
+            drift.append('trend_upper')
+    return drift
+
+def update_charts(charts, module_type, rows):
+    """Adds the (result, feature, axis, value) rows of a module to the charts dictionary, creating charts as
+    needed. Returns the keys of the charts updated."""
+    limits = get_limits()
+    keys = []
+    for result, feature, axis, value in rows:
+        key = get_key(module_type, result, feature, axis)
+        chart = charts.setdefault(key, new_chart())
+        add_value(chart, value)
+        chart['drift'] = get_drift(chart, limits.get((result, axis), (None, None)))
+        keys.append(key)
+    return keys
+
+def load_charts(connection, module_type=None):
+    """Returns a dictionary of the charts of the module type, or of all types, by key."""
+    query = 'SELECT * FROM charts' + (' WHERE module_type = ?' if module_type is not None else '')
+    charts = dict()
+    for row in connection.execute(query, (module_type,) if module_type is not None else ()):
+        chart = {name: row[name] for name in ('count', 'mean', 'm2', 'ewma')}
+        chart['window'] = json.loads(row['window'])
+        chart['drift'] = json.loads(row['drift'])
+        charts[(row['module_type'], row['result'], row['feature'], row['axis'])] = chart
+    return charts
+
+def save_charts(connection, charts, keys=None):
+    """Writes the charts of the keys, or all, to the results index. Does not commit."""
+    updated = datetime.now().isoformat()
+    connection.executemany('INSERT OR REPLACE INTO charts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+        key + (charts[key]['count'], charts[key]['mean'], charts[key]['m2'], charts[key]['ewma'],
+               json.dumps(charts[key]['window']), json.dumps(charts[key]['drift']), updated)
+        for key in (keys if keys is not None else charts)])
+
+def update(connection, module_type, rows):
+    """Adds the (result, feature, axis, value) rows of a new module to its charts in the results index.
+    Returns a list of (key, drift) of the charts that drift. Does not commit."""
+    module_type = module_type or ''
+    charts = load_charts(connection, module_type)
+    keys = update_charts(charts, module_type, rows)
+    save_charts(connection, charts, keys)
+    return [(key, charts[key]['drift']) for key in keys if charts[key]['drift']]
+
+def rebuild(connection, runs):
+    """Replaces the charts with those of the (module type, rows) of the runs, in the order measured.
+    Does not commit."""
+    charts = dict()
+    for module_type, rows in runs:
+        update_charts(charts, module_type, rows)
+    connection.execute('DELETE FROM charts')
+    save_charts(connection, charts)
+    return len(charts)
+
+def get_message(key, drift):
+    """Returns a line telling the user of the drifts of a chart."""
+    module_type, result, feature, axis = key
+    name = ' '.join(part for part in (module_type, result, feature, axis) if part)
+    return 'SPC drift in ' + name + ': ' + ', '.join(DRIFTS[item] for item in drift)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show the control charts of the results of the processed modules.')
+    parser.add_argument('--index', default=None, help='results index file (default: the results index)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    chart_parser = commands.add_parser('chart', help='statistics of the charts of a result, e.g. ABC0_GLUE_THICKNESS or BOW')
+    chart_parser.add_argument('result', help='name of the result')
+    chart_parser.add_argument('--module-type', default=None, help='only modules of this type')
+    chart_parser.add_argument('--feature', default=None, help='only this feature, e.g. ABC_R5H0_3')
+    commands.add_parser('drift', help='list the charts that drift')
+    commands.add_parser('rebuild', help='recompute the charts from the runs in the results index')
+    args = parser.parse_args(argv)
+
+    import module_results_index as results_index
+    connection = results_index.open_index(args.index)
+    if args.command == 'rebuild':
+        with connection:
+            count = results_index.rebuild_charts(connection)
+        print(f'Rebuilt {count} charts.')
+        return 0
+
+    charts = load_charts(connection, args.module_type if args.command == 'chart' else None)
+    if args.command == 'drift':
+        drifting = [(key, chart['drift']) for key, chart in sorted(charts.items()) if chart['drift']]
+        for key, drift in drifting:
+            print(get_message(key, drift))
+        if not drifting:
+            print('No chart drifts.')
+        return 1 if drifting else 0
+
+    limits = get_limits()
+    keys = [key for key in sorted(charts) if key[1] == args.result and args.feature in (None, key[2])]
+    if not keys:
+        print('No charts of ' + args.result)
+        return 1
+    print('type  feature            axis  count      mean     sigma      ewma    recent    limits         drift')
+    for key in keys:
+        chart = charts[key]
+        recent, _, _ = get_window_statistics(chart['window'])
+        lower, upper = limits.get((key[1], key[3] or None), (None, None))
+        limit_text = ('-' if lower is None else str(lower)) + '..' + ('-' if upper is None else str(upper))
+        print(f'{key[0] or "-":4s}  {key[2] or "-":17s}  {key[3] or "-":4s}  {chart["count"]:5d}  {chart["mean"]:8.2f}  '
+              f'{get_standard_deviation(chart):8.2f}  {chart["ewma"]:8.2f}  {recent:8.2f}  {limit_text:13s}  '
+              f'{",".join(chart["drift"]) or "-"}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""Records how long each stage of the conversion and upload takes, when tracing is enabled.
+
+Tracing is off unless the MODULE_TRACE environment variable names a trace file (or enable() is called). Each
+stage then appends one JSON line with its wall and CPU time, the module it was run for and its payload size, and
+its peak memory if MODULE_TRACE_MEMORY is set, as tracemalloc slows everything down. The trace file is rotated
+at MAX_BYTES. Worker processes write to their own file next to it, named with their process id, so that no two
+processes rotate the same file. Run this module to print the percentiles of each stage of a trace.
+
+Usage:
+    set MODULE_TRACE=trace.jsonl
+    python module_batch_upload.py metrology module_metrology_data/metrology_data
+    python module_stage_timing.py trace.jsonl
+"""
+import argparse
+import contextlib
+import functools
+import glob
+import json
+import logging
+import logging.handlers
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+TRACE_ENV = 'MODULE_TRACE'
+MEMORY_ENV = 'MODULE_TRACE_MEMORY'
+MAX_BYTES = 10 * 2**20
+BACKUP_COUNT = 3
+LOGGER = logging.getLogger('module_stage_timing')
+LOGGER.propagate = False
+HANDLER = None
+TRACE_PATH = None
+TRACE_MEMORY = False
+TRACE_PID = None # Process that opened the trace file, to reopen it in a forked worker.
+CONTEXT = threading.local()
+OPEN_STAGES = [] # Peak memory of each stage still running, for tracemalloc.
+OPEN_STAGES_LOCK = threading.Lock()
+
+def get_trace_path(path):
+    """Returns the trace file of this process: path itself in the main process, or path with the process id
+    added in a worker process."""
+    import multiprocessing
+    if multiprocessing.parent_process() is None:
+        return path
+    stem, extension = os.path.splitext(path)
+    return stem + '.' + str(os.getpid()) + extension
+
+def enable(path, memory=False):
+    """Starts appending the stages of this process to the trace file at path, with their peak memory if memory."""
+    global HANDLER, TRACE_PATH, TRACE_MEMORY, TRACE_PID
+    disable()
+    TRACE_PATH, TRACE_MEMORY, TRACE_PID = path, memory, os.getpid()
+    path = get_trace_path(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT)
+    LOGGER.addHandler(handler)
+    LOGGER.setLevel(logging.INFO)
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    HANDLER = handler
+
+def disable():
+    """Stops tracing."""
+    global HANDLER
+    handler, HANDLER = HANDLER, None
+    if handler is not None:
+        LOGGER.removeHandler(handler)
+        handler.close()
+
+def enabled():
+    return HANDLER is not None
+
+@contextlib.contextmanager
+def module(name):
+    """Marks the stages run by this thread within the block as stages of the module."""
+    previous = getattr(CONTEXT, 'module', None)
+    CONTEXT.module = name
+    try:
+        yield
+    finally:
+        CONTEXT.module = previous
+
+def get_module_name(file):
+    """Returns the serial number at the start of the name of a raw or standard format file."""
+    return os.path.basename(file).split('_')[0]
+
+def write_record(record):
+    """Appends a record to the trace."""
+    LOGGER.info(json.dumps(record, default=str))
+
+def update_peaks():
+    """Raises the peak memory of every running stage to the peak since the last update."""
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    for peaks in OPEN_STAGES:
+        peaks[0] = max(peaks[0], peak)
+
+@contextlib.contextmanager
+def stage(name, **fields):
+    """Times the block as a stage. The fields (for example bytes for a payload size) are added to its record,
+    and the block may add more to the dictionary it is given."""
+    if HANDLER is None:
+        yield fields
+        return
+    if TRACE_PID != os.getpid():
+        enable(TRACE_PATH, TRACE_MEMORY)
+    record = {'time': datetime.now().isoformat(timespec='milliseconds'), 'stage': name,
+              'module': getattr(CONTEXT, 'module', None)}
+    record.update(fields)
+    memory = tracemalloc.is_tracing()
+    if memory:
+        with OPEN_STAGES_LOCK:
+            update_peaks()
+            start_memory = tracemalloc.get_traced_memory()[0]
+            peaks = [start_memory]
+            OPEN_STAGES.append(peaks)
+    start_cpu = time.thread_time()
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as error:
+        record['error'] = repr(error)
+        raise
+    finally:
+        record['wall'] = time.perf_counter() - start
+        record['cpu'] = time.thread_time() - start_cpu
+        if memory:
+            with OPEN_STAGES_LOCK:
+                update_peaks()
+                OPEN_STAGES.remove(peaks)
+            record['peak_kb'] = (peaks[0] - start_memory)/1024
+        record['pid'] = os.getpid()
+        record['thread'] = threading.current_thread().name
+        write_record(record)
+
+def traced(name, describe=None):
+    """Decorates a function to time each call as a stage. describe(*args, **kwargs) returns the fields of the
+    record of a call, such as its file or payload size."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if HANDLER is None:
+                return function(*args, **kwargs)
+            with stage(name, **(describe(*args, **kwargs) if describe is not None else {})):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def describe_file(file, *args, **kwargs):
+    """Returns the fields of a stage that reads a file."""
+    return {'file': os.path.basename(file), 'bytes': os.path.getsize(file)}
+
+def describe_points(data_dictionary, *args, **kwargs):
+    """Returns the fields of a stage that processes a dictionary of points."""
+    return {'points': sum(len(points) for points in data_dictionary.values())}
+
+def read_trace(paths):
+    """Returns the records of the trace files, with their rotated and worker process files."""
+    records = []
+    for path in paths:
+        stem, extension = os.path.splitext(path)
+        files = set(glob.glob(path + '*')) | set(glob.glob(stem + '.*' + extension + '*'))
+        for file in sorted(files):
+            with open(file) as trace_file:
+                for line in trace_file:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue # A line cut short by a crash.
+    return records
+
+def summarize(records):
+    """Returns a dictionary of the count and statistics of each stage, in order of total wall time."""
+    import numpy as np
+    stages = dict()
+    for record in records:
+        stages.setdefault(record['stage'], []).append(record)
+    summary = dict()
+    for name, stage_records in stages.items():
+        wall = np.array([record['wall'] for record in stage_records])
+        cpu = np.array([record['cpu'] for record in stage_records])
+        peaks = [record['peak_kb'] for record in stage_records if 'peak_kb' in record]
+        sizes = [record['bytes'] for record in stage_records if 'bytes' in record]
+        summary[name] = {'count': len(stage_records), 'errors': sum('error' in record for record in stage_records),
+                         'total': wall.sum(), 'p50': np.percentile(wall, 50), 'p90': np.percentile(wall, 90),
+                         'p99': np.percentile(wall, 99), 'cpu': cpu.mean(), 'peak_kb': max(peaks) if peaks else None,
+                         'bytes': np.mean(sizes) if sizes else None,
+                         'modules': len({record['module'] for record in stage_records if record.get('module')})}
+    return dict(sorted(summary.items(), key=lambda item: -item[1]['total']))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print the percentiles of the time of each stage of a trace.')
+    parser.add_argument('trace', nargs='+', help='trace file(s), with their rotated and worker process files')
+    parser.add_argument('--module', default=None, help='only the stages of this module')
+    args = parser.parse_args(argv)
+
+    records = read_trace(args.trace)
+    if args.module is not None:
+        records = [record for record in records if record.get('module') == args.module]
+    if not records:
+        print('No stages in ' + ', '.join(args.trace))
+        return 1
+    print('stage                              count  errors  p50 [ms]  p90 [ms]  p99 [ms]  cpu [ms]  total [s]  peak [kB]  bytes')
+    for name, statistics in summarize(records).items():
+        peak = f'{statistics["peak_kb"]:9.0f}' if statistics['peak_kb'] is not None else '        -'
+        size = f'{statistics["bytes"]:0.0f}' if statistics['bytes'] is not None else '-'
+        print(f'{name:33s}  {statistics["count"]:5d}  {statistics["errors"]:6d}  {statistics["p50"]*1000:8.1f}  '
+              f'{statistics["p90"]*1000:8.1f}  {statistics["p99"]*1000:8.1f}  {statistics["cpu"]*1000:8.1f}  '
+              f'{statistics["total"]:9.2f}  {peak}  {size}')
+    return 0
+
+if os.environ.get(TRACE_ENV):
+    enable(os.environ[TRACE_ENV], bool(os.environ.get(MEMORY_ENV)))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""Measures how long the scripts take to start: the import time of each module and the time until the window
+of each GUI is drawn, both in a fresh interpreter as when an operator opens a tool.
+
+The import times come from python -X importtime, with the slow dependencies (matplotlib, scipy, itkdb and
+requests) that each module loads. The time to first window runs the GUI with its main loop replaced by a
+single update, and is measured from starting the interpreter. It needs a display.
+
+Usage:
+    python module_startup_benchmark.py --repeat 5 --budget 1.5
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+MODULES = ('module_metrology', 'module_feature_classifier', 'module_metrology_cache', 'module_plot_renderer',
+           'module_itkdb_session', 'module_upload_journal', 'module_metrology_file_conversion',
+           'module_bow_file_conversion', 'module_metrology_upload', 'module_bow_upload')
+GUIS = ('module_metrology_file_conversion.py', 'module_bow_file_conversion.py', 'module_metrology_upload.py',
+        'module_bow_upload.py')
+SLOW_MODULES = ('matplotlib', 'scipy', 'itkdb', 'requests')
+WINDOW_BUDGET = 2.0 #seconds from starting a GUI to its window being drawn
+FIRST_WINDOW = '''
+import runpy, sys, tkinter
+def mainloop(self, n=0):
+    self.update()
+    print('WINDOW', flush=True)
+    self.destroy()
+tkinter.Misc.mainloop = mainloop
+sys.argv = [sys.argv[1]]
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''
+
+def get_path():
+    """Returns the folder of the scripts, where they are run from."""
+    return os.path.dirname(os.path.abspath(__file__))
+
+def time_import(module):
+    """Imports a module in a new interpreter. Returns (seconds, the slow dependencies it loaded)."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=get_path(),
+                            capture_output=True, text=True)
+    seconds = None
+    loaded = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or line.count('|') != 2:
+            continue
+        _, cumulative, name = line.split('|')
+        name = name.strip()
+        if name == module:
+            seconds = int(cumulative)/1e6
+        if name in SLOW_MODULES:
+            loaded.add(name)
+    if seconds is None:
+        raise RuntimeError('Could not import ' + module + ': ' + result.stderr.strip().splitlines()[-1])
+    return seconds, sorted(loaded)
+
+def time_first_window(script, timeout=60):
+    """Starts a GUI in a new interpreter. Returns the seconds until its window was drawn, or None if it could
+    not be shown (no display)."""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', FIRST_WINDOW, script], cwd=get_path(),
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        for line in process.stdout:
+            if line.startswith('WINDOW'):
+                return time.perf_counter() - start
+        return None
+    finally:
+        process.stdout.close()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the import time of the modules and the startup time of the GUIs.')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each measurement, the median is shown (default: %(default)s)')
+    parser.add_argument('--budget', type=float, default=WINDOW_BUDGET, help='seconds allowed until a window is drawn (default: %(default)s)')
+    parser.add_argument('--no-windows', action='store_true', help='only measure the imports')
+    args = parser.parse_args(argv)
+
+    print('module                              import [ms]  slow dependencies')
+    for module in MODULES:
+        runs = [time_import(module) for _ in range(args.repeat)]
+        print(f'{module:34s}  {np.median([run[0] for run in runs])*1000:11.0f}  {", ".join(runs[-1][1]) or "-"}')
+    if args.no_windows:
+        return 0
+
+    print()
+    print('GUI                                 first window [ms]')
+    over_budget = False
+    for script in GUIS:
+        runs = [time_first_window(script) for _ in range(args.repeat)]
+        if None in runs:
+            print(f'{script:34s}  could not open a window (no display?)')
+            continue
+        seconds = np.median(runs)
+        over_budget = over_budget or seconds > args.budget
+        print(f'{script:34s}  {seconds*1000:17.0f}' + ('  over budget' if seconds > args.budget else ''))
+    return 1 if over_budget else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
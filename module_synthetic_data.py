@@ -0,0 +1,202 @@
+"""Generates synthetic modules for testing and benchmarking: raw CMM files as exported by the CMM, in the 4 or
+5+ column layout, and standard format files as written by the conversion GUIs, for metrology and bow.
+
+The fiducials of each module type come from its position file, and the features are named as in real files:
+H_R[0-5]H[0-1]_n and ABC_R[0-5]H[0-1]_n glue points on each hybrid, PB_n glue points and C1..C8 capacitors on
+the powerboard, Shield and Sensor_n. Positions are offset, and heights and bow drawn, around the values the
+upload GUIs accept, so that most modules pass. The points of a module are tilted by a random plane.
+
+Usage:
+    python module_synthetic_data.py synthetic --modules 20 --types M0 5R --sensor-points 400 --tilt 0.002
+"""
+import argparse
+import contextlib
+import csv
+import io
+import math
+import os
+import sys
+import numpy as np
+import module_metrology as mm
+import module_feature_classifier as fc
+import module_metrology_file_conversion as metrology_conversion
+import module_bow_file_conversion as bow_conversion
+import module_metrology_upload as metrology_upload
+import module_bow_upload as bow_upload
+
+SENSOR_POINTS = 20 # Sensor points of a metrology file.
+BOW_POINTS = 200 # Sensor points of a bow file.
+TILT = 0.002 # Largest slope of the plane the module is tilted by.
+POSITION_SIGMA = 50 #um
+GLUE_THICKNESS = 110 #um
+GLUE_SIGMA = 15 #um, between modules
+POINT_SIGMA = 5 #um, between points of a module
+CAP_HEIGHT = 1100 #um
+SHIELD_HEIGHT = 5900 #um
+BOW = 100 #um
+BOW_SIGMA = 40 #um
+HYBRID_POINTS = 3 # H_..._n glue points of each hybrid.
+ABC_POINTS = 10 # ABC_..._n glue points of each hybrid.
+PB_POINTS = 5
+MANIFEST_OPERATOR = 'Synthetic'
+SERIAL_PREFIX = 'SYNTH' # In place of 20USE, so that no synthetic module has the serial number of a real one.
+RAW_HEADERS = {4: 'Feature Type,Feature Label,Element,Actual',
+               5: 'Feature Type,Feature Label,Feature ID,Element,Actual'}
+ELEMENTS = ('Coord. X', 'Coord. Y', 'Coord. Z')
+
+def get_serial_number(module_type, index):
+    """Returns the serial number of the synthetic module of the type with the index, laid out as a real one."""
+    return SERIAL_PREFIX + module_type + f'{index:07d}'
+
+def get_sensor_grid(module_type, count):
+    """Returns an (count,2) array of X, Y points on a regular grid over the sensor of the module type."""
+    xy = mm.get_position_table(module_type, metrology_conversion.PATH_TO_POSITION_FILES)['xy']
+    width = xy[:, 0].max() + 5
+    height = xy[:, 1].max() + 10
+    columns = max(math.ceil(math.sqrt(count*width/height)), 1)
+    rows = math.ceil(count/columns)
+    x, y = np.meshgrid(np.linspace(0, width, columns), np.linspace(-5, height, rows))
+    return np.column_stack((x.ravel(), y.ravel()))[:count]
+
+def get_line(start, end, count, offset):
+    """Returns (count,2) X, Y points spread along the line from start to end, moved by offset in Y."""
+    t = (np.arange(count) + 0.5)/count
+    return np.column_stack((start[0] + (end[0] - start[0])*t, start[1] + (end[1] - start[1])*t + offset))
+
+def make_metrology_features(module_type, rng, sensor_points=SENSOR_POINTS, points_per_feature=1, fail=False):
+    """Returns a dictionary of feature label to (n,3) points in mm of a module without tilt, in the coordinates
+    of the standard format files. A failing module has thin glue under its first hybrid."""
+    positions = mm.get_position_table(module_type, metrology_conversion.PATH_TO_POSITION_FILES)['positions']
+    features = dict()
+    features['Module_Origin'] = np.zeros((1, 3))
+    for name, (x, y) in positions.items():
+        offset = rng.normal(0, POSITION_SIGMA/1000, 2)
+        features[name] = np.array([[x + offset[0], y + offset[1], 0.0]])
+
+    def add_glue(label, xy, thickness, flex_thickness):
+        xy = np.repeat(xy[None], points_per_feature, axis=0) + rng.normal(0, 0.05, (points_per_feature, 2))
+        heights = (thickness + flex_thickness + rng.normal(0, POINT_SIGMA, points_per_feature))/1000
+        features[label] = np.column_stack((xy, heights))
+
+    hybrids = sorted({name.rsplit('_', 1)[0][2:] for name in positions if name.startswith('H_')}, key=fc.natural_keys)
+    for index, hybrid in enumerate(hybrids):
+        start, end = positions['H_' + hybrid + '_P1'], positions['H_' + hybrid + '_P2']
+        thickness = rng.normal(GLUE_THICKNESS, GLUE_SIGMA) if not (fail and index == 0) else 25
+        for point, xy in enumerate(get_line(start, end, HYBRID_POINTS, -8)):
+            add_glue('H_' + hybrid + '_' + str(point), xy, thickness, metrology_upload.HYBRID_FLEX_THICKNESS)
+        for point, xy in enumerate(get_line(start, end, ABC_POINTS, -4)):
+            add_glue('ABC_' + hybrid + '_' + str(point), xy, thickness, metrology_upload.HYBRID_FLEX_THICKNESS)
+    if 'PB_P1' in positions:
+        start, end = positions['PB_P1'], positions['PB_P2']
+        thickness = rng.normal(GLUE_THICKNESS, GLUE_SIGMA)
+        for point, xy in enumerate(get_line(start, end, PB_POINTS, -3), start=1):
+            add_glue('PB_' + str(point), xy, thickness, metrology_upload.PB_FLEX_THICKNESS)
+        for point, xy in enumerate(get_line(start, end, 4 if module_type.startswith('M') else 8, 3), start=1):
+            features['C' + str(point)] = np.array([[xy[0], xy[1], rng.normal(CAP_HEIGHT, 20)/1000]])
+        shield = get_line(start, end, points_per_feature, 6)
+        features['Shield'] = np.column_stack((shield, rng.normal(SHIELD_HEIGHT, 30, len(shield))/1000))
+    features['Sensor'] = np.column_stack((get_sensor_grid(module_type, sensor_points),
+                                          rng.normal(0, 0.002, sensor_points)))
+    return features
+
+def make_bow_features(module_type, rng, sensor_points=BOW_POINTS, fail=False):
+    """Returns {'Sensor': (n,3) points} of a module bowed by a quadratic surface, without tilt. A failing
+    module is bowed beyond BOW_RANGE."""
+    xy = get_sensor_grid(module_type, sensor_points)
+    bow = rng.normal(BOW, BOW_SIGMA) if not fail else bow_upload.BOW_RANGE[1] + 100
+    centre = (xy.min(axis=0) + xy.max(axis=0))/2
+    radius = np.maximum((xy.max(axis=0) - xy.min(axis=0))/2, 1e-9)
+    surface = (((xy - centre)/radius)**2).sum(axis=1)/2 # Lowest at the centre, for a positive bow.
+    return {'Sensor': np.column_stack((xy, (bow*surface + rng.normal(0, 2, len(xy)))/1000))}
+
+def tilt_features(features, rng, tilt=TILT):
+    """Returns a copy of the features tilted by a random plane with slopes of at most tilt."""
+    a, b = rng.uniform(-tilt, tilt, 2)
+    c = rng.uniform(-0.5, 0.5)
+    tilted = dict()
+    for label, points in features.items():
+        points = points.copy()
+        points[:, 2] += a*points[:, 0] + b*points[:, 1] + c
+        tilted[label] = points
+    return tilted
+
+def write_cmm_file(filename, features, columns=5):
+    """Writes features to a raw CMM file in the 4 or 5 column layout. Sensor points each get their own
+    Sensor_n label, as the CMM exports them. Y is flipped back to the coordinates of the CMM."""
+    feature_id = 0
+    with open(filename, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(RAW_HEADERS[columns].split(','))
+        for label, points in features.items():
+            for index, point in enumerate(points):
+                feature_id += 1
+                name = 'Sensor_' + str(index + 1) if label == 'Sensor' else label
+                for element, value in zip(ELEMENTS, (point[0], -point[1], point[2])):
+                    fields = [name, feature_id, element, f'{value:12.6f}'] if columns == 5 else [name, element, f'{value:12.6f}']
+                    writer.writerow(['Point'] + fields)
+
+def generate_module(path, module_type, index, rng, sensor_points=SENSOR_POINTS, bow_points=BOW_POINTS,
+                    points_per_feature=1, tilt=TILT, columns=5, fail=False):
+    """Writes the raw metrology and bow files and the standard format files of one module under path.
+    Returns a dictionary with the serial number, module type and the paths of the four files."""
+    serial_number = get_serial_number(module_type, index)
+    module = {'serial_number': serial_number, 'module_type': module_type, 'run_number': '1', 'failed': fail}
+    for test, conversion, features in (
+            ('metrology', metrology_conversion, make_metrology_features(module_type, rng, sensor_points, points_per_feature, fail)),
+            ('bow', bow_conversion, make_bow_features(module_type, rng, bow_points, fail))):
+        features = tilt_features(features, rng, tilt)
+        raw_file = os.path.join(path, 'raw_data', test, serial_number + '_' + module_type + '_Module_' + test.capitalize() + '.csv')
+        os.makedirs(os.path.dirname(raw_file), exist_ok=True)
+        write_cmm_file(raw_file, features, columns)
+
+        # The standard file holds the same tilted points, as the conversion would have written them.
+        data_dict = {('Sensor' if label == 'Sensor' else mm.normalize_feature_name(label)): points for label, points in features.items()}
+        with contextlib.redirect_stdout(io.StringIO()):
+            converted = conversion.convert_data(data_dict, module_type, mm.get_date(raw_file))
+        data_file = os.path.join(path, test + '_data', os.path.basename(conversion.get_output_path(serial_number, module_type, 1)))
+        os.makedirs(os.path.dirname(data_file), exist_ok=True)
+        conversion.write_standard_file(data_file, converted, serial_number, MANIFEST_OPERATOR, 1)
+        module[test + '_raw'] = raw_file
+        module[test + '_data'] = data_file
+    return module
+
+def generate(path, count, module_types=mm.MODULE_TYPES, seed=0, fail_fraction=0.0, **options):
+    """Writes count synthetic modules under path, cycling through the module types, with a manifest for the
+    batch conversion of each test. Takes the options of generate_module. Returns the list of modules."""
+    rng = np.random.default_rng(seed)
+    modules = []
+    for index in range(count):
+        module_type = module_types[index % len(module_types)]
+        fail = rng.random() < fail_fraction
+        modules.append(generate_module(path, module_type, index, rng, fail=fail, **options))
+    for test in ('metrology', 'bow'):
+        with open(os.path.join(path, 'manifest_' + test + '.csv'), 'w', newline='') as manifest_file:
+            writer = csv.writer(manifest_file)
+            writer.writerow(('file', 'serial_number', 'module_type', 'run_number', 'operator'))
+            for module in modules:
+                writer.writerow((os.path.basename(module[test + '_raw']), module['serial_number'],
+                                 module['module_type'], module['run_number'], MANIFEST_OPERATOR))
+    return modules
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic raw CMM and standard format files.')
+    parser.add_argument('output', help='folder to write the files to')
+    parser.add_argument('--modules', type=int, default=10, help='number of modules (default: %(default)s)')
+    parser.add_argument('--types', nargs='+', default=list(mm.MODULE_TYPES), choices=mm.MODULE_TYPES, help='module types to cycle through (default: all)')
+    parser.add_argument('--sensor-points', type=int, default=SENSOR_POINTS, help='sensor points of a metrology file (default: %(default)s)')
+    parser.add_argument('--bow-points', type=int, default=BOW_POINTS, help='sensor points of a bow file (default: %(default)s)')
+    parser.add_argument('--points-per-feature', type=int, default=1, help='points of each glue point and the shield (default: %(default)s)')
+    parser.add_argument('--tilt', type=float, default=TILT, help='largest slope of the tilt of a module (default: %(default)s)')
+    parser.add_argument('--columns', type=int, choices=(4, 5), default=5, help='layout of the raw files (default: %(default)s)')
+    parser.add_argument('--fail-fraction', type=float, default=0.0, help='fraction of modules made to fail (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    modules = generate(args.output, args.modules, args.types, args.seed, args.fail_fraction,
+                       sensor_points=args.sensor_points, bow_points=args.bow_points,
+                       points_per_feature=args.points_per_feature, tilt=args.tilt, columns=args.columns)
+    print(f'Wrote {len(modules)} modules to {args.output} ({sum(module["failed"] for module in modules)} made to fail).')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
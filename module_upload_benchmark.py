@@ -0,0 +1,111 @@
+"""Benchmarks the upload of test runs and attachments against the local ITkDB stand-in.
+
+Makes N synthetic modules by copying a standard format file with synthetic serial numbers, then uploads them with the
+batch uploader (processing, upload journal, session and thread pool included) at each concurrency, and reports
+the requests per second, the p50 and p99 latency of the requests and the bytes sent.
+
+Usage:
+    python module_upload_benchmark.py --modules 200 --concurrency 1 4 8 --latency 0.05
+"""
+import argparse
+import contextlib
+import glob
+import io
+import os
+import re
+import sys
+import tempfile
+import time
+import numpy as np
+import module_itkdb_mock_server as mock_server
+import module_itkdb_session as itkdb_session
+import module_upload_journal as upload_journal
+import module_upload_schema as upload_schema
+import module_metrology_cache as cache
+import module_batch_upload as batch_upload
+import module_synthetic_data as synthetic_data
+
+DEFAULT_TEMPLATES = 'module_metrology_data/bow_data/uploaded/*_MODULE_BOW_*.dat'
+
+def make_modules(template, count, path):
+    """Writes count copies of a standard format file to path, each with its own synthetic serial number of the
+    module type of the file. Returns the list of files."""
+    with open(template) as template_file:
+        text = template_file.read()
+    serial_number = re.search(r'Module ref\. Number:\s*(\S+)', text, re.IGNORECASE).group(1)
+    test = 'MODULE_BOW' if '_MODULE_BOW_' in os.path.basename(template) else 'MODULE_METROLOGY'
+    files = []
+    for index in range(count):
+        new_serial_number = synthetic_data.get_serial_number(serial_number[5:7], index)
+        file = os.path.join(path, new_serial_number + '_' + test + '_001.dat')
+        with open(file, 'w') as module_file:
+            module_file.write(text.replace(serial_number, new_serial_number))
+        files.append(file)
+    return files
+
+def run_benchmark(files, test, server, concurrency, rate, options):
+    """Uploads the files to the server with a new journal and results index, so that the synthetic modules never
+    reach the real ones. Returns a dictionary of the measurements."""
+    with server.signing_keys():
+        client = itkdb_session.get_client('mock', 'mock', server.get_url('api'), server.get_url('auth'),
+                                          max(concurrency, itkdb_session.POOL_SIZE))
+    requests_sent = []
+    def record_response(response, *args, **kwargs):
+        requests_sent.append(response)
+    client.hooks['response'].append(record_response)
+    with tempfile.TemporaryDirectory() as journal_path:
+        connection = upload_journal.open_journal(os.path.join(journal_path, 'journal.sqlite'))
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                outcomes = batch_upload.upload_files(test, files, client, options, concurrency, rate, False, connection,
+                                                     index_path=os.path.join(journal_path, 'results_index.sqlite'))
+        finally:
+            elapsed = time.perf_counter() - start
+            client.hooks['response'].remove(record_response)
+            connection.close()
+    latencies = np.array([response.elapsed.total_seconds() for response in requests_sent])
+    bytes_sent = sum(len(response.request.body or b'') for response in requests_sent)
+    return {'concurrency': concurrency, 'modules': len(files), 'failed': sum(outcome[3] is not None for outcome in outcomes),
+            'seconds': elapsed, 'requests': len(requests_sent), 'requests_per_second': len(requests_sent)/elapsed,
+            'modules_per_second': len(files)/elapsed, 'p50': np.percentile(latencies, 50) if len(latencies) else 0.0,
+            'p99': np.percentile(latencies, 99) if len(latencies) else 0.0, 'bytes_sent': bytes_sent}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark uploads against the local ITkDB stand-in.')
+    parser.add_argument('--modules', type=int, default=100, help='number of synthetic modules (default: %(default)s)')
+    parser.add_argument('--template', default=None, help='standard format file to copy (default: an uploaded bow file)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8], help='concurrencies to run (default: 1 4 8)')
+    parser.add_argument('--rate', type=float, default=0, help='maximum requests per second, 0 for no limit (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds the server takes per request (default: %(default)s)')
+    parser.add_argument('--error', action='append', default=[], metavar='CODE:PROBABILITY', help='inject errors, as for the server')
+    args = parser.parse_args(argv)
+
+    template = os.path.abspath(args.template or sorted(glob.glob(DEFAULT_TEMPLATES))[0])
+    test = 'bow' if '_MODULE_BOW_' in os.path.basename(template) else 'metrology'
+    options = {'problems': False, 'stage': None, 'jig': 'BENCHMARK', 'temperature': '20'}
+    server = mock_server.start_server(latency=args.latency, errors=mock_server.parse_errors(args.error), seed=0,
+                                      default_location=batch_upload.UPLOADERS[test].INSTITUTE)
+    print(f'{args.modules} {test} modules from {template}, server latency {args.latency*1000:0.0f} ms.')
+    print('concurrency  modules/s  requests/s  p50 [ms]  p99 [ms]  kB sent  failed')
+    with tempfile.TemporaryDirectory() as path:
+        # Run in the temporary folder so that uploaded files are moved within it, with caches of its own.
+        cwd = os.getcwd()
+        cache_path, schema_path = cache.PATH_TO_CACHE, upload_schema.PATH_TO_SCHEMAS
+        os.chdir(path)
+        cache.PATH_TO_CACHE = os.path.join(path, 'cache')
+        upload_schema.PATH_TO_SCHEMAS = os.path.join(path, 'cache', 'test_types.json')
+        try:
+            for concurrency in args.concurrency:
+                files = make_modules(template, args.modules, tempfile.mkdtemp(dir=path))
+                result = run_benchmark(files, test, server, concurrency, args.rate, options)
+                print(f'{concurrency:11d}  {result["modules_per_second"]:9.1f}  {result["requests_per_second"]:10.1f}  '
+                      f'{result["p50"]*1000:8.1f}  {result["p99"]*1000:8.1f}  {result["bytes_sent"]/1000:7.0f}  {result["failed"]:6d}')
+        finally:
+            os.chdir(cwd)
+            cache.PATH_TO_CACHE, upload_schema.PATH_TO_SCHEMAS = cache_path, schema_path
+    server.shutdown()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Journal of the uploads to the ITkDB, kept in a SQLite file so that no upload is lost or made twice.
+
+Every test run is entered in the journal before it is uploaded, keyed by (component, testType, runNumber),
+and each step of its upload is recorded as it happens:
+
+    pending  -> posting     the test run is being uploaded
+    posting  -> uploaded    the ITkDB returned the test run id, the data file is to be attached
+    uploaded -> completed   the data file is attached and moved to the uploaded folder
+
+Steps that fail because the ITkDB could not be reached are retried with exponential backoff, uploads the ITkDB
+refuses are marked failed. A test run left posting by a crash or a lost connection may already be in the ITkDB,
+so the ITkDB is searched for it before it is uploaded again.
+"""
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures, FIRST_COMPLETED
+import module_itkdb_session as itkdb_session
+
+PATH_TO_JOURNAL = 'module_metrology_data/upload_journal.sqlite'
+UPLOADED_PATHS = {'MODULE_BOW': 'module_metrology_data/bow_data/uploaded/',
+                  'MODULE_METROLOGY': 'module_metrology_data/metrology_data/uploaded/'}
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 2 #seconds, doubled after every failed attempt
+BACKOFF_MAX = 300 #seconds
+
+PENDING = 'pending'
+POSTING = 'posting'
+UPLOADED = 'uploaded'
+COMPLETED = 'completed'
+FAILED = 'failed'
+UNFINISHED = (PENDING, POSTING, UPLOADED)
+
+def get_journal_path():
+    """Returns the full path of the journal file."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), PATH_TO_JOURNAL)
+
+def open_journal(path=None):
+    """Opens the journal, creating it if needed, and returns the sqlite3 connection."""
+    path = path or get_journal_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    connection = sqlite3.connect(path, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('''CREATE TABLE IF NOT EXISTS uploads (
+        component TEXT, test_type TEXT, run_number TEXT, file TEXT, payload TEXT, state TEXT, test_run TEXT,
+        attempts INTEGER DEFAULT 0, next_attempt REAL DEFAULT 0, last_error TEXT, updated TEXT,
+        PRIMARY KEY (component, test_type, run_number))''')
+    connection.commit()
+    return connection
+
+def get_key(data_dict):
+    """Returns the journal key (component, testType, runNumber) of a data dictionary."""
+    return (data_dict['component'], data_dict['testType'], str(data_dict['runNumber']))
+
+def get_entry(connection, key):
+    """Returns the journal entry of a key as a dictionary, or None."""
+    row = connection.execute('SELECT * FROM uploads WHERE component=? AND test_type=? AND run_number=?', key).fetchone()
+    return dict(row) if row is not None else None
+
+def update_entry(connection, key, **fields):
+    """Sets fields of the journal entry of a key and commits."""
+    fields['updated'] = datetime.datetime.now().isoformat()
+    assignments = ', '.join(name + '=?' for name in fields)
+    with connection:
+        connection.execute('UPDATE uploads SET ' + assignments + ' WHERE component=? AND test_type=? AND run_number=?',
+                           tuple(fields.values()) + tuple(key))
+
+def enqueue(connection, data_dict):
+    """Enters the upload of a data dictionary in the journal and returns the state of its entry.
+    A completed upload is left as it is, so that it is never uploaded twice, and so is an upload part way
+    through. A failed upload is reset with the new data."""
+    key = get_key(data_dict)
+    entry = get_entry(connection, key)
+    if entry is None:
+        with connection:
+            connection.execute('INSERT INTO uploads (component, test_type, run_number, file, payload, state, updated) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?)', key + (data_dict['results']['FILE'], json.dumps(data_dict),
+                               PENDING, datetime.datetime.now().isoformat()))
+        return PENDING
+    if entry['state'] in (COMPLETED, POSTING, UPLOADED):
+        return entry['state']
+    return reset_entry(connection, entry, data_dict)
+
+def reset_entry(connection, entry, data_dict=None):
+    """Resets a pending or failed upload to be tried again, with new data if given, and returns its state.
+    A test run already in the ITkDB only needs its file attached, one that failed while posting is searched
+    for in the ITkDB before it is uploaded again."""
+    key = (entry['component'], entry['test_type'], entry['run_number'])
+    if entry['test_run'] is not None:
+        state = UPLOADED
+    elif entry['last_error'] is not None and entry['last_error'].startswith(POSTING):
+        state = POSTING
+    else:
+        state = PENDING
+    fields = dict()
+    if data_dict is not None:
+        fields = {'file': data_dict['results']['FILE'], 'payload': json.dumps(data_dict)}
+    update_entry(connection, key, state=state, attempts=0, next_attempt=0, last_error=None, **fields)
+    return state
+
+def reset_failed(connection):
+    """Resets every failed upload in the journal to be tried again. Returns their keys."""
+    keys = []
+    for row in connection.execute('SELECT * FROM uploads WHERE state=?', (FAILED,)).fetchall():
+        reset_entry(connection, dict(row))
+        keys.append((row['component'], row['test_type'], row['run_number']))
+    return keys
+
+def get_unfinished_keys(connection):
+    """Returns the keys of every upload in the journal that is neither completed nor failed."""
+    rows = connection.execute('SELECT component, test_type, run_number FROM uploads WHERE state IN (%s)'
+                              % ','.join('?'*len(UNFINISHED)), UNFINISHED).fetchall()
+    return [tuple(row) for row in rows]
+
+def run_step(client, entry, wait=None):
+    """Runs the next step of an upload. Runs in a worker thread. Returns the new (state, test run id)."""
+    data_dict = json.loads(entry['payload'])
+    if wait is not None:
+        wait()
+    if entry['state'] in (PENDING, POSTING):
+        test_run = None
+        if entry['state'] == POSTING:
+            test_run = itkdb_session.find_test_run(client, data_dict)
+        if test_run is None:
+            test_run = itkdb_session.upload_test_run(client, data_dict)
+        return UPLOADED, test_run
+    itkdb_session.upload_attachment(client, entry['test_run'], entry['file'])
+    return COMPLETED, entry['test_run']
+
+def move_uploaded_file(entry):
+    """Moves the data file of a completed upload to the uploaded folder of its test type. Returns the new path."""
+    uploaded_path = UPLOADED_PATHS.get(entry['test_type'])
+    if uploaded_path is None or not os.path.isfile(entry['file']):
+        return entry['file']
+    if os.path.abspath(os.path.dirname(entry['file'])) == os.path.abspath(uploaded_path):
+        return entry['file']
+    os.makedirs(uploaded_path, exist_ok=True)
+    return shutil.move(entry['file'], os.path.join(uploaded_path, os.path.basename(entry['file'])))
+
+def record_failure(connection, entry, error, retry=True):
+    """Records a failed step, scheduling a retry with backoff if the failure is transient. Returns the new state."""
+    key = (entry['component'], entry['test_type'], entry['run_number'])
+    attempts = entry['attempts'] + 1
+    transient = not isinstance(error, itkdb_session.UploadError) or error.is_transient()
+    step = entry['state']
+    if step == PENDING and transient:
+        step = POSTING # The test run may have reached the ITkDB.
+    if transient and retry and attempts < MAX_ATTEMPTS:
+        state = step
+        next_attempt = time.time() + min(BACKOFF_BASE * 2**(attempts - 1), BACKOFF_MAX)
+    else:
+        state = FAILED
+        next_attempt = 0
+    update_entry(connection, key, state=state, attempts=attempts, next_attempt=next_attempt,
+                 last_error=step + ': ' + str(error))
+    return state
+
+def drain(connection, client, keys, concurrency=1, wait=None, retry=True, cancelled=None):
+    """Runs the uploads of the keys to completion on a thread pool, printing the outcome of each upload.
+    Failed steps are retried with backoff when retry is true, otherwise every upload is tried only once.
+    Once cancelled() returns true no further step is started, and the unfinished uploads are left in the
+    journal to be resumed. The journal is only written from this thread. Returns a list of
+    (file, test run id or None, seconds taken or None, error message or None) tuples."""
+    outcomes = []
+    waiting = list(keys)
+    started = dict()
+    running = dict()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while waiting or running:
+            if cancelled is not None and cancelled():
+                waiting = []
+            next_attempt = None
+            for key in list(waiting):
+                entry = get_entry(connection, key)
+                if entry is None or entry['state'] not in UNFINISHED:
+                    waiting.remove(key)
+                elif entry['next_attempt'] > time.time():
+                    next_attempt = min(next_attempt or entry['next_attempt'], entry['next_attempt'])
+                elif len(running) < concurrency:
+                    if entry['state'] == PENDING:
+                        update_entry(connection, key, state=POSTING) # Written before the test run is sent.
+                    started.setdefault(key, time.perf_counter())
+                    running[executor.submit(run_step, client, entry, wait)] = entry
+                    waiting.remove(key)
+            timeout = None if next_attempt is None else max(0.0, next_attempt - time.time())
+            if not running:
+                if next_attempt is not None:
+                    time.sleep(timeout)
+                continue
+            done, _ = wait_futures(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                entry = running.pop(future)
+                key = (entry['component'], entry['test_type'], entry['run_number'])
+                try:
+                    state, test_run = future.result()
+                except Exception as error:
+                    state = record_failure(connection, entry, error, retry)
+                    if state == FAILED:
+                        outcomes.append((entry['file'], None, None, str(error)))
+                        print('FAILED ' + entry['file'] + ': ' + str(error))
+                    else:
+                        print('RETRY  ' + entry['file'] + ': ' + str(error))
+                        waiting.append(key)
+                    continue
+                if state == COMPLETED:
+                    file = move_uploaded_file(entry)
+                    update_entry(connection, key, state=COMPLETED, file=file, last_error=None)
+                    seconds = time.perf_counter() - started[key]
+                    outcomes.append((entry['file'], test_run, seconds, None))
+                    print(f'OK     {entry["file"]} -> {test_run} ({seconds:0.2f} s)')
+                else:
+                    update_entry(connection, key, state=state, test_run=test_run, attempts=0, next_attempt=0)
+                    waiting.insert(0, key) # Attach the file as soon as possible.
+    return outcomes
@@ -0,0 +1,84 @@
+"""Checks a batch of uploads against the current state of their components in the ITkDB before any is sent.
+
+The location and stage of every component in the batch are fetched with a few getComponentBulk calls, and the
+test types of each stage with one getComponentTypeByCode call per component type. Both are kept for the rest of
+the session. A test run is rejected locally if its component is not at the institute, or if the stage it would
+be uploaded to does not have its test type, which are the errors the ITkDB would otherwise give after the upload.
+"""
+import threading
+import module_itkdb_session as itkdb_session
+
+BULK_SIZE = 100 # Components per getComponentBulk call.
+PROJECT = 'S' # Strips
+
+COMPONENTS = dict()
+STAGE_TEST_TYPES = dict()
+CACHE_LOCK = threading.Lock()
+
+def get_code(value):
+    """Returns the code of an ITkDB object given as a dictionary with a code, or as the code itself."""
+    return value.get('code') if isinstance(value, dict) else value
+
+def fetch_components(client, serial_numbers):
+    """Returns a dictionary of serial number to ITkDB component for the serial numbers, fetching those not
+    already cached in bulk. Serial numbers unknown to the ITkDB are left out. Raises UploadError on failure."""
+    with CACHE_LOCK:
+        missing = sorted({serial_number for serial_number in serial_numbers
+                          if (client.prefix_url, serial_number) not in COMPONENTS})
+    for start in range(0, len(missing), BULK_SIZE):
+        chunk = missing[start:start + BULK_SIZE]
+        try:
+            components = client.get('getComponentBulk', json={'component': chunk})
+        except Exception as error:
+            raise itkdb_session.UploadError('Could not fetch the components from the ITkDB: ' + str(error)) from error
+        with CACHE_LOCK:
+            for component in components:
+                COMPONENTS[(client.prefix_url, component.get('serialNumber'))] = component
+    with CACHE_LOCK:
+        return {serial_number: COMPONENTS[(client.prefix_url, serial_number)] for serial_number in serial_numbers
+                if (client.prefix_url, serial_number) in COMPONENTS}
+
+def get_stage_test_types(client, component_type):
+    """Returns a dictionary of stage code to the set of test type codes of the stage for a component type,
+    fetched once per session. Raises UploadError on failure."""
+    key = (client.prefix_url, component_type)
+    with CACHE_LOCK:
+        if key in STAGE_TEST_TYPES:
+            return STAGE_TEST_TYPES[key]
+    try:
+        definition = client.get('getComponentTypeByCode', json={'project': PROJECT, 'code': component_type})
+    except Exception as error:
+        raise itkdb_session.UploadError('Could not fetch the component type ' + component_type + ': ' + str(error)) from error
+    stage_test_types = dict()
+    for stage in definition.get('stages') or []:
+        stage_test_types[get_code(stage)] = {get_code(test_type.get('testType', test_type))
+                                             for test_type in stage.get('testTypes') or []}
+    with CACHE_LOCK:
+        STAGE_TEST_TYPES[key] = stage_test_types
+    return stage_test_types
+
+def check_component(component, data_dict, institute, stage_test_types):
+    """Returns the reason the test run of a data dictionary would be refused for its component, or None."""
+    if component is None:
+        return 'Component ' + data_dict['component'] + ' is not in the ITkDB'
+    location = get_code(component.get('currentLocation'))
+    if location != institute:
+        return itkdb_session.UPLOAD_ERROR_MESSAGES['componentAtDifferentLocation'] + f' ({location}, not {institute})'
+    stage = data_dict['stage'] if data_dict.get('isRetroactive') else get_code(component.get('currentStage'))
+    if data_dict['testType'] not in stage_test_types.get(stage, set()):
+        return itkdb_session.UPLOAD_ERROR_MESSAGES['unassociatedStageWithTestType'] + f' (stage {stage})'
+    return None
+
+def check_uploads(client, data_dicts, institute):
+    """Checks a list of data dictionaries against their components in the ITkDB. Returns a list with the
+    reason each test run would be refused, or None where it can be uploaded. Raises UploadError if the ITkDB
+    cannot be reached."""
+    components = fetch_components(client, [data_dict['component'] for data_dict in data_dicts])
+    problems = []
+    for data_dict in data_dicts:
+        component = components.get(data_dict['component'])
+        stage_test_types = dict()
+        if component is not None:
+            stage_test_types = get_stage_test_types(client, get_code(component.get('componentType')))
+        problems.append(check_component(component, data_dict, institute, stage_test_types))
+    return problems
@@ -0,0 +1,129 @@
+"""Checks upload data dictionaries against the definition of their test type in the ITkDB before they are sent.
+
+The definition of each test type (its properties and results, with their data types and whether they are
+required) is fetched once with getTestTypeByCode and kept on disk for SCHEMA_TTL, so checking a data dictionary
+needs no request. A definition older than that is fetched again, and still used if the ITkDB cannot be reached.
+"""
+import json
+import os
+import threading
+import time
+import module_itkdb_session as itkdb_session
+
+PATH_TO_SCHEMAS = 'module_metrology_data/.cache/test_types.json'
+SCHEMA_TTL = 24 * 3600 #seconds
+PROJECT = 'S' # Strips
+COMPONENT_TYPE = 'MODULE'
+REQUIRED_FIELDS = ('component', 'testType', 'institution', 'runNumber', 'date')
+SCHEMAS = dict()
+SCHEMA_LOCK = threading.Lock()
+
+def get_schema_path():
+    """Returns the full path of the file of cached test type definitions."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), PATH_TO_SCHEMAS)
+
+def read_schemas():
+    """Returns the dictionary of cached test types from disk, keyed by server and test type code."""
+    try:
+        with open(get_schema_path()) as schema_file:
+            return json.load(schema_file)
+    except (OSError, ValueError):
+        return dict()
+
+def write_schemas(schemas):
+    """Writes the dictionary of cached test types to disk."""
+    path = get_schema_path()
+    temp_path = path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temp_path, 'w') as schema_file:
+            json.dump(schemas, schema_file)
+        os.replace(temp_path, path)
+    except OSError as error:
+        print("Could not write the test type cache:", error)
+
+def get_test_type(client, code, ttl=SCHEMA_TTL):
+    """Returns the ITkDB definition of a test type of modules, from memory, from disk if fetched less than ttl
+    seconds ago, or else from the ITkDB. Raises UploadError if it is not cached and cannot be fetched."""
+    key = client.prefix_url + ' ' + code
+    with SCHEMA_LOCK:
+        if key not in SCHEMAS:
+            SCHEMAS.update(read_schemas())
+        cached = SCHEMAS.get(key)
+    if cached is not None and time.time() - cached['fetched'] < ttl:
+        return cached['definition']
+    try:
+        definition = client.get('getTestTypeByCode', json={'project': PROJECT, 'componentType': COMPONENT_TYPE, 'code': code})
+    except Exception as error:
+        if cached is not None:
+            return cached['definition'] # Out of date, but better than no check.
+        raise itkdb_session.UploadError('Could not fetch the test type ' + code + ': ' + str(error)) from error
+    with SCHEMA_LOCK:
+        SCHEMAS.update(read_schemas())
+        SCHEMAS[key] = {'fetched': time.time(), 'definition': definition}
+        write_schemas(SCHEMAS)
+    return definition
+
+def check_value(value, field):
+    """Returns the reason a value does not have the data type of a test type field, or None.
+    Lists and dictionaries are checked item by item. Numbers may be given as text, as in the GUIs."""
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, list):
+        for item in value:
+            problem = check_value(item, field)
+            if problem is not None:
+                return problem
+        return None
+    data_type = field.get('dataType')
+    if data_type == 'boolean':
+        valid = isinstance(value, bool)
+    elif data_type in ('integer', 'float'):
+        valid = not isinstance(value, bool)
+        try:
+            number = float(value)
+            valid = valid and (data_type == 'float' or number == int(number))
+        except (TypeError, ValueError, OverflowError):
+            valid = False
+    elif data_type == 'string':
+        valid = isinstance(value, str)
+    elif data_type == 'codeTable':
+        valid = value in [item.get('code') for item in field.get('codeTable') or []]
+    else:
+        valid = True
+    return None if valid else f'{field["code"]} is {value!r}, not a {data_type}'
+
+def check_fields(values, fields, name, warnings, strict=True):
+    """Returns the list of reasons the dictionary of values of the properties or results does not match
+    their fields in the test type. Values the test type does not define (such as the local FILE) are added to
+    warnings, as are required values missing or None if not strict, as the uploaders leave out or send None for
+    the parts a module does not have (the powerboard of an L module)."""
+    fields = {field['code']: field for field in fields or []}
+    warnings += [name + ' ' + code + ' is not in the test type' for code in values if code not in fields]
+    problems = []
+    for code, field in fields.items():
+        value = values.get(code)
+        if value is None or value == '':
+            if field.get('required') and (strict or value == ''):
+                problems.append(name + ' ' + code + ' is required')
+            elif field.get('required'):
+                warnings.append(name + ' ' + code + ' is required but has no value')
+            continue
+        problem = check_value(value, field)
+        if problem is not None:
+            problems.append(name + ' ' + problem)
+    return problems
+
+def validate_payload(data_dict, test_type, warnings=None):
+    """Returns the list of reasons the ITkDB would refuse the data dictionary of a test run of the test type.
+    The doubtful fields that do not stop an upload are added to the list warnings, if given."""
+    warnings = warnings if warnings is not None else []
+    problems = [field + ' is required' for field in REQUIRED_FIELDS if data_dict.get(field) in (None, '')]
+    if data_dict.get('testType') != test_type.get('code'):
+        problems.append(f'testType is {data_dict.get("testType")}, not {test_type.get("code")}')
+    problems += [field + ' must be true or false' for field in ('passed', 'problems')
+                 if not isinstance(data_dict.get(field), bool)]
+    problems += check_fields(data_dict.get('properties') or dict(), test_type.get('properties'), 'property', warnings)
+    problems += check_fields(data_dict.get('results') or dict(), test_type.get('parameters'), 'result', warnings,
+                             strict=False)
+    return problems
@@ -0,0 +1,119 @@
+import glob
+import math
+import os
+import numpy as np
+import pytest
+import module_bow_upload as bow_upload
+import module_metrology as metrology
+
+BOW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                          'module_metrology_data', 'bow_data', 'uploaded', '*.dat')))
+
+@pytest.fixture(autouse=True)
+def fit_cache(monkeypatch):
+    fit_cache = bow_upload.OrderedDict()
+    monkeypatch.setattr(bow_upload, 'FIT_CACHE', fit_cache)
+    return fit_cache
+
+def get_bow_baseline(lines):
+    """The bow of the loop over the points that get_results_from_data replaced, without its pass/fail."""
+    index = 12
+    raw_data_dict = dict()
+    for line in lines[index:] :
+        name, x, y ,z = line.split()
+        temp_list = raw_data_dict.get(name, [])
+        temp_list.append([float(x),float(y),float(z)])
+        raw_data_dict[name] = temp_list
+    data_dict = metrology.tilt_correction(raw_data_dict)
+    sensor_data = np.array(data_dict.get('Sensor'))
+    x = sensor_data[:,bow_upload.X]
+    y = sensor_data[:,bow_upload.Y]
+    z = sensor_data[:,bow_upload.Z]
+    mid_y = np.max(y)/2
+    mid_x = np.max(x)/2
+    min_index = 0
+    max_index = 0
+    min_value = 10000
+    max_value = -10000
+    for i in range(0,len(z)):
+        if z[i] > max_value:
+            max_value = z[i]
+            max_index = i
+        if z[i] < min_value:
+            min_value = z[i]
+            min_index = i
+    d_max_value = math.sqrt((x[max_index] - mid_x)**2 + (y[max_index] - mid_y)**2)
+    d_min_value = math.sqrt((x[min_index] - mid_x)**2 + (y[min_index] - mid_y)**2)
+    if d_max_value < d_min_value :
+        bow = (min_value - max_value)*1000
+    else:
+        bow = (max_value - min_value)*1000
+    return bow_upload.round(bow)
+
+def make_sensor(coefficients, noise=0.0, seed=0, nx=11, ny=19):
+    """Returns the (N,3) sensor points of the quadratic surface z = a + bx + cy + dx^2 + exy + fy^2 on a grid,
+    which by default has a point at its centre, (48.5, -45)."""
+    a, b, c, d, e, f = coefficients
+    x, y = np.meshgrid(np.linspace(0, 97, nx), np.linspace(-90, 0, ny))
+    x, y = x.ravel(), y.ravel()
+    z = a + b*x + c*y + d*x*x + e*x*y + f*y*y + np.random.default_rng(seed).normal(0, noise, len(x))
+    return np.column_stack((x, y, z))
+
+# A dome on (48.5, -45), 43.7725 um above its corners: the highest point is nearest the centre (concave down).
+HEADER_LINES = ['#---Header', 'EC or Barrel: EC', 'Module type: M2', 'Module ref. Number: 20USEM20000014',
+                'Date: 2024-01-01T10:00:00.000Z', 'Institute: SFU', 'Operator: Tester', 'Instrument type: CMM',
+                'Run Number: 1', 'Measurement program version: v1', '#---Positions', '#Bow\tX[mm]\tY[mm]\tZ[mm]']
+DOME = (0.1 - 1e-5*(48.5**2 + 45**2), 1e-5*97, -1e-5*90, -1e-5, 0.0, -1e-5)
+
+@pytest.mark.parametrize('file', BOW_FILES, ids=os.path.basename)
+def test_bow_matches_the_baseline_loop(file):
+    with open(file) as data_file:
+        lines = data_file.readlines()
+    assert bow_upload.get_bow_results(lines)['BOW'] == get_bow_baseline(lines)
+
+@pytest.mark.parametrize('coefficients', [DOME, tuple(-value for value in DOME), (0.01, 1e-4, -2e-4, 3e-6, -1e-6, 2e-6)])
+def test_bow_of_the_points_matches_the_baseline_loop(coefficients):
+    sensor = make_sensor(coefficients, noise=0.003)
+    lines = [line + '\n' for line in HEADER_LINES] + [f'Sensor\t{x:0.4f}\t{y:0.4f}\t{z:0.4f}\n' for x, y, z in sensor]
+    assert bow_upload.get_bow_results(lines)['BOW'] == get_bow_baseline(lines)
+
+def test_fitted_bow_of_a_known_quadratic_surface():
+    sensor = make_sensor(DOME)
+    scaling, r_factor = bow_upload.get_quadratic_fit(sensor[:, 0], sensor[:, 1])
+    design = bow_upload.get_quadratic_design(sensor[:, 0], sensor[:, 1], scaling)
+    np.testing.assert_allclose(r_factor.T @ r_factor, design.T @ design, rtol=1e-10, atol=1e-10)
+    # The surface has no noise, so its fit is itself.
+    assert bow_upload.get_fitted_bow({'Sensor': sensor}) == pytest.approx(-43.7725, abs=0.011)
+    inverted = sensor*[1, 1, -1]
+    assert bow_upload.get_fitted_bow({'Sensor': inverted}) == pytest.approx(43.7725, abs=0.011)
+
+def test_fitted_bow_ignores_a_single_noisy_point():
+    sensor = make_sensor(DOME, noise=0.001)
+    fitted_bow = bow_upload.get_fitted_bow({'Sensor': sensor})
+    sensor[5, 2] += 0.05
+    assert abs(bow_upload.get_fitted_bow({'Sensor': sensor}) - fitted_bow) < 2
+    assert abs(bow_upload.get_results_from_data({'Sensor': sensor})['BOW'] - fitted_bow) > 20
+
+def test_fitted_bow_of_too_few_points():
+    assert bow_upload.get_fitted_bow({'Sensor': make_sensor(DOME)[:5]}) is None
+
+def test_second_fit_on_the_same_grid_reuses_the_cache(fit_cache):
+    sensor = make_sensor(DOME, noise=0.002, seed=1)
+    other = make_sensor((0.01, 1e-4, -2e-4, 3e-6, -1e-6, 2e-6), noise=0.002, seed=2)
+    first_bow = bow_upload.get_fitted_bow({'Sensor': sensor})
+    other_bow = bow_upload.get_fitted_bow({'Sensor': other})
+    assert len(fit_cache) == 1
+    assert bow_upload.get_quadratic_fit(other[:, 0], other[:, 1]) is fit_cache[next(iter(fit_cache))]
+    assert bow_upload.get_fitted_bow({'Sensor': sensor}) == first_bow
+    # The same as fits without the cache.
+    fit_cache.clear()
+    assert bow_upload.get_fitted_bow({'Sensor': other}) == other_bow
+    # A different grid has an entry of its own.
+    bow_upload.get_fitted_bow({'Sensor': make_sensor(DOME, nx=12)})
+    assert len(fit_cache) == 2
+
+def test_fit_cache_is_limited(fit_cache, monkeypatch):
+    monkeypatch.setattr(bow_upload, 'FIT_CACHE_SIZE', 2)
+    for nx in (8, 9, 10):
+        bow_upload.get_fitted_bow({'Sensor': make_sensor(DOME, nx=nx)})
+    assert len(fit_cache) == 2
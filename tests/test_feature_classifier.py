@@ -0,0 +1,62 @@
+import glob
+import os
+import re
+import module_feature_classifier as fc
+import module_metrology as metrology
+
+RAW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                          'module_metrology_data', 'raw_data', '*', '*.csv')))
+# Names that match more than one regex, or none.
+NAMES = ['C1_R5H0_3', 'C9', 'PB_5', 'PB_4_C2', 'ABC_R4H1_12', 'ABC_R4H1_2', 'H_R3H0_P1', 'R5H0_1', 'Shield_PB_1',
+         'Shield_Box', 'Sensor', 'ABC', 'PB_P1', 'X_R6H0_1', 'ABC_R0H1_0', 'C8_Shield']
+
+def classify_baseline(names):
+    """The regex chain of the metrology uploader and converter that classify_features replaced."""
+    bins = {category: [] for category in fc.CATEGORIES + (fc.HYBRID, fc.ABC0, fc.ABC1, fc.PB_MOD, fc.GLUE)}
+    for key in names:
+        if re.search('C[1-8]', key):
+            bins[fc.CAP].append(key)
+        elif re.search('_R[0-5]H0_[0-9]+', key):
+            bins[fc.HYBRID0].append(key)
+            bins[fc.HYBRID].append(key)
+            if re.search('ABC', key):
+                bins[fc.ABC0].append(key)
+        elif re.search('_R[0-5]H1_[0-9]+', key):
+            bins[fc.HYBRID1].append(key)
+            bins[fc.HYBRID].append(key)
+            if re.search('ABC', key):
+                bins[fc.ABC1].append(key)
+        elif re.search('PB_[0-5]', key):
+            bins[fc.PB].append(key)
+            if re.search('PB_[0-4]', key):
+                bins[fc.PB_MOD].append(key)
+        elif re.search('Shield', key):
+            bins[fc.SHIELD].append(key)
+        if re.search('_R[0-5]H[0-1]_[0-9]+', key) or re.search('PB_[0-5]', key):
+            bins[fc.GLUE].append(key)
+    for names_in_bin in bins.values():
+        names_in_bin.sort(key=fc.natural_keys)
+    return bins
+
+def test_classify_features_matches_the_regex_chain():
+    assert fc.classify_features(NAMES) == classify_baseline(NAMES)
+
+def test_classify_features_matches_the_regex_chain_on_raw_files():
+    for file in RAW_FILES:
+        names = list(metrology.read_cmm_file(file))
+        assert fc.classify_features(names) == classify_baseline(names), file
+
+def test_classify_features_is_unchanged_when_memoized():
+    first = fc.classify_features(NAMES)
+    assert fc.classify_features(list(reversed(NAMES))) == first
+    assert fc.match_feature.cache_info().hits > 0
+
+def test_bins_are_in_natural_order():
+    bins = fc.classify_features(['ABC_R4H1_12', 'ABC_R4H1_2', 'ABC_R4H1_10'])
+    assert bins[fc.HYBRID1] == ['ABC_R4H1_2', 'ABC_R4H1_10', 'ABC_R4H1_12']
+
+def test_classify_feature():
+    assert fc.classify_feature('C1_R5H0_3') == fc.CAP
+    assert fc.classify_feature('PB_4_C2') == fc.CAP
+    assert fc.classify_feature('Shield_PB_1') == fc.PB
+    assert fc.classify_feature('Sensor') is None
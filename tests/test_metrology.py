@@ -0,0 +1,337 @@
+import copy
+import csv
+import glob
+import os
+import re
+import warnings
+import numpy as np
+import pytest
+import module_metrology as metrology
+
+RAW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                          'module_metrology_data', 'raw_data', '*', '*.csv')))
+# Features in the order measured, with Sensor points before and after the others so that it is not one run of rows.
+FEATURES = [('Sensor_Plane', 12), ('ABC_R5H0_0_A', 3), ('ABC_R5H0_0_B', 2), ('Shield_Box', 4), ('H_R5H0_P1', 1),
+            ('SENSOR_Plane_2', 6), ('PB_P1', 5)]
+
+def read_cmm_file_baseline(filename):
+    """The parser that read_cmm_file replaced, less its print."""
+    with open(filename) as csv_file:
+        data = csv.reader(csv_file)
+        data = list(data)
+    data_dictionary = {}
+    temp_list = []
+    for row in data[1:]:
+        if len(row) == 4 :
+            name, element, value = row[1:4]
+        else :
+            name, feature_id, element, value = row[1:5]
+        name = name.upper()
+        if re.search("_[A-Z]$", name) :
+            name = name[0:-2]
+        if "SENSOR" in name or "SHIELD" in name:
+            name = name.capitalize()
+        if 'Sensor' in name :
+            name = 'Sensor'
+        if 'Y' in element :
+            temp_list.append(-(float(value))) #Y needs to be flipped for the desired co-ordinate system.
+        elif 'Z' in element:
+            temp_list.append(float(value))
+            temp_entry = data_dictionary.get(name, [])
+            temp_entry.append(temp_list)
+            data_dictionary[name] = temp_entry
+            temp_list = []
+        else:
+            temp_list.append(float(value))
+    return data_dictionary
+
+def tilt_correction_baseline(data_dictionary):
+    """The normal equation fit that tilt_correction replaced. Returns the plane [a, b, c] and corrects the lists
+    of points in place."""
+    sensor_data = data_dictionary.get('Sensor')
+    temp_xy = []
+    temp_z = []
+    for row in sensor_data:
+        temp_xy.append([row[metrology.X], row[metrology.Y], 1])
+        temp_z.append(row[metrology.Z])
+    X, Y, Z = metrology.X, metrology.Y, metrology.Z
+    with warnings.catch_warnings(): # np.matrix and float() of a 1x1 matrix are deprecated.
+        warnings.simplefilter('ignore')
+        z = np.matrix(temp_z).T
+        xy = np.matrix(temp_xy)
+        c = (xy.T * xy).I * xy.T * z
+        for point_lists in data_dictionary.values():
+            for point in point_lists:
+                point[Z] = float(-(c[X]*point[X] + c[Y]*point[Y] - point[Z] + c[Z]) / np.sqrt(c[X]**2 + c[Y]**2 + 1))
+    return np.asarray(c).ravel()
+
+def make_module(plane, seed=0, shift=(0.0, 0.0), rows=8):
+    """Returns a dictionary of (N,3) arrays of a module with a tilted sensor plane [a, b, c] and features above it,
+    as read_cmm_file would, on a sensor grid moved by shift mm."""
+    random = np.random.default_rng(seed)
+    x, y = np.meshgrid(np.linspace(5, 95, 10) + shift[0], np.linspace(-90, -5, rows) + shift[1])
+    a, b, c = plane
+    sensor = np.column_stack((x.ravel(), y.ravel(), a*x.ravel() + b*y.ravel() + c))
+    sensor[:, metrology.Z] += random.normal(0, 0.002, len(sensor))
+    features = {'Sensor': sensor}
+    for name, height in (('ABC_R5H0_0', 0.42), ('H_R5H0_P1', 0.6), ('Shield_Box', 5.1)):
+        points = np.column_stack((random.uniform(5, 95, 6), random.uniform(-90, -5, 6), np.zeros(6)))
+        points[:, metrology.Z] = a*points[:, metrology.X] + b*points[:, metrology.Y] + c + height
+        features[name] = points
+    names = list(features)
+    codes = np.repeat(np.arange(len(names)), [len(features[name]) for name in names])
+    return metrology.group_points(codes, names, np.concatenate(list(features.values())))
+
+def write_cmm_file(path, features=FEATURES, columns=5, seed=0):
+    """Writes a CMM export of random points of the (label, number of points) features, in 4 columns (without the
+    feature ID) or 5 or more."""
+    random = np.random.default_rng(seed)
+    with open(path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        header = ['Feature Type', 'Feature Label', 'Feature ID', 'Element', 'Actual', 'Nominal']
+        writer.writerow(header[:2] + header[3:5] if columns == 4 else header[:columns])
+        for feature_id, (label, count) in enumerate(features):
+            for point in random.uniform(-150, 150, (count, 3)):
+                for element, value in zip(('Coord. X', 'Coord. Y', 'Coord. Z'), point):
+                    row = ['Point', label, str(feature_id), element, f'{value:12.6f}', '0.0']
+                    writer.writerow(row[:2] + row[3:5] if columns == 4 else row[:columns])
+    return path
+
+def assert_same_points(data_dictionary, expected):
+    assert list(data_dictionary) == list(expected)
+    for name, points in expected.items():
+        np.testing.assert_array_equal(data_dictionary[name], np.array(points).reshape(-1, 3))
+
+@pytest.mark.parametrize('columns', [4, 5, 6])
+@pytest.mark.parametrize('chunk_rows', [1, 2, 4, 7, metrology.CHUNK_ROWS])
+def test_read_cmm_file_matches_the_baseline_parser(tmp_path, columns, chunk_rows):
+    file = write_cmm_file(str(tmp_path / 'module.csv'), columns=columns)
+    data_dictionary = metrology.read_cmm_file(file, chunk_rows=chunk_rows)
+    assert_same_points(data_dictionary, read_cmm_file_baseline(file))
+    assert all(points.dtype == np.float64 and points.flags['C_CONTIGUOUS'] for points in data_dictionary.values())
+
+def test_read_cmm_file_grows_its_buffer_across_chunks(tmp_path, monkeypatch):
+    # One point of room to begin with, so the buffer grows many times over chunks of 5 rows.
+    monkeypatch.setattr(metrology, 'POINT_BYTES', 10**9)
+    features = [('Sensor', 40), ('ABC_R5H0_0', 10), ('Shield_Box', 10)]
+    file = write_cmm_file(str(tmp_path / 'module.csv'), features)
+    data_dictionary = metrology.read_cmm_file(file, chunk_rows=5)
+    assert_same_points(data_dictionary, read_cmm_file_baseline(file))
+    # Each feature is one run of rows, so the arrays are consecutive views of the buffer.
+    assert metrology.shared_buffer(data_dictionary) is not None
+
+@pytest.mark.parametrize('file', RAW_FILES, ids=os.path.basename)
+def test_read_cmm_file_matches_the_baseline_parser_on_raw_files(file):
+    expected = read_cmm_file_baseline(file)
+    for chunk_rows in (10, metrology.CHUNK_ROWS):
+        assert_same_points(metrology.read_cmm_file(file, chunk_rows=chunk_rows), expected)
+
+def test_read_cmm_file_rejects_a_point_without_z(tmp_path):
+    file = str(tmp_path / 'module.csv')
+    with open(file, 'w', newline='') as csv_file:
+        csv.writer(csv_file).writerows([['Feature Type', 'Feature Label', 'Feature ID', 'Element', 'Actual'],
+                                        ['Point', 'Sensor', '1', 'Coord. X', '1.0'],
+                                        ['Point', 'Sensor', '1', 'Coord. Y', '2.0'],
+                                        ['Point', 'Sensor', '1', 'Coord. X', '3.0'],
+                                        ['Point', 'Sensor', '1', 'Coord. Y', '4.0'],
+                                        ['Point', 'Sensor', '1', 'Coord. Z', '5.0']])
+    with pytest.raises(ValueError, match='X, Y and Z'):
+        metrology.read_cmm_file(file, chunk_rows=2)
+
+@pytest.mark.parametrize('plane', [(0.0, 0.0, 0.0), (0.002, -0.001, 0.3), (-0.01, 0.004, -12.5)])
+def test_tilt_correction_matches_the_normal_equation_fit(plane):
+    data_dictionary = make_module(plane)
+    expected = {name: points.tolist() for name, points in data_dictionary.items()}
+    expected_plane = tilt_correction_baseline(expected)
+    np.testing.assert_allclose(metrology.fit_plane(data_dictionary['Sensor']), expected_plane, rtol=1e-9, atol=1e-12)
+    buffer = metrology.shared_buffer(data_dictionary)
+    corrected = metrology.tilt_correction(data_dictionary)
+    assert corrected is data_dictionary and metrology.shared_buffer(corrected) is buffer # Corrected in place.
+    for name, points in expected.items():
+        np.testing.assert_allclose(corrected[name], points, rtol=0, atol=1e-9)
+    # The features keep their heights above the sensor plane, to within the noise of the sensor points.
+    np.testing.assert_allclose(corrected['Shield_Box'][:, metrology.Z], 5.1/np.sqrt(plane[0]**2 + plane[1]**2 + 1), atol=0.002)
+
+def test_tilt_correction_of_lists_returns_lists():
+    data_dictionary = {name: points.tolist() for name, points in make_module((0.002, -0.001, 0.3)).items()}
+    expected = copy.deepcopy(data_dictionary)
+    tilt_correction_baseline(expected)
+    corrected = metrology.tilt_correction(data_dictionary)
+    assert all(isinstance(points, list) for points in corrected.values())
+    for name, points in expected.items():
+        np.testing.assert_allclose(corrected[name], points, rtol=0, atol=1e-9)
+
+@pytest.mark.parametrize('file', [file for file in RAW_FILES if 'Sensor' in read_cmm_file_baseline(file)],
+                         ids=os.path.basename)
+def test_tilt_correction_matches_the_normal_equation_fit_on_raw_files(file):
+    expected = read_cmm_file_baseline(file)
+    tilt_correction_baseline(expected)
+    corrected = metrology.tilt_correction(metrology.read_cmm_file(file))
+    for name, points in expected.items():
+        np.testing.assert_allclose(corrected[name], np.array(points).reshape(-1, 3), rtol=0, atol=1e-9)
+
+PLANES = [(0.002, -0.001, 0.3), (-0.003, 0.0005, 0.1), (0.0, 0.002, -0.4), (0.001, 0.001, 0.0)]
+
+@pytest.fixture
+def solver_cache(monkeypatch):
+    cache = metrology.OrderedDict()
+    monkeypatch.setattr(metrology, 'PLANE_SOLVER_CACHE', cache)
+    return cache
+
+@pytest.fixture
+def fit_plane_calls(monkeypatch):
+    """Counts the modules fitted on their own rather than with a cached factorization."""
+    calls = []
+    fit_plane = metrology.fit_plane
+    def counted_fit_plane(points):
+        calls.append(len(points))
+        return fit_plane(points)
+    monkeypatch.setattr(metrology, 'fit_plane', counted_fit_plane)
+    return calls
+
+def fit_each(modules):
+    """Returns the tilt corrected copies of the modules, each fitted on its own."""
+    return [metrology.tilt_correction({name: points.copy() for name, points in module.items()}) for module in modules]
+
+def assert_same_modules(modules, expected, atol=1e-9):
+    for module, expected_module in zip(modules, expected):
+        for name, points in expected_module.items():
+            np.testing.assert_allclose(module[name], points, rtol=0, atol=atol)
+
+def test_batch_tilt_correction_matches_one_fit_per_module(solver_cache, fit_plane_calls):
+    modules = [make_module(plane, seed) for seed, plane in enumerate(PLANES)]
+    expected = fit_each(modules)
+    fit_plane_calls.clear()
+    planes = metrology.fit_planes('5R', [module['Sensor'] for module in modules])
+    np.testing.assert_allclose(planes, [metrology.fit_plane(module['Sensor']) for module in modules], rtol=0, atol=1e-12)
+    fit_plane_calls.clear()
+    assert metrology.tilt_correction_batch('5R', modules) is modules
+    assert_same_modules(modules, expected)
+    assert fit_plane_calls == [] # One factorization of the shared grid, cached for the module type.
+    assert [key[:2] for key in solver_cache] == [('5R', 80)]
+
+def test_batch_tilt_correction_reuses_the_cached_factorization(solver_cache, fit_plane_calls):
+    metrology.tilt_correction_batch('5R', [make_module(plane, seed) for seed, plane in enumerate(PLANES[:2])])
+    modules = [make_module(PLANES[2], 10)]
+    expected = fit_each(modules)
+    fit_plane_calls.clear()
+    metrology.tilt_correction_batch('5R', modules)
+    assert_same_modules(modules, expected)
+    assert fit_plane_calls == []
+    assert len(solver_cache) == 1
+
+def test_batch_tilt_correction_of_a_grid_within_tolerance_uses_the_cache(solver_cache, fit_plane_calls):
+    metrology.tilt_correction_batch('5R', [make_module(plane, seed) for seed, plane in enumerate(PLANES[:2])])
+    modules = [make_module(PLANES[2], 10, shift=(0.4*metrology.GRID_TOLERANCE, -0.4*metrology.GRID_TOLERANCE))]
+    expected = fit_each(modules)
+    fit_plane_calls.clear()
+    metrology.tilt_correction_batch('5R', modules)
+    assert fit_plane_calls == []
+    # The cached grid is a few micrometres off, which moves the fit by far less than the CMM resolution.
+    assert_same_modules(modules, expected, atol=1e-5)
+
+@pytest.mark.parametrize('shift, rows', [((1.0, 0.0), 8), ((0.0, 0.0), 7)], ids=['moved grid', 'fewer points'])
+def test_batch_tilt_correction_falls_back_for_a_grid_not_cached(solver_cache, fit_plane_calls, shift, rows):
+    metrology.tilt_correction_batch('5R', [make_module(plane, seed) for seed, plane in enumerate(PLANES[:2])])
+    modules = [make_module(PLANES[2], 10), make_module(PLANES[3], 11, shift=shift, rows=rows)]
+    expected = fit_each(modules)
+    fit_plane_calls.clear()
+    metrology.tilt_correction_batch('5R', modules)
+    assert_same_modules(modules, expected)
+    assert fit_plane_calls == [10*rows] # Only the module off the cached grid, fitted on its own and not cached.
+    assert len(solver_cache) == 1
+
+def test_batch_tilt_correction_keeps_module_types_apart(solver_cache, fit_plane_calls):
+    metrology.tilt_correction_batch('5R', [make_module(plane, seed) for seed, plane in enumerate(PLANES[:2])])
+    modules = [make_module(PLANES[2], 10)]
+    expected = fit_each(modules)
+    fit_plane_calls.clear()
+    metrology.tilt_correction_batch('5L', modules)
+    assert_same_modules(modules, expected)
+    assert fit_plane_calls == [80]
+
+HEADER_LINES = ['#---Header', 'EC or Barrel: EC', 'Module type: 5R', 'Module ref. Number: 20USE5R0000002',
+                'Date: 2024-01-01T10:00:00.000Z', 'Institute: SFU', 'Operator:  Some   Operator',
+                'Instrument type: Smartscope Flash 302', 'Run Number: 1', 'Measurement program version: v1']
+POSITION_LINES = ['#---Positions', '#Location X[mm] Y[mm]', 'H_R5H0_P1 4.9750 52.6696', 'PB_P1 51.8104 37.6683']
+GLUE_LINES = ['#---Glue heights:', '#Location Type X[mm] Y[mm] Z[mm]', 'Sensor\t1\t1.5579\t1.1688\t0.0106',
+              'ABC_R5H0_0\t1\t10.0\t20.0\t0.4200', 'Sensor\t1\t3.7128\t36.7447\t-0.0002', '']
+OTHER_LINES = ['#---Other heights:', '#Location\tType\tX[mm]\tY[mm]\tZ[mm]', 'Shield_Box\t2\t30.0\t40.0\t5.1000']
+HEADER = {'ec or barrel': 'EC', 'module type': '5R', 'module ref. number': '20USE5R0000002',
+          'date': '2024-01-01T10:00:00.000Z', 'institute': 'SFU', 'operator': 'Some Operator',
+          'instrument type': 'Smartscope Flash 302', 'run number': '1', 'measurement program version': 'v1'}
+POSITIONS = {'H_R5H0_P1': [4.975, 52.6696], 'PB_P1': [51.8104, 37.6683]}
+POINTS = {'Sensor': [[1.5579, 1.1688, 0.0106], [3.7128, 36.7447, -0.0002]], 'ABC_R5H0_0': [[10.0, 20.0, 0.42]],
+          'Shield_Box': [[30.0, 40.0, 5.1]]}
+
+def assert_standard_file(lines, header=HEADER, positions=POSITIONS, points=POINTS):
+    read_header, read_positions, data_dictionary = metrology.read_standard_file([line + '\n' for line in lines])
+    assert read_header == header
+    assert read_positions == positions
+    assert sorted(data_dictionary) == sorted(points)
+    for name, expected in points.items():
+        np.testing.assert_array_equal(data_dictionary[name], expected)
+
+def test_iter_standard_file_yields_each_entry_with_its_section():
+    entries = list(metrology.iter_standard_file(HEADER_LINES[:2] + ['', '# a comment'] + POSITION_LINES[:3]))
+    assert entries == [('Header', ('ec or barrel', 'EC')), ('Positions', ['H_R5H0_P1', '4.9750', '52.6696'])]
+    assert list(metrology.iter_standard_file(GLUE_LINES[:3]))[0] == ('Glue heights', ['Sensor', '1', '1.5579', '1.1688', '0.0106'])
+
+def test_read_standard_file():
+    assert_standard_file(HEADER_LINES + POSITION_LINES + GLUE_LINES + OTHER_LINES)
+
+def test_read_standard_file_with_a_missing_section():
+    assert_standard_file(HEADER_LINES + GLUE_LINES + OTHER_LINES, positions={})
+    assert_standard_file(HEADER_LINES + POSITION_LINES + GLUE_LINES, points={name: POINTS[name] for name in ('Sensor', 'ABC_R5H0_0')})
+    assert_standard_file(POSITION_LINES + GLUE_LINES + OTHER_LINES, header={})
+
+def test_read_standard_file_with_reordered_sections():
+    assert_standard_file(OTHER_LINES + GLUE_LINES + POSITION_LINES + HEADER_LINES)
+    assert_standard_file(HEADER_LINES + OTHER_LINES + POSITION_LINES + GLUE_LINES)
+
+def test_read_standard_file_of_a_bow_file():
+    # Bow files have a positions marker followed by the bow points, which have no type column.
+    lines = HEADER_LINES + ['#---Positions', '#Bow\tX[mm]\tY[mm]\tZ[mm]', 'Sensor\t0.9902\t1.0012\t0.0702',
+                            'Sensor\t9.3219\t0.2343\t0.0423']
+    assert_standard_file(lines, positions={}, points={'Sensor': [[0.9902, 1.0012, 0.0702], [9.3219, 0.2343, 0.0423]]})
+
+def test_read_standard_file_rejects_an_unexpected_line():
+    with pytest.raises(ValueError, match='Glue heights'):
+        metrology.read_standard_file(HEADER_LINES + GLUE_LINES[:2] + ['Sensor 1 1.5'])
+
+def test_read_standard_header_stops_at_the_end_of_the_header():
+    assert metrology.read_standard_header(HEADER_LINES + POSITION_LINES + ['not a valid line']) == HEADER
+    assert metrology.read_standard_header(POSITION_LINES + HEADER_LINES) == {}
+
+@pytest.mark.parametrize('sorted_ids', [True, False], ids=['sorted', 'unsorted'])
+def test_grouped_statistics_match_numpy_per_group(sorted_ids):
+    random = np.random.default_rng(3)
+    feature_ids = np.repeat([0, 1, 3, 4, 6], [5, 1, 40, 2, 7]) # Features 2 and 5 have no values.
+    if not sorted_ids:
+        feature_ids = random.permutation(feature_ids)
+    values = random.normal(0.1, 0.02, len(feature_ids))
+    statistics = metrology.grouped_statistics(values, feature_ids, 7)
+    np.testing.assert_array_equal(statistics['count'], [5, 1, 0, 40, 2, 0, 7])
+    for feature in range(7):
+        group = values[feature_ids == feature]
+        if len(group) == 0:
+            assert all(np.isnan(statistics[key][feature]) for key in ('mean', 'min', 'max', 'std'))
+            continue
+        assert statistics['mean'][feature] == pytest.approx(np.mean(group), rel=1e-12)
+        assert statistics['std'][feature] == pytest.approx(np.std(group), rel=1e-9, abs=1e-15)
+        assert statistics['min'][feature] == np.min(group)
+        assert statistics['max'][feature] == np.max(group)
+
+def test_grouped_statistics_of_a_feature_table():
+    module = make_module((0.002, -0.001, 0.3))
+    names, points, feature_ids = metrology.get_feature_table(module)
+    assert points is metrology.shared_buffer(module) # No copy of the points.
+    statistics = metrology.grouped_statistics(points[:, metrology.Z], feature_ids, len(names))
+    for index, name in enumerate(names):
+        assert statistics['mean'][index] == pytest.approx(module[name][:, metrology.Z].mean(), rel=1e-12)
+        assert statistics['std'][index] == pytest.approx(module[name][:, metrology.Z].std(), rel=1e-9)
+
+def test_grouped_statistics_of_no_values():
+    statistics = metrology.grouped_statistics([], [], 2)
+    np.testing.assert_array_equal(statistics['count'], [0, 0])
+    assert np.isnan(statistics['mean']).all() and np.isnan(statistics['max']).all()
@@ -0,0 +1,93 @@
+import glob
+import os
+import shutil
+import numpy as np
+import pytest
+import module_bow_upload as bow_upload
+import module_metrology_cache as cache
+
+BOW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                          'module_metrology_data', 'bow_data', 'uploaded', '*.dat')))
+
+@pytest.fixture(autouse=True)
+def cache_path(tmp_path, monkeypatch):
+    path = tmp_path / 'cache'
+    monkeypatch.setattr(cache, 'PATH_TO_CACHE', str(path) + os.sep)
+    return path
+
+def make_arrays(seed=0):
+    random = np.random.default_rng(seed)
+    return {'Sensor': random.normal(size=(20, 3)), 'ABC_R5H0_0': random.normal(size=(3, 3)), 'Empty': np.empty((0, 3))}
+
+class Process:
+    """Counts the calls of a processing function."""
+    def __init__(self, arrays, results):
+        self.arrays = arrays
+        self.results = results
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.arrays, self.results
+
+def test_cache_hit_returns_the_stored_arrays_and_results():
+    key = cache.get_cache_key(b'contents', {'LIMIT': 1})
+    process = Process(make_arrays(), {'BOW': 12.5, 'HEIGHTS': [1, 2]})
+    arrays, results, cache_hit = cache.cached_processing(key, process)
+    assert not cache_hit and arrays is process.arrays
+    arrays, results, cache_hit = cache.cached_processing(key, process)
+    assert cache_hit and process.calls == 1
+    assert results == {'BOW': 12.5, 'HEIGHTS': [1, 2]}
+    assert list(arrays) == list(process.arrays)
+    for name, points in process.arrays.items():
+        np.testing.assert_array_equal(arrays[name], points)
+        assert arrays[name].base is arrays['Sensor'].base # Views of one array of all points.
+
+def test_cache_key_changes_with_the_contents_constants_and_version(monkeypatch):
+    key = cache.get_cache_key(b'contents', {'LIMIT': 1})
+    assert cache.get_cache_key(b'contents', {'LIMIT': 1}) == key
+    assert cache.get_cache_key(b'contents!', {'LIMIT': 1}) != key
+    assert cache.get_cache_key(b'contents', {'LIMIT': 2}) != key
+    monkeypatch.setattr(cache, 'CACHE_VERSION', cache.CACHE_VERSION + 1)
+    assert cache.get_cache_key(b'contents', {'LIMIT': 1}) != key
+
+def test_changed_file_is_processed_again(tmp_path):
+    file = str(tmp_path / os.path.basename(BOW_FILES[0]))
+    shutil.copy(BOW_FILES[0], file)
+    data, key, cache_hit = bow_upload.build_data_dict(file)
+    assert not cache_hit
+    again, same_key, cache_hit = bow_upload.build_data_dict(file)
+    assert cache_hit and same_key == key and again['results'] == data['results']
+    # Raise the first sensor point, the processing must see the new data.
+    with open(file) as data_file:
+        lines = data_file.read().splitlines(keepends=True)
+    index = next(index for index, line in enumerate(lines) if line.startswith('Sensor'))
+    name, x, y, z = lines[index].split()
+    lines[index] = '\t'.join((name, x, y, f'{float(z) + 1:0.4f}')) + '\n'
+    with open(file, 'w') as data_file:
+        data_file.writelines(lines)
+    changed, changed_key, cache_hit = bow_upload.build_data_dict(file)
+    assert not cache_hit and changed_key != key
+    assert changed['results']['BOW'] != data['results']['BOW']
+
+def test_least_recently_used_entries_are_evicted(cache_path, monkeypatch):
+    keys = [cache.get_cache_key(str(index).encode(), {}) for index in range(4)]
+    for index, key in enumerate(keys):
+        cache.store(key, make_arrays(index), {'index': index})
+        os.utime(cache_path / (key + '.npz'), (1000 + index, 1000 + index))
+    size = os.path.getsize(cache_path / (keys[0] + '.npz'))
+    assert cache.load(keys[0]) is not None # Now the most recently used.
+    # Room for three entries.
+    monkeypatch.setattr(cache, 'CACHE_SIZE_LIMIT', 3*size + size//2)
+    cache.store(keys[1], make_arrays(1), {'index': 1})
+    assert cache.load(keys[2]) is None
+    assert [cache.load(key)[1]['index'] for key in (keys[0], keys[1], keys[3])] == [0, 1, 3]
+
+def test_unreadable_entry_is_a_miss(cache_path):
+    key = cache.get_cache_key(b'contents', {})
+    os.makedirs(cache_path)
+    (cache_path / (key + '.npz')).write_bytes(b'not an npz file')
+    process = Process(make_arrays(), {'BOW': 1.0})
+    _, _, cache_hit = cache.cached_processing(key, process)
+    assert not cache_hit and process.calls == 1
+    assert cache.load(key)[1] == {'BOW': 1.0}
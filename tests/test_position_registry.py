@@ -0,0 +1,77 @@
+import os
+import numpy as np
+import pytest
+import module_metrology as metrology
+import module_metrology_file_conversion as file_conversion
+
+POSITION_FILES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'metrology_position_files')
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    registry = dict()
+    monkeypatch.setattr(metrology, 'POSITION_REGISTRY', registry)
+    return registry
+
+def write_position_file(path, rows, module_type='M1', mtime_ns=None):
+    file = os.path.join(str(path), module_type + '_positions.csv')
+    with open(file, 'w') as position_file:
+        position_file.write('ID,X (mm),Y (mm)\n' + ''.join(row + '\n' for row in rows))
+    if mtime_ns is not None:
+        os.utime(file, ns=(mtime_ns, mtime_ns))
+    return file
+
+def test_position_table():
+    entry = metrology.get_position_table('M1', POSITION_FILES)
+    assert entry['names'][:3] == ['H_R1H0_P1', 'H_R1H0_P2', 'PB_P1']
+    assert entry['positions']['PB_P1'] == (70.939, 44.617)
+    assert entry['xy'].shape == (len(entry['names']), 2)
+    assert [entry['names'][entry['index'][name]] for name in entry['names']] == entry['names']
+
+def test_position_file_is_read_again_only_when_it_changes(tmp_path, monkeypatch):
+    write_position_file(tmp_path, ['P1,1.0,2.0', 'P2,3.0,4.0'], mtime_ns=10**18)
+    entry = metrology.get_position_table('M1', str(tmp_path))
+    loads = []
+    load_position_file = metrology.load_position_file
+    monkeypatch.setattr(metrology, 'load_position_file', lambda file: loads.append(file) or load_position_file(file))
+    assert metrology.get_position_table('M1', str(tmp_path)) is entry
+    assert loads == []
+    # Same size, new modification time.
+    write_position_file(tmp_path, ['P1,1.5,2.0', 'P2,3.0,4.0'], mtime_ns=10**18 + 10**9)
+    entry = metrology.get_position_table('M1', str(tmp_path))
+    assert entry['positions']['P1'] == (1.5, 2.0)
+    # Same modification time, new size.
+    write_position_file(tmp_path, ['P1,1.5,2.0', 'P2,3.0,4.0', 'P3,5.0,6.0'], mtime_ns=10**18 + 10**9)
+    assert metrology.get_position_table('M1', str(tmp_path))['names'] == ['P1', 'P2', 'P3']
+    assert len(loads) == 2
+
+def test_position_registry_loads_every_module_type():
+    registry = metrology.load_position_registry(POSITION_FILES)
+    assert list(registry) == list(metrology.MODULE_TYPES)
+    assert all(len(entry['names']) > 0 for entry in registry.values())
+
+@pytest.mark.parametrize('rows, problem', [
+    (['P1,1.0,2.0', 'P1,3.0,4.0'], 'line 3: P1 is listed more than once'),
+    (['P1,1.0,two'], 'line 2: position of P1 is not a number'),
+    (['P1,1.0,nan'], 'line 2: position of P1 is not finite'),
+    (['P1,1.0'], 'line 2: expected an ID, X and Y position'),
+])
+def test_position_file_is_validated(tmp_path, rows, problem):
+    write_position_file(tmp_path, rows)
+    with pytest.raises(ValueError, match=problem):
+        metrology.get_position_table('M1', str(tmp_path))
+
+def test_distance_dict(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_conversion, 'PATH_TO_POSITION_FILES', str(tmp_path))
+    write_position_file(tmp_path, ['P10,1.0,2.0', 'P2,3.0,4.0'])
+    data_dictionary = {'P10': np.array([[1.01, 2.02, 0.0]]), 'P2': np.array([[2.99, 4.0, 0.0], [9.0, 9.0, 0.0]]),
+                       'Sensor': np.zeros((3, 3))}
+    distances = file_conversion.get_distance_dict(data_dictionary, 'M1')
+    assert list(distances.items()) == [('P2', [2.99, 4.0]), ('P10', [1.01, 2.02])] # In natural order.
+
+def test_distance_dict_names_the_missing_fiducials(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_conversion, 'PATH_TO_POSITION_FILES', str(tmp_path))
+    write_position_file(tmp_path, ['P1,1.0,2.0', 'P2,3.0,4.0', 'P3,5.0,6.0'])
+    data_dictionary = {'P1': np.array([[1.0, 2.0, 0.0]]), 'P3': np.empty((0, 3))}
+    with pytest.raises(ValueError) as error:
+        file_conversion.get_distance_dict(data_dictionary, 'M1')
+    assert str(error.value) == 'Fiducial(s) of a M1 module missing from the data: P2, P3'
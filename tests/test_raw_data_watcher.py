@@ -0,0 +1,111 @@
+import json
+import os
+import pytest
+import module_raw_data_watcher as watcher
+
+class Clock:
+    """Stands in for the time module of the watcher, its sleep only moving on its monotonic clock."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(watcher, 'time', clock)
+    monkeypatch.setattr(watcher, 'open_inotify', lambda paths: None)
+    return clock
+
+@pytest.fixture
+def paths(tmp_path):
+    paths = {'metrology': str(tmp_path / 'metrology'), 'bow': str(tmp_path / 'bow')}
+    for path in paths.values():
+        os.makedirs(path)
+    return paths
+
+@pytest.fixture
+def make_watcher(clock, paths):
+    watchers = []
+    def make_watcher(existing=False):
+        watchers.append(watcher.Watcher(paths, 'Tester', workers=1, plot=False, existing=existing))
+        return watchers[-1]
+    yield make_watcher
+    for raw_data_watcher in watchers:
+        raw_data_watcher.executor.shutdown()
+
+def write_file(folder, name, contents='Sensor,1.0,2.0,3.0\n'):
+    file = os.path.join(folder, name)
+    with open(file, 'a') as raw_file:
+        raw_file.write(contents)
+    return file
+
+def test_new_file_is_ready_once_settled(make_watcher, paths):
+    raw_data_watcher = make_watcher()
+    assert raw_data_watcher.inotify is None # The polling fallback.
+    file = write_file(paths['bow'], '20USEM20000014_1.csv')
+    assert raw_data_watcher.get_ready(watcher.POLL_INTERVAL) == [] # First seen.
+    assert raw_data_watcher.get_ready(watcher.SETTLE_TIME - watcher.POLL_INTERVAL/2) == []
+    assert raw_data_watcher.get_ready(watcher.POLL_INTERVAL) == [file]
+
+def test_file_still_written_is_not_ready(make_watcher, paths):
+    raw_data_watcher = make_watcher()
+    file = write_file(paths['metrology'], '20USEM20000014_1.csv')
+    for _ in range(5):
+        assert raw_data_watcher.get_ready(watcher.POLL_INTERVAL) == []
+        write_file(paths['metrology'], '20USEM20000014_1.csv')
+    # Unchanged from the last poll, it settles SETTLE_TIME after it.
+    assert raw_data_watcher.get_ready(watcher.POLL_INTERVAL) == []
+    assert raw_data_watcher.get_ready(watcher.SETTLE_TIME) == [file]
+
+def test_existing_files_wait_for_the_settle_time(make_watcher, paths):
+    file = write_file(paths['bow'], '20USEM20000014_1.csv')
+    raw_data_watcher = make_watcher(existing=True)
+    assert raw_data_watcher.get_ready(0) == []
+    assert raw_data_watcher.get_ready(watcher.SETTLE_TIME/2) == []
+    assert raw_data_watcher.get_ready(watcher.SETTLE_TIME/2) == [file]
+
+def test_files_found_at_start_are_done_unless_existing(make_watcher, paths):
+    file = write_file(paths['bow'], '20USEM20000014_1.csv')
+    raw_data_watcher = make_watcher()
+    assert raw_data_watcher.get_ready(2*watcher.SETTLE_TIME) == []
+    # Written again, it is taken as a new file.
+    write_file(paths['bow'], '20USEM20000014_1.csv')
+    assert raw_data_watcher.get_ready(watcher.POLL_INTERVAL) == []
+    assert raw_data_watcher.get_ready(watcher.SETTLE_TIME) == [file]
+
+def test_only_raw_files_are_ready(make_watcher, paths):
+    raw_data_watcher = make_watcher()
+    write_file(paths['metrology'], watcher.MANIFEST_NAME, ','.join(watcher.batch_conversion.MANIFEST_FIELDS) + '\n')
+    write_file(paths['metrology'], '20USEM20000014_1.json', '{}')
+    write_file(paths['metrology'], 'notes.txt', 'notes')
+    assert raw_data_watcher.get_ready(watcher.POLL_INTERVAL) == []
+    assert raw_data_watcher.get_ready(2*watcher.SETTLE_TIME) == []
+
+def test_submitted_file_is_not_ready_again(make_watcher, paths):
+    raw_data_watcher = make_watcher()
+    file = write_file(paths['bow'], 'unnamed.csv')
+    raw_data_watcher.get_ready(watcher.POLL_INTERVAL)
+    assert raw_data_watcher.get_ready(watcher.SETTLE_TIME) == [file]
+    raw_data_watcher.submit(file) # Skipped, there is no serial number in its name.
+    assert raw_data_watcher.skipped == {file} and not raw_data_watcher.running
+    assert raw_data_watcher.get_ready(2*watcher.SETTLE_TIME) == []
+    assert file not in raw_data_watcher.signatures
+
+def test_skipped_file_waits_for_the_settle_time_after_its_sidecar(make_watcher, paths):
+    raw_data_watcher = make_watcher()
+    file = write_file(paths['bow'], 'unnamed.csv')
+    raw_data_watcher.get_ready(watcher.POLL_INTERVAL)
+    raw_data_watcher.get_ready(watcher.SETTLE_TIME)
+    raw_data_watcher.submit(file)
+    sidecar = {'serial_number': '20USEM20000014', 'module_type': 'M0', 'run_number': 1}
+    write_file(paths['bow'], 'unnamed.json', json.dumps(sidecar))
+    assert raw_data_watcher.get_ready(watcher.POLL_INTERVAL) == [] # Retried from now.
+    assert raw_data_watcher.skipped == set()
+    assert raw_data_watcher.get_ready(watcher.SETTLE_TIME/2) == []
+    assert raw_data_watcher.get_ready(watcher.SETTLE_TIME/2) == [file]
+    assert watcher.get_entry(file, 'Tester')['serial_number'] == '20USEM20000014'
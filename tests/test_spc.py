@@ -0,0 +1,110 @@
+import sqlite3
+import pytest
+import module_spc as spc
+
+VALUES = [2, 4, 4, 4, 5, 5, 7, 9]
+EWMAS = [2, 2.4, 2.72, 2.976, 3.3808, 3.70464, 4.363712, 5.2909696] # By hand, with EWMA_WEIGHT = 0.2.
+
+def make_chart(window, mean=None, sigma=0.0, ewma=None, count=20):
+    """Returns a chart of count values with the given statistics and latest values."""
+    mean = sum(window)/len(window) if mean is None else mean
+    return {'count': count, 'mean': mean, 'm2': sigma**2*(count - 1), 'ewma': mean if ewma is None else ewma,
+            'window': list(window), 'drift': []}
+
+@pytest.fixture
+def connection(monkeypatch):
+    monkeypatch.setattr(spc, 'LIMITS', {('BOW', None): (-50, 150)})
+    connection = sqlite3.connect(':memory:')
+    connection.row_factory = sqlite3.Row
+    spc.create_table(connection)
+    yield connection
+    connection.close()
+
+def test_add_value_keeps_the_running_statistics():
+    chart = spc.new_chart()
+    for value, ewma in zip(VALUES, EWMAS):
+        spc.add_value(chart, value)
+        assert chart['ewma'] == pytest.approx(ewma)
+    assert chart['count'] == 8
+    assert chart['mean'] == pytest.approx(5)
+    assert chart['m2'] == pytest.approx(32)
+    assert spc.get_standard_deviation(chart) == pytest.approx((32/7)**0.5)
+    assert chart['window'] == VALUES
+
+def test_add_value_keeps_only_the_latest_window():
+    chart = spc.new_chart()
+    for value in range(spc.WINDOW + 5):
+        spc.add_value(chart, value)
+    assert chart['window'] == list(range(5, spc.WINDOW + 5))
+    assert chart['count'] == spc.WINDOW + 5
+
+def test_window_statistics():
+    mean, deviation, slope = spc.get_window_statistics([100 + 3*index for index in range(10)])
+    assert mean == pytest.approx(113.5)
+    assert deviation == pytest.approx(3*(55/6)**0.5)
+    assert slope == pytest.approx(3)
+    assert spc.get_window_statistics([7]) == (7, 0.0, 0.0)
+
+def test_no_drift_before_min_count():
+    chart = make_chart([160]*5, ewma=200, sigma=2, count=spc.MIN_COUNT - 1)
+    assert spc.get_drift(chart, (40, 170)) == []
+
+def test_shift_of_the_ewma():
+    # The EWMA control limits are 3*2*sqrt(0.2/1.8) = 2 from the mean.
+    assert spc.get_drift(make_chart([100]*10, mean=100, sigma=2, ewma=104)) == ['shift']
+    assert spc.get_drift(make_chart([100]*10, mean=100, sigma=2, ewma=96)) == ['shift']
+    assert spc.get_drift(make_chart([100]*10, mean=100, sigma=2, ewma=101)) == []
+    assert spc.get_drift(make_chart([100]*10, mean=100, sigma=0, ewma=104)) == []
+
+def test_latest_values_near_a_limit():
+    # Mean 160 and standard deviation 5.27, so within 3 of 170 but not of 40.
+    window = [155, 165]*5
+    assert spc.get_drift(make_chart(window), (40, 170)) == ['near_upper']
+    assert spc.get_drift(make_chart([-value for value in window]), (-170, -40)) == ['near_lower']
+    assert spc.get_drift(make_chart(window), (40, 200)) == []
+
+def test_trend_reaching_a_limit():
+    # Mean 113.5 and slope 3 project to 113.5 + 3*(4.5 + 25) = 202 within TREND_MODULES modules.
+    window = [100 + 3*index for index in range(10)]
+    assert spc.get_drift(make_chart(window), (40, 170)) == ['trend_upper']
+    assert spc.get_drift(make_chart([-value for value in window]), (-170, -40)) == ['trend_lower']
+    assert spc.get_drift(make_chart(window), (40, 210)) == []
+
+def test_missing_limit_is_not_checked():
+    assert spc.get_drift(make_chart([155, 165]*5), (None, 6110)) == []
+    assert spc.get_drift(make_chart([-6100, -6000]*5), (None, 6110)) == []
+
+def test_update_saves_the_charts_and_reports_drift(connection):
+    values = [140, 146]*5 + [143]
+    chart = spc.new_chart()
+    for count, value in enumerate(values, 1):
+        drifting = spc.update(connection, 'M1', [('BOW', None, None, value), ('BOW_FIT', None, None, value)])
+        spc.add_value(chart, value)
+        if count < spc.MIN_COUNT:
+            assert drifting == []
+        else:
+            # Mean 143 and standard deviation 3.16 are within 3 of the upper limit, 150.
+            assert drifting == [(('M1', 'BOW', '', ''), ['near_upper'])]
+    charts = spc.load_charts(connection, 'M1')
+    assert set(charts) == {('M1', 'BOW', '', ''), ('M1', 'BOW_FIT', '', '')}
+    saved = charts[('M1', 'BOW', '', '')]
+    assert saved['count'] == len(values)
+    assert saved['mean'] == pytest.approx(chart['mean'])
+    assert saved['m2'] == pytest.approx(chart['m2'])
+    assert saved['ewma'] == pytest.approx(chart['ewma'])
+    assert saved['window'] == values
+    assert charts[('M1', 'BOW_FIT', '', '')]['drift'] == [] # No limits.
+    assert spc.load_charts(connection, 'M2') == {}
+
+def test_rebuild_matches_the_updates(connection):
+    runs = [('M1', [('BOW', None, None, value)]) for value in (100, 120, 110)] + [(None, [('BOW', None, None, 90)])]
+    for module_type, rows in runs:
+        spc.update(connection, module_type, rows)
+    updated = spc.load_charts(connection)
+    assert spc.rebuild(connection, runs) == 2
+    assert spc.load_charts(connection) == updated
+    assert set(updated) == {('M1', 'BOW', '', ''), ('', 'BOW', '', '')}
+
+def test_message():
+    assert spc.get_message(('M1', 'BOW', '', ''), ['near_upper', 'trend_upper']) == \
+        'SPC drift in M1 BOW: latest values near the upper limit, trend reaches the upper limit'
@@ -0,0 +1,159 @@
+import os
+import pytest
+import module_itkdb_session as itkdb_session
+import module_upload_journal as upload_journal
+
+class FakeITkDB:
+    """Stands in for the test run, attachment and search requests, failing the first calls with given errors."""
+    def __init__(self, post_errors=(), attach_errors=(), found=None):
+        self.post_errors = list(post_errors)
+        self.attach_errors = list(attach_errors)
+        self.found = found
+        self.posts = 0
+        self.searches = 0
+        self.attachments = []
+
+    def upload_test_run(self, client, data_dict):
+        self.posts += 1
+        if self.post_errors:
+            raise self.post_errors.pop(0)
+        return 'run-' + str(self.posts)
+
+    def find_test_run(self, client, data_dict):
+        self.searches += 1
+        return self.found
+
+    def upload_attachment(self, client, test_run, file):
+        if self.attach_errors:
+            raise self.attach_errors.pop(0)
+        self.attachments.append((test_run, file))
+
+@pytest.fixture
+def itkdb(monkeypatch):
+    fake = FakeITkDB()
+    for name in ('upload_test_run', 'find_test_run', 'upload_attachment'):
+        monkeypatch.setattr(itkdb_session, name, getattr(fake, name))
+    monkeypatch.setattr(upload_journal, 'BACKOFF_BASE', 0)
+    return fake
+
+@pytest.fixture
+def connection(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_journal, 'UPLOADED_PATHS', {'MODULE_BOW': str(tmp_path / 'uploaded') + os.sep})
+    connection = upload_journal.open_journal(str(tmp_path / 'journal.sqlite'))
+    yield connection
+    connection.close()
+
+def make_data(tmp_path, run_number=1):
+    file = tmp_path / ('20USEM20000014_M2_MODULE_BOW_' + f'{run_number:03d}' + '.dat')
+    file.write_text('data')
+    return {'component': '20USEM20000014', 'testType': 'MODULE_BOW', 'runNumber': run_number,
+            'results': {'BOW': 100.0, 'FILE': str(file)}}
+
+def transient():
+    return itkdb_session.UploadError('Service unavailable', status=503)
+
+def permanent():
+    return itkdb_session.UploadError('Component at a different location', ('componentAtDifferentLocation',), 400)
+
+def test_upload_goes_from_pending_to_completed(tmp_path, connection, itkdb):
+    data = make_data(tmp_path)
+    key = upload_journal.get_key(data)
+    assert upload_journal.enqueue(connection, data) == upload_journal.PENDING
+    outcomes = upload_journal.drain(connection, None, [key])
+    entry = upload_journal.get_entry(connection, key)
+    assert entry['state'] == upload_journal.COMPLETED
+    assert entry['test_run'] == 'run-1'
+    assert entry['file'] == str(tmp_path / 'uploaded' / os.path.basename(data['results']['FILE']))
+    assert os.path.isfile(entry['file'])
+    assert itkdb.attachments == [('run-1', data['results']['FILE'])]
+    assert outcomes[0][1] == 'run-1' and outcomes[0][3] is None
+
+def test_completed_upload_is_never_entered_again(tmp_path, connection, itkdb):
+    data = make_data(tmp_path)
+    upload_journal.enqueue(connection, data)
+    upload_journal.drain(connection, None, [upload_journal.get_key(data)])
+    assert upload_journal.enqueue(connection, make_data(tmp_path)) == upload_journal.COMPLETED
+    assert itkdb.posts == 1
+
+def test_transient_post_failure_searches_before_posting_again(tmp_path, connection, itkdb):
+    itkdb.post_errors = [transient()]
+    data = make_data(tmp_path)
+    key = upload_journal.get_key(data)
+    upload_journal.enqueue(connection, data)
+    upload_journal.drain(connection, None, [key])
+    entry = upload_journal.get_entry(connection, key)
+    assert entry['state'] == upload_journal.COMPLETED
+    assert itkdb.searches == 1 # The failed post may have reached the ITkDB.
+    assert itkdb.posts == 2
+
+def test_test_run_found_after_a_lost_post_is_not_posted_again(tmp_path, connection, itkdb):
+    itkdb.post_errors = [ConnectionError('connection reset')]
+    itkdb.found = 'run-found'
+    data = make_data(tmp_path)
+    key = upload_journal.get_key(data)
+    upload_journal.enqueue(connection, data)
+    upload_journal.drain(connection, None, [key])
+    assert upload_journal.get_entry(connection, key)['test_run'] == 'run-found'
+    assert itkdb.posts == 1
+
+def test_permanent_post_failure_fails_at_once(tmp_path, connection, itkdb):
+    itkdb.post_errors = [permanent()]
+    data = make_data(tmp_path)
+    key = upload_journal.get_key(data)
+    upload_journal.enqueue(connection, data)
+    outcomes = upload_journal.drain(connection, None, [key])
+    entry = upload_journal.get_entry(connection, key)
+    assert entry['state'] == upload_journal.FAILED
+    assert entry['attempts'] == 1
+    assert entry['last_error'].startswith(upload_journal.PENDING + ': ')
+    assert outcomes == [(data['results']['FILE'], None, None, 'Component at a different location')]
+    # Retried from the start, as the ITkDB refused the test run.
+    assert upload_journal.reset_failed(connection) == [key]
+    assert upload_journal.get_entry(connection, key)['state'] == upload_journal.PENDING
+
+def test_transient_failure_without_retry_is_resumed_as_posting(tmp_path, connection, itkdb):
+    itkdb.post_errors = [transient()]
+    data = make_data(tmp_path)
+    key = upload_journal.get_key(data)
+    upload_journal.enqueue(connection, data)
+    upload_journal.drain(connection, None, [key], retry=False)
+    entry = upload_journal.get_entry(connection, key)
+    assert entry['state'] == upload_journal.FAILED
+    assert entry['last_error'].startswith(upload_journal.POSTING + ': ')
+    upload_journal.reset_failed(connection)
+    assert upload_journal.get_entry(connection, key)['state'] == upload_journal.POSTING
+
+def test_transient_failures_give_up_after_max_attempts(tmp_path, connection, itkdb):
+    itkdb.post_errors = [transient() for _ in range(upload_journal.MAX_ATTEMPTS)]
+    data = make_data(tmp_path)
+    key = upload_journal.get_key(data)
+    upload_journal.enqueue(connection, data)
+    upload_journal.drain(connection, None, [key])
+    entry = upload_journal.get_entry(connection, key)
+    assert entry['state'] == upload_journal.FAILED
+    assert entry['attempts'] == upload_journal.MAX_ATTEMPTS
+
+def test_failed_attachment_keeps_the_test_run(tmp_path, connection, itkdb):
+    itkdb.attach_errors = [permanent()]
+    data = make_data(tmp_path)
+    key = upload_journal.get_key(data)
+    upload_journal.enqueue(connection, data)
+    upload_journal.drain(connection, None, [key])
+    entry = upload_journal.get_entry(connection, key)
+    assert entry['state'] == upload_journal.FAILED
+    assert entry['test_run'] == 'run-1'
+    assert entry['last_error'].startswith(upload_journal.UPLOADED + ': ')
+    # Only the file is attached again.
+    assert upload_journal.enqueue(connection, data) == upload_journal.UPLOADED
+    upload_journal.drain(connection, None, [key])
+    assert upload_journal.get_entry(connection, key)['state'] == upload_journal.COMPLETED
+    assert itkdb.posts == 1
+
+def test_transient_attachment_failure_is_retried(tmp_path, connection, itkdb):
+    itkdb.attach_errors = [transient()]
+    data = make_data(tmp_path)
+    key = upload_journal.get_key(data)
+    upload_journal.enqueue(connection, data)
+    upload_journal.drain(connection, None, [key])
+    assert upload_journal.get_entry(connection, key)['state'] == upload_journal.COMPLETED
+    assert itkdb.posts == 1
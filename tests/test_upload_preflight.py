@@ -0,0 +1,82 @@
+import pytest
+import module_itkdb_session as itkdb_session
+import module_upload_preflight as upload_preflight
+
+STAGES = {'RECEPTION': (), 'GLUED': ('MODULE_METROLOGY', 'MODULE_BOW'), 'FINISHED': ('MODULE_BOW',)}
+
+class FakeClient:
+    """Answers getComponentBulk and getComponentTypeByCode from (location, stage) of each serial number."""
+    prefix_url = 'https://itkpd.example/'
+
+    def __init__(self, components, error=None):
+        self.components = components
+        self.error = error
+        self.requests = []
+
+    def get(self, command, json):
+        self.requests.append((command, json))
+        if self.error is not None:
+            raise self.error
+        if command == 'getComponentBulk':
+            return [{'serialNumber': serial_number, 'componentType': {'code': 'MODULE'},
+                     'currentLocation': {'code': self.components[serial_number][0]},
+                     'currentStage': {'code': self.components[serial_number][1]}}
+                    for serial_number in json['component'] if serial_number in self.components]
+        return {'code': json['code'], 'stages': [{'code': stage, 'testTypes': [{'testType': {'code': test_type}}
+                                                                               for test_type in test_types]}
+                                                 for stage, test_types in STAGES.items()]}
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch):
+    monkeypatch.setattr(upload_preflight, 'COMPONENTS', dict())
+    monkeypatch.setattr(upload_preflight, 'STAGE_TEST_TYPES', dict())
+
+def make_data(serial_number, test_type='MODULE_BOW', stage=None):
+    data = {'component': serial_number, 'testType': test_type}
+    if stage is not None:
+        data['isRetroactive'] = True
+        data['stage'] = stage
+    return data
+
+def test_component_at_the_institute_and_stage_passes():
+    client = FakeClient({'20USEM20000014': ('SFU', 'GLUED')})
+    assert upload_preflight.check_uploads(client, [make_data('20USEM20000014')], 'SFU') == [None]
+
+def test_component_at_another_location_is_rejected():
+    client = FakeClient({'20USEM20000014': ('TRIUMF', 'GLUED')})
+    problem, = upload_preflight.check_uploads(client, [make_data('20USEM20000014')], 'SFU')
+    assert problem == itkdb_session.UPLOAD_ERROR_MESSAGES['componentAtDifferentLocation'] + ' (TRIUMF, not SFU)'
+
+def test_component_at_a_stage_without_the_test_type_is_rejected():
+    client = FakeClient({'20USEM20000014': ('SFU', 'RECEPTION'), '20USEM20000016': ('SFU', 'FINISHED')})
+    problems = upload_preflight.check_uploads(client, [make_data('20USEM20000014'),
+                                                       make_data('20USEM20000016', 'MODULE_METROLOGY')], 'SFU')
+    message = itkdb_session.UPLOAD_ERROR_MESSAGES['unassociatedStageWithTestType']
+    assert problems == [message + ' (stage RECEPTION)', message + ' (stage FINISHED)']
+
+def test_retroactive_upload_is_checked_against_its_own_stage():
+    client = FakeClient({'20USEM20000014': ('SFU', 'RECEPTION')})
+    problems = upload_preflight.check_uploads(client, [make_data('20USEM20000014', stage='GLUED'),
+                                                       make_data('20USEM20000014', 'MODULE_METROLOGY', 'FINISHED')], 'SFU')
+    assert problems == [None, itkdb_session.UPLOAD_ERROR_MESSAGES['unassociatedStageWithTestType'] + ' (stage FINISHED)']
+
+def test_unknown_component_is_rejected():
+    client = FakeClient({})
+    assert upload_preflight.check_uploads(client, [make_data('20USEM29999999')], 'SFU') == \
+        ['Component 20USEM29999999 is not in the ITkDB']
+
+def test_components_are_fetched_in_bulk_once(monkeypatch):
+    monkeypatch.setattr(upload_preflight, 'BULK_SIZE', 2)
+    serial_numbers = ['20USEM2000001' + str(index) for index in range(5)]
+    client = FakeClient({serial_number: ('SFU', 'GLUED') for serial_number in serial_numbers})
+    data_dicts = [make_data(serial_number) for serial_number in serial_numbers + serial_numbers[:2]]
+    assert upload_preflight.check_uploads(client, data_dicts, 'SFU') == [None]*7
+    commands = [command for command, _ in client.requests]
+    assert commands == ['getComponentBulk']*3 + ['getComponentTypeByCode']
+    assert upload_preflight.check_uploads(client, data_dicts, 'SFU') == [None]*7
+    assert len(client.requests) == 4 # Cached for the session.
+
+def test_unreachable_itkdb_raises_upload_error():
+    client = FakeClient({}, error=ConnectionError('offline'))
+    with pytest.raises(itkdb_session.UploadError, match='Could not fetch the components'):
+        upload_preflight.check_uploads(client, [make_data('20USEM20000014')], 'SFU')
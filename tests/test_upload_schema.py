@@ -0,0 +1,90 @@
+import pytest
+import module_itkdb_session as itkdb_session
+import module_upload_schema as upload_schema
+
+TEST_TYPE = {
+    'code': 'MODULE_BOW',
+    'properties': [{'code': 'JIG', 'dataType': 'string', 'required': True},
+                   {'code': 'TEMP', 'dataType': 'float', 'required': False},
+                   {'code': 'SITE', 'dataType': 'codeTable', 'required': False,
+                    'codeTable': [{'code': 'SCIPP'}, {'code': 'LBNL'}]}],
+    'parameters': [{'code': 'BOW', 'dataType': 'float', 'required': True},
+                   {'code': 'RUNS', 'dataType': 'integer', 'required': False},
+                   {'code': 'PB_GLUE_THICKNESS', 'dataType': 'float', 'required': True}]}
+
+def make_data(**changes):
+    data = {'component': '20USEM20000014', 'testType': 'MODULE_BOW', 'institution': 'SCIPP', 'runNumber': '1',
+            'date': '2024-01-01T00:00:00.000Z', 'passed': True, 'problems': False,
+            'properties': {'JIG': 'JIG1', 'TEMP': '21.5', 'SITE': 'SCIPP'},
+            'results': {'BOW': 100.0, 'RUNS': 3, 'PB_GLUE_THICKNESS': {'P1': 120.0, 'P2': '118'}}}
+    data.update(changes)
+    return data
+
+class FakeClient:
+    prefix_url = 'https://itkpd.example/'
+
+    def __init__(self, error=None):
+        self.error = error
+        self.requests = 0
+
+    def get(self, command, json):
+        self.requests += 1
+        if self.error is not None:
+            raise self.error
+        return dict(TEST_TYPE, code=json['code'])
+
+def test_complete_payload_is_accepted():
+    warnings = []
+    assert upload_schema.validate_payload(make_data(), TEST_TYPE, warnings) == []
+    assert warnings == []
+
+@pytest.mark.parametrize('changes, problem', [
+    ({'component': ''}, 'component is required'),
+    ({'date': None}, 'date is required'),
+    ({'testType': 'MODULE_METROLOGY'}, 'testType is MODULE_METROLOGY, not MODULE_BOW'),
+    ({'passed': 'true'}, 'passed must be true or false'),
+    ({'problems': None}, 'problems must be true or false'),
+    ({'properties': {'TEMP': 21.5}}, 'property JIG is required'),
+    ({'properties': {'JIG': 7}}, 'property JIG is 7, not a string'),
+    ({'properties': {'JIG': 'JIG1', 'TEMP': 'warm'}}, "property TEMP is 'warm', not a float"),
+    ({'properties': {'JIG': 'JIG1', 'SITE': 'CERN'}}, "property SITE is 'CERN', not a codeTable"),
+    ({'results': {'BOW': True, 'PB_GLUE_THICKNESS': 1.0}}, 'result BOW is True, not a float'),
+    ({'results': {'BOW': 1.0, 'RUNS': 2.5, 'PB_GLUE_THICKNESS': 1.0}}, 'result RUNS is 2.5, not a integer'),
+    ({'results': {'BOW': 1.0, 'PB_GLUE_THICKNESS': {'P1': 1.0, 'P2': 'nan?'}}},
+     "result PB_GLUE_THICKNESS is 'nan?', not a float"),
+    ({'results': {'BOW': '', 'PB_GLUE_THICKNESS': 1.0}}, 'result BOW is required'),
+])
+def test_payload_is_rejected(changes, problem):
+    assert upload_schema.validate_payload(make_data(**changes), TEST_TYPE) == [problem]
+
+def test_unknown_and_empty_values_only_warn():
+    warnings = []
+    data = make_data(properties={'JIG': 'JIG1', 'OPERATOR': 'someone'},
+                     results={'BOW': 100.0, 'PB_GLUE_THICKNESS': None, 'FILE': 'bow.dat'})
+    assert upload_schema.validate_payload(data, TEST_TYPE, warnings) == []
+    assert warnings == ['property OPERATOR is not in the test type', 'result FILE is not in the test type',
+                        'result PB_GLUE_THICKNESS is required but has no value']
+
+def test_check_value():
+    assert upload_schema.check_value('12', {'code': 'N', 'dataType': 'integer'}) is None
+    assert upload_schema.check_value(12.0, {'code': 'N', 'dataType': 'integer'}) is None
+    assert upload_schema.check_value(False, {'code': 'N', 'dataType': 'integer'}) == 'N is False, not a integer'
+    assert upload_schema.check_value(float('inf'), {'code': 'N', 'dataType': 'integer'}) == 'N is inf, not a integer'
+    assert upload_schema.check_value([[1, 2], [3, 'x']], {'code': 'X', 'dataType': 'float'}) == \
+        "X is 'x', not a float"
+    assert upload_schema.check_value(1, {'code': 'B', 'dataType': 'boolean'}) == 'B is 1, not a boolean'
+    assert upload_schema.check_value(object, {'code': 'I', 'dataType': 'image'}) is None
+
+def test_test_type_is_cached_on_disk(tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_schema, 'PATH_TO_SCHEMAS', str(tmp_path / 'test_types.json'))
+    monkeypatch.setattr(upload_schema, 'SCHEMAS', dict())
+    client = FakeClient()
+    assert upload_schema.get_test_type(client, 'MODULE_BOW')['code'] == 'MODULE_BOW'
+    monkeypatch.setattr(upload_schema, 'SCHEMAS', dict())
+    assert upload_schema.get_test_type(client, 'MODULE_BOW')['code'] == 'MODULE_BOW'
+    assert client.requests == 1
+    # An out of date definition is still used when the ITkDB cannot be reached.
+    offline = FakeClient(ConnectionError('offline'))
+    assert upload_schema.get_test_type(offline, 'MODULE_BOW', ttl=0)['code'] == 'MODULE_BOW'
+    with pytest.raises(itkdb_session.UploadError):
+        upload_schema.get_test_type(offline, 'MODULE_METROLOGY')